@@ -19,6 +19,10 @@
 
 import os
 import re
+import hashlib
+
+# the fingerprint of a file is computed from its first and last block of this size
+FINGERPRINT_BLOCK = 1024 * 1024
 
 
 def removeNonDna(seq):
@@ -35,6 +39,27 @@ def noNewLine(line):
     return line.replace('\n', '').replace('\r', '')
 
 
+def getFileSignature(filePath):
+    """
+        Signature of the state of a file, an index or a cache derived from the file is valid as long as the signature
+        doesn't change.
+
+        @return: size, modification time, sha1 of the first and the last block of the file
+        @rtype: (int, float, str)
+    """
+    f = open(os.path.normpath(filePath), 'rb')
+    try:
+        st = os.fstat(f.fileno())
+        h = hashlib.sha1()
+        h.update(f.read(FINGERPRINT_BLOCK))
+        if st.st_size > FINGERPRINT_BLOCK:
+            f.seek(max(FINGERPRINT_BLOCK, st.st_size - FINGERPRINT_BLOCK))
+            h.update(f.read(FINGERPRINT_BLOCK))
+    finally:
+        f.close()
+    return st.st_size, st.st_mtime, h.digest()
+
+
 def createTagFilePath(dstDir, fileNameFromPath, tag):
     """
         Returns a path that results from the concatenation of dstDir and a file from filePath where the name of the file
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2015  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Reading of compressed input files (gzip, bzip2, zstd, xz), the compression is detected according to the first
+    bytes of a file. A file is decompressed by an external (multi-threaded if installed) program that writes to a pipe,
+    otherwise by the gzip or bz2 module, thus the file doesn't have to be decompressed to the disk first.
+"""
+
+import os
+import gzip
+import bz2
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+
+# compression -> magic bytes
+MAGIC = [('gzip', '\x1f\x8b'), ('bzip2', 'BZh'), ('zstd', '\x28\xb5\x2f\xfd'), ('xz', '\xfd7zXZ\x00')]
+
+# usual file name suffixes of compressed files
+SUFFIXES = ['gz', 'bz2', 'zst', 'xz']
+
+# compression -> decompression commands in the order of preference
+DECOMPRESS_COMMANDS = {'gzip': [['pigz', '-dc'], ['gzip', '-dc']],
+                       'bzip2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+                       'zstd': [['zstd', '-dcq']],
+                       'xz': [['xz', '-dc']]}
+
+# use the external programs (if installed) for decompression
+USE_EXTERNAL = True
+
+_commandCache = {}
+
+
+def getCompression(filePath):
+    """
+        @return: compression of the file (see MAGIC) or None if the file is not compressed
+    """
+    f = open(os.path.normpath(filePath), 'rb')
+    try:
+        head = f.read(6)
+    finally:
+        f.close()
+    for compression, magic in MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def openInput(filePath):
+    """
+        Opens a file for reading, a compressed file is decompressed on the fly.
+
+        @return: file like object that supports read, readline, readlines, iteration over lines and close
+    """
+    compression = getCompression(filePath)
+    if compression is None:
+        return open(os.path.normpath(filePath), 'rb')
+    command = _getCommand(compression)
+    if command is not None:
+        return PipeFile(command + [os.path.normpath(filePath)])
+    if compression == 'gzip':
+        return gzip.GzipFile(os.path.normpath(filePath), 'rb')
+    if compression == 'bzip2':
+        return bz2.BZ2File(os.path.normpath(filePath), 'rb')
+    raise IOError('Decompression of a %s file requires one of the programs: %s (%s)'
+                  % (compression, ', '.join(c[0] for c in DECOMPRESS_COMMANDS[compression]), filePath))
+
+
+def _getCommand(compression):
+    """
+        @return: the first installed decompression command or None
+    """
+    if not USE_EXTERNAL:
+        return None
+    if compression not in _commandCache:
+        _commandCache[compression] = None
+        for command in DECOMPRESS_COMMANDS[compression]:
+            if find_executable(command[0]) is not None:
+                _commandCache[compression] = command
+                break
+    return _commandCache[compression]
+
+
+class PipeFile():
+    """
+        Output of a decompression program read from a pipe.
+    """
+    def __init__(self, args):
+        self._args = args
+        # a pipe could fill up with the warnings of the program and block it, the messages are read at the end
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=self._stderr, bufsize=-1)
+        self._stdout = self._process.stdout
+
+    def read(self, size=-1):
+        data = self._stdout.read(size)
+        if len(data) == 0 and size != 0:
+            self._checkExit()
+        return data
+
+    def readline(self):
+        line = self._stdout.readline()
+        if len(line) == 0:
+            self._checkExit()
+        return line
+
+    def readlines(self, sizeHint=0):
+        lines = self._stdout.readlines(sizeHint)
+        if len(lines) == 0:
+            self._checkExit()
+        return lines
+
+    def __iter__(self):
+        for line in self._stdout:
+            yield line
+        self._checkExit()
+
+    def _checkExit(self):
+        if self._process.wait() != 0:
+            self._stderr.seek(0)
+            raise IOError('Decompression failed (exit code %s): %s [%s]'
+                          % (self._process.returncode, ' '.join(self._args), self._stderr.read().strip()))
+
+    def close(self):
+        self._stdout.close()
+        if self._process.poll() is None:
+            self._process.terminate()
+        self._process.wait()
+        self._stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        self.close()
@@ -21,11 +21,17 @@
 
 import os
 import sys
-import re
+import gc
 import types
+from operator import itemgetter
+from itertools import izip, repeat, compress
 
+from algbioi.com import compression
+from algbioi.com import seqids
 from algbioi.com.common import noNewLine
 
+_CHUNK_SIZE = 4 * 1024 * 1024  # batch parsers get the lines of a chunk of this size (in bytes)
+
 
 def getColumnAsList(fileName, entryModifyFunction=None, colNum=0, sep=None, comment='#'):
     """
@@ -86,19 +92,19 @@ class _MappingTupleParser():
         self._keyColNumTuple = keyColNumTuple
         self._valColNumTuple = valColNumTuple
         self._sep = sep
-        self._comment = comment
+        self.comment = comment
 
     def parse(self, line):
-        if not isComment(line, self._comment):
-            tokens = line.split(self._sep)
-            k = []
-            v = []
-            for i in self._keyColNumTuple:
-                k.append(tokens[i])
-            for i in self._valColNumTuple:
-                v.append(tokens[i])
-            assert tuple(k) not in self._map, "Duplicate tuple keys."
-            self._map[tuple(k)] = tuple(v)
+        if not isComment(line, self.comment):
+            self.parseLines([line])
+
+    def parseLines(self, lines):
+        keyGetter = _tupleGetter(self._keyColNumTuple)
+        valGetter = _tupleGetter(self._valColNumTuple)
+        for tokens in map(str.split, lines, repeat(self._sep, len(lines))):
+            k = keyGetter(tokens)
+            assert k not in self._map, "Duplicate tuple keys."
+            self._map[k] = valGetter(tokens)
 
     def finalize(self):
         pass
@@ -110,16 +116,27 @@ class _MappingTupleParser():
 def forEachLine(filePath, parser):
     """
         For each line of the file call the parser, at the end call the finalize method of the parser if it`s defined.
+        A compressed file (gzip, bzip2, zstd, xz) is decompressed on the fly.
+
+        A batch parser defines method "parseLines(lines)" that is called for chunks of lines (instead of "parse(line)"
+        for each line), the lines don't contain new line characters. If the parser has attribute "comment"
+        (not None), the comment lines (see function "isComment") are removed from the chunks.
     """
     try:
-        f = open(os.path.normpath(filePath), 'r')
+        f = compression.openInput(filePath)
     except Exception:
         sys.stderr.write('Cannot open a file for reading: ' + filePath)
         raise
     else:
         try:
-            for line in f:
-                parser.parse(noNewLine(line))
+            if isinstance(getattr(parser, 'parseLines', None), types.MethodType):
+                comment = getattr(parser, 'comment', None)
+                for lines in _lineChunks(f, comment):
+                    if len(lines) > 0:
+                        parser.parseLines(lines)
+            else:
+                for line in f:
+                    parser.parse(noNewLine(line))
         except Exception:
             sys.stderr.write('Cannot read from file: ' + filePath)
             raise
@@ -134,14 +151,46 @@ def forEachLine(filePath, parser):
     return parser
 
 
+def _lineChunks(f, comment=None):
+    """
+        Reads a file in chunks of lines, the same lines as if the file was read line by line and each line was passed
+        through function "noNewLine".
+
+        @param comment: comment lines that start with this substring are removed (None ~ no lines are removed)
+        @return: iterator over lists of lines
+    """
+    tail = ''
+    eof = False
+    while not eof:
+        data = f.read(_CHUNK_SIZE)
+        eof = len(data) == 0
+        text = tail + data
+        # the lists of the lines would trigger the garbage collector, which would traverse all the objects kept
+        # by the parser, thus it's disabled while a chunk is split (but not while the lines are parsed)
+        gcEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            if eof:
+                lines = [text] if len(text) > 0 else []
+            else:
+                lines = text.split('\n')
+                tail = lines.pop()
+            if '\r' in text:
+                lines = [line.replace('\r', '') for line in lines]
+            # most chunks don't contain the comment substring at all, then the lines are not tested one by one
+            if comment is not None and comment in text:
+                lines = [line for line in lines if not isComment(line, comment)]
+        finally:
+            if gcEnabled:
+                gc.enable()
+        yield lines
+
+
 def isComment(line, comment):
     """
-        Is the line a comment.
+        Is the line a comment, i.e. does it start with the comment substring after leading spaces and tabs.
     """
-    if re.match(str('[ \t]*' + comment), line):
-        return True
-    else:
-        return False
+    return line.lstrip(' \t').startswith(comment)
 
 
 class OutFileBuffer():
@@ -196,27 +245,35 @@ class _MappingParser():
         self._keyColNum = keyColNum
         self._valColNum = valColNum
         self._sep = sep
-        self._comment = comment
+        self.comment = comment
 
     def getDict(self):
         return self._dict
 
     def parse(self, line):
-        if not isComment(line, self._comment):
-            lineList = line.split(self._sep)
-            if len(lineList) > self._keyColNum and len(lineList) > self._valColNum:
-                key = lineList[self._keyColNum]
-                val = lineList[self._valColNum]
-                if key not in self._dict:
-                    tmp = []
-                    tmp.append(val)
-                    self._dict[key] = tmp
-                else:
-                    self._dict[key].append(val)
-            else:
-                if len(lineList) > 0:
+        if not isComment(line, self.comment):
+            self.parseLines([line])
+
+    def parseLines(self, lines):
+        # only the columns up to the key and the value column are split
+        maxSplit = max(self._keyColNum, self._valColNum) + 1
+        lineLists = map(str.split, lines, repeat(self._sep, len(lines)), repeat(maxSplit, len(lines)))
+        if min(map(len, lineLists)) < maxSplit:
+            validLists = []
+            for line, lineList in izip(lines, lineLists):
+                if len(lineList) >= maxSplit:
+                    validLists.append(lineList)
+                elif len(lineList) > 0:
                     print str("TabSepFileFunctions:_MappingParser: line skipped:  %s  doesn't have enough entries\n"
                               % line)
+            lineLists = validLists
+        mapping = self._dict
+        for key, val in izip(map(itemgetter(self._keyColNum), lineLists), map(itemgetter(self._valColNum), lineLists)):
+            valList = mapping.get(key)
+            if valList is None:
+                mapping[key] = [val]
+            else:
+                valList.append(val)
 
 
 class _LineConditionFilterOutLines():
@@ -250,34 +307,59 @@ class _LineFilter():
         if self.lineCondition.takeLine(line):
             self.outFileBuffer.writeText(str(line + '\n'))
 
+    def parseLines(self, lines):
+        # comment lines are not removed, the condition takes them
+        lines = list(compress(lines, map(self.lineCondition.takeLine, lines)))
+        if len(lines) > 0:
+            self.outFileBuffer.writeText('\n'.join(lines) + '\n')
+
     def finalize(self):
         self.outFileBuffer.close()
 
 
-def predToDict(predFilePath):
-    """  Reads predictions. """
-    return forEachLine(predFilePath, _PredParser()).getContigToPredDict()
+def predToDict(predFilePath, seqIdIndex=None, duplicates=seqids.LAST_WINS, stats=None, name='predToDict'):
+    """
+        Reads predictions.
+
+        @param seqIdIndex: the names are added to this index and the predictions are returned as a compact mapping
+        @type seqIdIndex: seqids.SeqIdIndex
+        @param duplicates: policy for contigs assigned more than once (see seqids.DUPLICATE_POLICIES)
+        @param stats: statistics of the assignments filled by the function (None ~ duplicates reported to stderr)
+        @type stats: seqids.AssignmentStats
+        @param name: name of the caller used in the messages about the duplicates (followed by the file name)
+        @rtype: dict or seqids.SeqIdMap (if seqIdIndex is given)
+    """
+    loader = seqids.AssignmentLoader(duplicates, seqIdIndex, stats, name + ': ' + predFilePath)
+    return forEachLine(predFilePath, _PredParser(loader)).getContigToPredDict()
 
 
 class _PredParser():
     """
         To parse the prediction file.
     """
-    def __init__(self):
-        self._dict = dict()
+    def __init__(self, loader=None):
+        """
+            @type loader: seqids.AssignmentLoader
+        """
+        if loader is None:
+            loader = seqids.AssignmentLoader()
+        self._loader = loader
+        self.comment = '#'
 
     def parse(self, line):
-        if not isComment(line, '#'):
-            lineList = line.split()
-            if len(lineList) >= 2:
-                key = lineList[0]
-                val = lineList[len(lineList) - 1]
-                if key in self._dict:
-                    sys.stderr.write('Consistency:PredParser: the contig "%s" has already been assigned' % key)
-                self._dict[key] = int(val)
+        if not isComment(line, self.comment):
+            self.parseLines([line])
+
+    def parseLines(self, lines):
+        lineLists = map(str.split, lines)
+        if min(map(len, lineLists)) < 2:
+            lineLists = [lineList for lineList in lineLists if len(lineList) >= 2]
+        keys = map(itemgetter(0), lineLists)
+        values = map(int, map(itemgetter(-1), lineLists))
+        self._loader.add(keys, values)
 
     def getContigToPredDict(self):
-        return self._dict
+        return self._loader.getMapping()
 
 
 class _ColumnEntryListBuffer():
@@ -293,16 +375,31 @@ class _ColumnEntryListBuffer():
 
     def parse(self, line):
         if not isComment(line, self.comment):  # the line is not a comment
-            lineList = line.split(self.sep)
-            if len(lineList) > self.colNum:
-                entry = lineList[self.colNum]
-                if self.entryModifyFunction is not None:
-                    entry = self.entryModifyFunction(entry)
-                self.list.append(entry)
+            self.parseLines([line])
+
+    def parseLines(self, lines):
+        # only the columns up to the entry column are split
+        lineLists = map(str.split, lines, repeat(self.sep, len(lines)), repeat(self.colNum + 1, len(lines)))
+        if min(map(len, lineLists)) <= self.colNum:
+            lineLists = [lineList for lineList in lineLists if len(lineList) > self.colNum]
+        entries = map(itemgetter(self.colNum), lineLists)
+        if self.entryModifyFunction is not None:
+            entries = map(self.entryModifyFunction, entries)
+        self.list.extend(entries)
 
     def retVal(self):
         return self.list
 
 
+def _tupleGetter(indices):
+    """
+        @return: function that returns the tuple of the entries of a list at the indices
+    """
+    if len(indices) == 1:
+        index = indices[0]
+        return lambda entries: (entries[index],)
+    return itemgetter(*indices)
+
+
 # if __name__ == "__main__":
 #     pass
\ No newline at end of file
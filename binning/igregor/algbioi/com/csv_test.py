@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2014  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Tests of the lines passed to the batch parsers.
+
+    Run from the directory that contains the "algbioi" package: python -m unittest algbioi.com.csv_test
+"""
+
+import gc
+import os
+import tempfile
+import unittest
+
+from algbioi.com import csv
+
+
+class _BatchParser():
+    def __init__(self, comment=None):
+        self.comment = comment
+        self.lines = []
+        self.gcEnabled = []
+
+    def parseLines(self, lines):
+        self.lines.extend(lines)
+        self.gcEnabled.append(gc.isenabled())
+
+
+class _LineParser():
+    def __init__(self):
+        self.lines = []
+
+    def parse(self, line):
+        self.lines.append(line)
+
+
+class TestForEachLine(unittest.TestCase):
+
+    CONTENT = 'a\tb\r\n#comment\n  # indented comment\nc\rd\te\r\r\n\nlast\r'
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, self.CONTENT)
+        os.close(fd)
+        self.chunkSize = csv._CHUNK_SIZE
+
+    def tearDown(self):
+        csv._CHUNK_SIZE = self.chunkSize
+        os.remove(self.path)
+
+    def test_lines(self):
+        # the batch parsers get the same lines as the parsers called for each line (see common.noNewLine)
+        expected = ['a\tb', '#comment', '  # indented comment', 'cd\te', '', 'last']
+        self.assertEqual(expected, csv.forEachLine(self.path, _LineParser()).lines)
+        for chunkSize in [1, 2, 5, self.chunkSize]:
+            csv._CHUNK_SIZE = chunkSize
+            self.assertEqual(expected, csv.forEachLine(self.path, _BatchParser()).lines)
+            self.assertEqual([expected[0]] + expected[3:], csv.forEachLine(self.path, _BatchParser('#')).lines)
+
+    def test_gc_enabled_while_parsing(self):
+        csv._CHUNK_SIZE = 4
+        parser = csv.forEachLine(self.path, _BatchParser())
+        self.assertTrue(len(parser.gcEnabled) > 1)
+        self.assertTrue(all(parser.gcEnabled))
+        self.assertTrue(gc.isenabled())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,9 +23,14 @@ import sys
 import os
 import re
 import types
-import gzip
+import struct
+import numpy
+from itertools import izip
 from Bio import SeqIO
 
+from algbioi.com import common
+from algbioi.com import compression
+from algbioi.com import seqids
 from algbioi.com.csv import OutFileBuffer
 from algbioi.com.common import removeNonDna
 from algbioi.com.common import noNewLine
@@ -108,11 +113,197 @@ def filterOutNonDna(inFileName, outFileName):
     _forEachRecord(inFileName, parser)
 
 
-def getSequenceToBpDict(fastaFilePath):
+_CHUNK_SIZE = 16 * 1024 * 1024  # read fasta files in chunks of this size (in bytes)
+
+# sequence length index stored next to a fasta file, see function "getSequenceLengthsIndexed"
+LENGTH_INDEX_SUFFIX = '.lenidx'
+LENGTH_INDEX_MAGIC = 'FALENIDX'
+LENGTH_INDEX_VERSION = 2  # version 1 counted the trailing tabs of the sequence lines
+# magic, version, fasta file size, fasta file mtime, fasta file fingerprint, sequence count, names length
+_LENGTH_INDEX_HEADER = struct.Struct('<8sIQd20sQQ')
+
+
+def getSequenceToBpDict(fastaFilePath, useIndex=True, seqIdIndex=None):
     """
         Reads a fasta file and returns mapping: sequenceName -> sequenceLength.
+
+        @param useIndex: use (and create) the sequence length index stored next to the fasta file
+        @param seqIdIndex: the names are added to this index and the lengths are returned as a compact mapping
+        @type seqIdIndex: seqids.SeqIdIndex
+        @rtype: dict or seqids.SeqIdMap (if seqIdIndex is given)
+    """
+    if useIndex:
+        seqIdList, seqLenArray = getSequenceLengthsIndexed(fastaFilePath)
+    else:
+        seqIdList, seqLenArray = getSequenceLengths(fastaFilePath)
+    if seqIdIndex is not None:
+        return seqids.SeqIdMap(seqIdIndex, seqIdIndex.getIds(seqIdList), seqLenArray)
+    return dict(izip(seqIdList, seqLenArray.tolist()))
+
+
+def getSequenceLengthsIndexed(fastaFilePath):
+    """
+        Returns the sequence lengths (see function "getSequenceLengths") stored in the index file
+        "fastaFilePath.lenidx", the index is (re)built if it doesn't exist or if it doesn't match the fasta file.
+        The index is valid if the size, the modification time and the fingerprint (sha1 of the first and the last
+        block) of the fasta file are the same as when the index was built. If the index cannot be written
+        (e.g. read-only directory), the lengths are just returned.
+
+        @return: list of sequence names, array of the respective sequence lengths
+        @rtype: (list of str, numpy.ndarray)
+    """
+    indexFilePath = fastaFilePath + LENGTH_INDEX_SUFFIX
+    size, mtime, fingerprint = common.getFileSignature(fastaFilePath)
+    if os.path.isfile(indexFilePath):
+        try:
+            entry = _readLengthIndex(indexFilePath, size, mtime, fingerprint)
+        except Exception as e:
+            sys.stderr.write('Cannot read the sequence length index: %s (%s)\n' % (indexFilePath, e))
+            entry = None
+        if entry is not None:
+            return entry
+
+    seqIdList, seqLenArray = getSequenceLengths(fastaFilePath)
+    # the file wasn't modified while reading
+    if common.getFileSignature(fastaFilePath) == (size, mtime, fingerprint):
+        try:
+            _writeLengthIndex(indexFilePath, size, mtime, fingerprint, seqIdList, seqLenArray)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Cannot write the sequence length index: %s (%s)\n' % (indexFilePath, e))
+    return seqIdList, seqLenArray
+
+
+def _readLengthIndex(indexFilePath, size, mtime, fingerprint):
+    """
+        @return: list of sequence names, array of the sequence lengths or None if the index doesn't match the file
+    """
+    f = open(os.path.normpath(indexFilePath), 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    magic, version, iSize, iMtime, iFingerprint, n, namesLen = _LENGTH_INDEX_HEADER.unpack_from(data, 0)
+    if magic != LENGTH_INDEX_MAGIC or version != LENGTH_INDEX_VERSION \
+            or (iSize, iMtime, iFingerprint) != (size, mtime, fingerprint):
+        return None
+    offset = _LENGTH_INDEX_HEADER.size
+    if len(data) != offset + 8 * n + namesLen:
+        raise ValueError('truncated index file')
+    seqLenArray = numpy.frombuffer(data, dtype='<i8', count=n, offset=offset).astype(numpy.int64)
+    offset += 8 * n
+    seqIdList = data[offset:offset + namesLen].split('\n') if n > 0 else []
+    if len(seqIdList) != n:
+        raise ValueError('inconsistent index file')
+    return seqIdList, seqLenArray
+
+
+def _writeLengthIndex(indexFilePath, size, mtime, fingerprint, seqIdList, seqLenArray):
+    """
+        Stores the sequence lengths, the index is written to a temporary file first and then renamed,
+        thus concurrent readers never see an incomplete index.
+        (The sequence names cannot contain white spaces, thus they are separated by new lines.)
     """
-    return _forEachRecord(fastaFilePath, SeqToBpParser()).getSeqToBpDict()
+    names = '\n'.join(seqIdList)
+    tmpFile = '%s.tmp%s' % (indexFilePath, os.getpid())
+    f = open(os.path.normpath(tmpFile), 'wb')
+    try:
+        f.write(_LENGTH_INDEX_HEADER.pack(LENGTH_INDEX_MAGIC, LENGTH_INDEX_VERSION, size, mtime, fingerprint,
+                                          len(seqIdList), len(names)))
+        f.write(numpy.asarray(seqLenArray, dtype='<i8').tostring())
+        f.write(names)
+    except:
+        f.close()
+        os.remove(tmpFile)
+        raise
+    f.close()
+    os.rename(tmpFile, indexFilePath)
+
+
+def getSequenceLengths(fastaFilePath):
+    """
+        Reads the sequence lengths from a fasta file (can be compressed, see compression.openInput), the sequences
+        are not parsed, only the bytes between the headers are counted (except for spaces, carriage returns and
+        the white spaces at the ends of the lines), thus the sequence names and lengths are the same as if the file
+        was read via SeqIO.
+
+        @return: list of sequence names, array of the respective sequence lengths
+        @rtype: (list of str, numpy.ndarray)
+    """
+    seqIdList = []
+    seqLenList = []
+    try:
+        f = compression.openInput(fastaFilePath)
+    except Exception:
+        sys.stderr.write('Cannot open a fasta file for reading: ' + fastaFilePath + '\n')
+        raise
+    try:
+        name = None  # name of the current record (None ~ before the first record)
+        length = 0
+        inHeader = False
+        data = '\n'  # each header is preceded by a new line
+        pos = 0
+        eof = False
+        while not eof:
+            chunk = f.read(_CHUNK_SIZE)
+            eof = len(chunk) == 0
+            data = data[pos:] + chunk
+            pos = 0
+            # most files contain neither spaces nor carriage returns, these are counted only if present
+            hasCr = data.count('\r') > 0
+            hasSpace = data.count(' ') > 0
+            # other white spaces are only removed at the ends of the lines (as SeqIO does), the lines are then
+            # counted one by one
+            hasOtherSpace = data.count('\t') > 0 or data.count('\x0b') > 0 or data.count('\x0c') > 0
+            while True:
+                if inHeader:  # data[pos] == '>'
+                    end = data.find('\n', pos)
+                    if end == -1:
+                        if not eof:
+                            break  # read the rest of the header
+                        end = len(data)
+                    title = data[pos + 1:end].split(None, 1)
+                    name = title[0] if len(title) > 0 else ''
+                    length = 0
+                    inHeader = False
+                    pos = end
+                else:
+                    end = data.find('\n>', pos)
+                    header = end != -1
+                    if not header:
+                        if eof:
+                            end = len(data)
+                        elif hasOtherSpace:
+                            # only complete lines, the rest is read with the next chunk
+                            end = max(pos, data.rfind('\n', pos))
+                        else:
+                            # the last character can be the end of line that precedes the next header
+                            end = max(pos, len(data) - 1)
+                    if hasOtherSpace:
+                        length += sum(len(line.rstrip().replace(' ', '').replace('\r', ''))
+                                      for line in data[pos:end].split('\n'))
+                    else:
+                        length += (end - pos) - data.count('\n', pos, end)
+                        if hasCr:
+                            length -= data.count('\r', pos, end)
+                        if hasSpace:
+                            length -= data.count(' ', pos, end)
+                    pos = end
+                    if not header:
+                        if eof and name is not None:
+                            seqIdList.append(name)
+                            seqLenList.append(length)
+                        break
+                    if name is not None:
+                        seqIdList.append(name)
+                        seqLenList.append(length)
+                    inHeader = True
+                    pos = end + 1
+    except Exception:
+        sys.stderr.write('Cannot read from a fasta file: ' + fastaFilePath + '\n')
+        raise
+    finally:
+        f.close()
+    return seqIdList, numpy.array(seqLenList, dtype=numpy.int64)
 
 
 class SeqToBpParser():
@@ -238,10 +429,7 @@ def fastaFileToDictWholeNames(filePath):
     seqIdToSeq = {}
     f = None
     try:
-        if filePath.endswith('.gz'):
-            f = gzip.open(os.path.normpath(filePath), mode='r')
-        else:
-            f = open(os.path.normpath(filePath), 'r')
+        f = compression.openInput(filePath)
     except Exception:
         print "Cannot open file:", filePath
         raise
@@ -292,7 +480,7 @@ def _forEachRecord(filePath, parser, formatName="fasta"):
     except Exception:
         pass
     try:
-        f = open(os.path.normpath(filePath), 'r')
+        f = compression.openInput(filePath)
     except Exception:
         sys.stderr.write('Cannot open a ' + formatName + ' file for reading: ' + filePath + '\n')
         raise
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2014  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Tests of the sequence lengths read by the chunk scanner against SeqIO.
+
+    Run from the directory that contains the "algbioi" package: python -m unittest algbioi.com.fasta_test
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from algbioi.com import fasta
+
+
+def _randomFasta(rnd, count, whiteSpaces):
+    """
+        @param whiteSpaces: characters inserted into the sequence lines (and appended to them)
+        @return: content of a fasta file
+    """
+    records = []
+    for i in range(count):
+        lines = ['>seq%s description %s' % (i, i)]
+        for j in range(rnd.randint(0, 6)):
+            line = [rnd.choice('ACGTN' + whiteSpaces) for k in range(rnd.randint(0, 30))]
+            if rnd.random() < 0.5:
+                line.append(rnd.choice(whiteSpaces) * rnd.randint(1, 3))
+            lines.append(''.join(line))
+        records.append('\n'.join(lines))
+    return '\n'.join(records) + rnd.choice(['', '\n'])
+
+
+class TestSequenceLengths(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.chunkSize = fasta._CHUNK_SIZE
+
+    def tearDown(self):
+        fasta._CHUNK_SIZE = self.chunkSize
+        shutil.rmtree(self.tmpDir)
+
+    def _check(self, content):
+        path = os.path.join(self.tmpDir, 'seq.fna')
+        f = open(path, 'wb')
+        f.write(content)
+        f.close()
+        expected = fasta.getSequencesToList(path)
+        for chunkSize in [1, 2, 7, 64, self.chunkSize]:
+            fasta._CHUNK_SIZE = chunkSize
+            seqIdList, seqLenArray = fasta.getSequenceLengths(path)
+            self.assertEqual([(name, len(seq)) for name, seq in expected], zip(seqIdList, seqLenArray.tolist()))
+
+    def test_plain(self):
+        rnd = random.Random(1)
+        for i in range(20):
+            self._check(_randomFasta(rnd, 10, ' \r'))
+
+    def test_tabs(self):
+        # SeqIO removes the trailing white spaces of the lines but keeps the tabs inside the lines
+        self._check('>a\nAC\t\t\nG\tT\t\n\t\n>b x\n\tA \r\n>c\n\x0bA\x0c\n')
+        rnd = random.Random(2)
+        for i in range(20):
+            self._check(_randomFasta(rnd, 10, ' \t\r\x0b\x0c'))
+
+    def test_index_matches(self):
+        path = os.path.join(self.tmpDir, 'seq.fna')
+        f = open(path, 'wb')
+        f.write('>a\nACG\t\n>b\nA\tC\n')
+        f.close()
+        self.assertEqual({'a': 3, 'b': 3}, fasta.getSequenceToBpDict(path, useIndex=False))
+        for i in range(2):  # build and read the index
+            self.assertEqual({'a': 3, 'b': 3}, fasta.getSequenceToBpDict(path))
+        self.assertTrue(os.path.isfile(path + fasta.LENGTH_INDEX_SUFFIX))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,8 @@ import os
 import time
 import sys
 
+from algbioi.com import taxonomy_ncbi
+
 
 def get_answer_timeout():
     start_time = time.time()  # this is time in seconds
@@ -35,6 +37,53 @@ def get_answer_timeout():
             return "n"
 
 
+def _read_nodes(dmp):
+    """
+        Streams the nodes.dmp file.
+
+        @return: generator of tuples (ncbi_taxon_id, parent_ncbi_taxon_id, rank)
+    """
+    fr = open(os.path.join(dmp, "nodes.dmp"))
+    try:
+        for line in fr:
+            values = line.split("\t|\t", 3)
+            if len(values) < 3:
+                continue
+            yield int(values[0]), int(values[1]), values[2].rstrip("\t|\r\n")
+    finally:
+        fr.close()
+
+
+def _read_names(dmp):
+    """
+        Streams the names.dmp file.
+
+        @return: generator of tuples (ncbi_taxon_id, name, name_class)
+    """
+    fr = open(os.path.join(dmp, "names.dmp"))
+    try:
+        for line in fr:
+            values = line.split("\t|\t", 4)
+            if len(values) < 4:
+                continue
+            yield int(values[0]), values[1], values[3].rstrip("\t|\r\n")
+    finally:
+        fr.close()
+
+
+def _connect_bulk(db_file):
+    """
+        Opens a new database tuned for the bulk load (no rollback journal, no syncing),
+        the database must be rebuilt from scratch if the load fails.
+    """
+    db = sqlite3.connect(db_file)
+    db.text_factory = str  # the names are stored as utf-8 encoded strings without decoding them first
+    db.execute("PRAGMA journal_mode=OFF;")
+    db.execute("PRAGMA synchronous=OFF;")
+    db.execute("PRAGMA cache_size=-262144;")  # 256MB
+    return db
+
+
 def build_database(args):
     """
             TABLE taxon
@@ -46,70 +95,60 @@ def build_database(args):
                 taxon_id    same as in TABLE taxon
                 name        the taxons name at given namespace
                 name_class  e.g. 'scientific name'
+
+        Each dump is parsed in one streaming pass and loaded with parameterized bulk inserts in one transaction,
+        the indices are created after the load. The database file is removed if the load fails.
     """
     if os.path.isfile(args.db):
         database_exists()
     # create a new database
-    db = sqlite3.connect(args.db)
-    cursor = db.cursor()
-    # specify tables in the database
-    taxon_table = "CREATE TABLE taxon(" \
-                  "taxon_id INTEGER PRIMARY KEY AUTOINCREMENT," \
-                  "ncbi_taxon_id INTEGER," \
-                  "parent_taxon_id  INTEGER," \
-                  "node_rank TEXT," \
-                  "UNIQUE (ncbi_taxon_id));"
-    cursor.execute(taxon_table)
-    cursor.execute("CREATE INDEX taxparent ON taxon(parent_taxon_id);")
-    name_table = "CREATE TABLE taxon_name(" \
-                 "taxon_id INTEGER," \
-                 "name TEXT NOT NULL," \
-                 "name_class TEXT NOT NULL," \
-                 "UNIQUE (taxon_id, name, name_class));"
-    cursor.execute(name_table)
+    db = _connect_bulk(args.db)
+    try:
+        cursor = db.cursor()
+        # specify tables in the database
+        taxon_table = "CREATE TABLE taxon(" \
+                      "taxon_id INTEGER PRIMARY KEY AUTOINCREMENT," \
+                      "ncbi_taxon_id INTEGER," \
+                      "parent_taxon_id  INTEGER," \
+                      "node_rank TEXT);"
+        cursor.execute(taxon_table)
+        name_table = "CREATE TABLE taxon_name(" \
+                     "taxon_id INTEGER," \
+                     "name TEXT NOT NULL," \
+                     "name_class TEXT NOT NULL," \
+                     "UNIQUE (taxon_id, name, name_class));"
+        cursor.execute(name_table)
+        db.commit()
 
-    print "Processing nodes.dmp... "
-    # read the ncbi dumps and populate the database
-    # first load the nodes.dmp as we will need it for names.dmp
-    # using parameterized queries for performance
-    # examples at http://rosettacode.org/wiki/Parametrized_SQL_statement
-    fr = open(os.path.join(args.dmp, "nodes.dmp"))
-    for line in fr:
-        line = line.strip()
-        if line == "":
-            continue
-        values = line.split("|", 3)
-
-        nid = values[0].strip("\t")
-        pid = values[1].strip("\t")
-        rank = values[2].strip("\t")
-        insert_taxon = "INSERT INTO taxon (ncbi_taxon_id, parent_taxon_id, node_rank) " \
-                       "VALUES({ncbi_id},{parent_id},'{rank}')".format(ncbi_id=nid, parent_id=pid, rank=rank)
-        cursor.execute(insert_taxon)
-    fr.close()
-    print "Done."
+        print "Processing nodes.dmp... "
+        # read the ncbi dumps and populate the database
+        # first load the nodes.dmp as we will need it for names.dmp
+        # taxon_id is assigned here (as AUTOINCREMENT would do) so that names.dmp can be mapped without any SELECT
+        ncbi_to_taxon_id = {}
 
-    print "Processing names.dmp... "
-    fr = open(os.path.join(args.dmp, "names.dmp"))
-    for line in fr:
-        line = line.strip()
-        if line == "":
-            continue
-        values = line.split("|", 4)
-        ncbi_taxon_id = values[0].strip("\t")
-        cursor.execute('SELECT taxon_id FROM taxon T WHERE T.ncbi_taxon_id=?', (ncbi_taxon_id,))
-        result = cursor.fetchall()
-        taxon_id = str(result[0][0])
-        name = values[1].strip("\t")
-        if "\'" in name:
-            name = name.replace('\'', "\'\'")   # assuming '' in sql has same effect as \' in python
-        name_class = values[3].strip("\t")
-        insert_taxon_name = "INSERT OR IGNORE INTO taxon_name VALUES({taxid},'{name}','{name_class}')".format(
-            taxid=taxon_id, name=name, name_class=name_class)
-        cursor.execute(insert_taxon_name)
-
-    fr.close()
-    db.commit()
+        def taxon_rows():
+            for taxon_id, (nid, pid, rank) in enumerate(_read_nodes(args.dmp), start=1):
+                ncbi_to_taxon_id[nid] = taxon_id
+                yield taxon_id, nid, pid, rank
+
+        cursor.executemany("INSERT INTO taxon (taxon_id, ncbi_taxon_id, parent_taxon_id, node_rank) VALUES(?,?,?,?)",
+                           taxon_rows())
+        print "Done."
+
+        print "Processing names.dmp... "
+        cursor.executemany("INSERT OR IGNORE INTO taxon_name VALUES(?,?,?)",
+                           ((ncbi_to_taxon_id[nid], name, name_class)
+                            for nid, name, name_class in _read_names(args.dmp)))
+        db.commit()
+
+        cursor.execute("CREATE UNIQUE INDEX taxncbi ON taxon(ncbi_taxon_id);")
+        cursor.execute("CREATE INDEX taxparent ON taxon(parent_taxon_id);")
+        db.commit()
+    except:
+        # a partially loaded database (e.g. a duplicate ncbi taxon id in nodes.dmp) must not be left behind
+        db.close()
+        os.remove(args.db)
+        raise
     db.close()
     print "Done."
 
@@ -162,14 +201,13 @@ def build_database_simple(args):
                 parent_taxon_id     ncbi id of the taxons parent
                 rank                the taxons rank
                 scientific_name     the taxons name at given namespace
-        Todo: read in dict first, then create db
     """
 
     if os.path.isfile(args.db):
         database_exists(checkold=False)
 
     # create a new database
-    db = sqlite3.connect(args.db)
+    db = _connect_bulk(args.db)
     cursor = db.cursor()
     # specify table in the database
     taxon_table = "CREATE TABLE taxon_simple(" \
@@ -178,50 +216,55 @@ def build_database_simple(args):
                   "rank TEXT NOT NULL," \
                   "scientific_name TEXT);"
     cursor.execute(taxon_table)
-    cursor.execute("CREATE INDEX taxon_simple_parent_index ON taxon_simple(parent_ncbi_taxon_id)")
+    db.commit()
 
     taxon_parent_dict = {}
     taxon_rank_dict = {}
     print "Processing nodes.dmp... "
     # read the ncbi dumps and populate the database
     # first load the nodes.dmp as we will need it for names.dmp
-    fr = open(os.path.join(args.dmp, "nodes.dmp"))
-    for line in fr:
-        if line == "":
-            continue
-        values = line.split("|")[0:3]
-        taxonid = values[0].strip("\t")
-        taxon_parent_dict[taxonid] = values[1].strip("\t")
-        taxon_rank_dict[taxonid] = values[2].strip("\t")
-    fr.close()
+    for nid, pid, rank in _read_nodes(args.dmp):
+        taxon_parent_dict[nid] = pid
+        taxon_rank_dict[nid] = rank
     print "Done."
 
     print "Processing names.dmp... "
-    fr = open(os.path.join(args.dmp, "names.dmp"))
-    for line in fr:
-        if line == "":
-            continue
-        values = line.strip().split("|")
-        name_class = values[3].strip("\t")
-        # store scientific names only
-        if name_class == 'scientific name':
-            ncbi_taxon_id = values[0].strip("\t")
-            name = values[1].strip("\t")
-            if "\'" in name:
-                name = name.replace('\'', "\'\'")   # assuming '' in sql has same effect as \' in python
-            insert_taxon = "INSERT INTO taxon_simple (ncbi_taxon_id, parent_ncbi_taxon_id, rank, scientific_name)" \
-                           " VALUES({nid},{pid},'{rank}','{name}')".format(nid=ncbi_taxon_id,
-                                                                  pid=taxon_parent_dict[ncbi_taxon_id],
-                                                                  rank=taxon_rank_dict[ncbi_taxon_id],
-                                                                  name=name)
-            cursor.execute(insert_taxon)
-
-    fr.close()
+    # store scientific names only
+    cursor.executemany("INSERT INTO taxon_simple (ncbi_taxon_id, parent_ncbi_taxon_id, rank, scientific_name)"
+                       " VALUES(?,?,?,?)",
+                       ((nid, taxon_parent_dict[nid], taxon_rank_dict[nid], name)
+                        for nid, name, name_class in _read_names(args.dmp) if name_class == 'scientific name'))
+    db.commit()
+    cursor.execute("CREATE INDEX taxon_simple_parent_index ON taxon_simple(parent_ncbi_taxon_id)")
     db.commit()
     db.close()
     print "Done."
 
 
+def build_snapshot(args):
+    """
+        Builds a binary snapshot of the taxonomy (see taxonomy_ncbi.buildSnapshot) directly from the dump files,
+        it is stored at args.db and can be used instead of the sqlite3 database.
+    """
+    ncbidList = []
+    parentList = []
+    rankList = []
+    print "Processing nodes.dmp... "
+    for nid, pid, rank in _read_nodes(args.dmp):
+        ncbidList.append(nid)
+        parentList.append(pid)
+        rankList.append(rank)
+    print "Done."
+
+    print "Processing names.dmp... "
+    ncbidToName = {}
+    for nid, name, name_class in _read_names(args.dmp):
+        if name_class == 'scientific name':
+            ncbidToName[nid] = name
+    taxonomy_ncbi.buildSnapshot(args.db, ncbidList, parentList, rankList, ncbidToName)
+    print "Done."
+
+
 def download_dumps(args):
     print "\tdownloading dump files..."  # TODO: use python, not wget, to download and only extract required files
 
@@ -253,6 +296,8 @@ if __name__ == "__main__":
     parser.add_argument("-db", help="filename for the SQLite database", action='store', required=True)
     parser.add_argument('-y', help="automatically set answers to 'yes'", action='store_true', default=False)
     parser.add_argument('-s', help="build a more simple variant of the database", action='store_true', default=False)
+    parser.add_argument('-m', help="build a binary (memory-mappable) snapshot of the taxonomy instead of the database",
+                        action='store_true', default=False)
     args = parser.parse_args()
 
     if not os.path.isfile(os.path.join(args.dmp, "nodes.dmp")) or not os.path.isfile(os.path.join(args.dmp, "names.dmp")):
@@ -269,7 +314,9 @@ if __name__ == "__main__":
             sys.stderr.write("\nPlease provide correct directory name with NCBI taxonomy dump files.\n")
             sys.exit(1)
 
-    if args.s:
+    if args.m:
+        build_snapshot(args)
+    elif args.s:
         build_database_simple(args)
     else:
         build_database(args)
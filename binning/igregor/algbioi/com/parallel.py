@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2015  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Runs independent tasks in a pool of forked processes.
+"""
+
+import sys
+import multiprocessing
+
+# task function and tasks of the running pool, the forked worker processes inherit them
+_taskFunc = None
+_taskList = None
+
+
+def _runTask(taskIdx):
+    return _taskFunc(_taskList[taskIdx])
+
+
+def runForked(taskFunc, taskList, jobs=1):
+    """
+        Calls "taskFunc(task)" for each task in the list using a pool of "jobs" processes.
+
+        The worker processes are forked after the tasks are defined, thus all data that the task function
+        uses (e.g. objects it is bound to, numpy arrays, a memory-mapped taxonomy) are shared read-only with
+        the workers (copy-on-write) and only the task indices and the results are pickled.
+        The results are returned in the order of the tasks, thus the output doesn't depend on the scheduling.
+
+        @param taskFunc: function that takes one task, its result must be picklable
+        @param taskList: list of tasks
+        @param jobs: number of processes (1 ~ the tasks are run in this process)
+        @return: list of results
+        @rtype: list
+    """
+    global _taskFunc, _taskList
+    if jobs is None or jobs <= 1 or len(taskList) <= 1:
+        return [taskFunc(task) for task in taskList]
+
+    assert _taskFunc is None, 'parallel.runForked: pools cannot be nested'
+    sys.stdout.flush()
+    sys.stderr.flush()
+    _taskFunc = taskFunc
+    _taskList = taskList
+    try:
+        pool = multiprocessing.Pool(min(jobs, len(taskList)))
+        try:
+            return pool.map(_runTask, range(len(taskList)), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _taskFunc = None
+        _taskList = None
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2014  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Compact mappings keyed by sequence names.
+
+    The loaders of the sequence lengths and of the assignments (fasta.getSequenceToBpDict, csv.predToDict,
+    cami.readAssignments) build a dictionary per file, thus each name is stored once per file, and each value is
+    a separate object. Given a shared index (SeqIdIndex), each name is stored once and mapped to a dense id,
+    the values of a mapping (SeqIdMap) are stored in an array indexed by the ids.
+
+    The assignments are collected by an AssignmentLoader that resolves the sequences assigned more than once
+    according to a policy (see DUPLICATE_POLICIES) and counts the duplicates and the conflicts.
+"""
+
+import sys
+import numpy
+from operator import is_
+from itertools import izip, imap, repeat, compress
+
+# policies for sequences assigned more than once
+FIRST_WINS = 'first'  # keep the first assignment
+LAST_WINS = 'last'  # keep the last assignment
+ERROR = 'error'  # raise DuplicateAssignmentError
+MULTI_LABEL = 'multi'  # keep the list of all different assignments (only for dictionaries)
+DUPLICATE_POLICIES = (FIRST_WINS, LAST_WINS, ERROR, MULTI_LABEL)
+
+# number of sequences assigned more than once that are listed in the statistics
+MAX_EXAMPLES = 5
+
+
+class SeqIdIndex():
+    """
+        Index of sequence names, name -> dense id (0, 1, ...). The ids of the names never change,
+        new names get the next ids.
+    """
+    def __init__(self):
+        self._nameToId = {}
+        self._names = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._nameToId
+
+    def getId(self, name):
+        """
+            @return: id of the name or None if the name isn't indexed
+            @rtype: int
+        """
+        return self._nameToId.get(name, None)
+
+    def getName(self, seqId):
+        """
+            @rtype: str
+        """
+        return self._names[seqId]
+
+    def getNames(self, ids=None):
+        """
+            @param ids: ids of the names (None ~ all names in the order of the ids)
+            @rtype: list of str
+        """
+        if ids is None:
+            return self._names
+        return map(self._names.__getitem__, ids)
+
+    def getIds(self, names):
+        """
+            Gets the ids of the names, the names that aren't indexed are added.
+
+            @type names: list of str
+            @rtype: numpy.ndarray
+        """
+        nameToId = self._nameToId
+        ids = map(nameToId.get, names)
+        if None not in ids:
+            return numpy.array(ids, dtype=numpy.int64)
+        if ids.count(None) == len(ids):
+            newNames = names
+        else:
+            newNames = list(compress(names, imap(is_, ids, repeat(None))))
+        # the new names are added at once, a repeated name gets the id of its first occurrence
+        firstPos = dict(izip(reversed(newNames), xrange(len(newNames) - 1, -1, -1)))
+        if len(firstPos) < len(newNames):
+            firstPos = numpy.fromiter(firstPos.itervalues(), dtype=numpy.int64, count=len(firstPos))
+            newNames = map(newNames.__getitem__, numpy.sort(firstPos).tolist())
+        start = len(self._names)
+        nameToId.update(izip(newNames, xrange(start, start + len(newNames))))
+        self._names.extend(newNames)
+        if len(newNames) == len(names):
+            return numpy.arange(start, start + len(names), dtype=numpy.int64)
+        return numpy.array(map(nameToId.get, names), dtype=numpy.int64)
+
+    def lookup(self, names):
+        """
+            Gets the ids of the names without adding new names.
+
+            @type names: list of str
+            @return: ids of the names (-1 ~ not indexed)
+            @rtype: numpy.ndarray
+        """
+        get = self._nameToId.get
+        return numpy.array([get(name, -1) for name in names], dtype=numpy.int64)
+
+
+class SeqIdMap():
+    """
+        Mapping, sequence name -> integer (e.g. sequence length or taxon id) that supports the read methods
+        of a dictionary used by the evaluation scripts. The values are stored in an array indexed by
+        the ids of a SeqIdIndex that can be shared by several mappings.
+    """
+    def __init__(self, seqIdIndex, ids=None, values=None, dtype=numpy.int64):
+        """
+            @type seqIdIndex: SeqIdIndex
+            @param ids: ids of the sequences (see SeqIdIndex.getIds)
+            @param values: values of the sequences, the last value of an id is kept
+        """
+        self._index = seqIdIndex
+        self._values = numpy.zeros(0, dtype=dtype)
+        self._defined = numpy.zeros(0, dtype=bool)
+        self._len = 0
+        if ids is not None:
+            self.assign(ids, values)
+
+    def getIndex(self):
+        """
+            @rtype: SeqIdIndex
+        """
+        return self._index
+
+    def assign(self, ids, values):
+        """
+            Sets the values of the sequences, the last value of an id is kept.
+
+            @param ids: ids of the sequences (see SeqIdIndex.getIds)
+            @param values: values of the sequences
+            @return: ids (in the input order) that already had a value or that are repeated in the input
+            @rtype: list of int
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        values = numpy.asarray(values, dtype=self._values.dtype)
+        if len(ids) == 0:
+            return []
+        size = int(ids.max()) + 1
+        if size > len(self._values):
+            # grow geometrically, the mappings are typically filled in batches
+            size = max(size, len(self._index), 2 * len(self._values))
+            self._values = numpy.resize(self._values, size)
+            self._defined = numpy.concatenate((self._defined, numpy.zeros(size - len(self._defined), dtype=bool)))
+        if len(numpy.unique(ids)) == len(ids) and not self._defined[ids].any():
+            reassigned = []
+        else:
+            seen = set()
+            reassigned = []
+            for seqId, hasValue in izip(ids.tolist(), self._defined[ids].tolist()):
+                if hasValue or seqId in seen:
+                    reassigned.append(seqId)
+                seen.add(seqId)
+            # with repeated ids, the last value of an id is kept
+            last = len(ids) - 1 - numpy.unique(ids[::-1], return_index=True)[1]
+            ids = ids[last]
+            values = values[last]
+        self._len += int(len(ids) - self._defined[ids].sum())
+        self._values[ids] = values
+        self._defined[ids] = True
+        return reassigned
+
+    def getArray(self, names, missing=-1):
+        """
+            Gets the values of the sequences as an array.
+
+            @param names: names of the sequences
+            @param missing: value of the sequences that have no value
+            @return: values aligned with the names, whether the sequences have a value
+            @rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        ids = self._index.lookup(names)
+        defined = self.hasValues(ids)
+        values = numpy.empty(len(ids), dtype=self._values.dtype)
+        values.fill(missing)
+        values[defined] = self._values[ids[defined]]
+        return values, defined
+
+    def hasValues(self, ids):
+        """
+            @param ids: ids of the sequences (-1 ~ not indexed)
+            @return: whether the sequences have a value
+            @rtype: numpy.ndarray
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        defined = (ids >= 0) & (ids < len(self._defined))
+        defined[defined] = self._defined[ids[defined]]
+        return defined
+
+    def getIdArray(self):
+        """
+            @return: ids of the sequences that have a value, in the order of keys()
+            @rtype: numpy.ndarray
+        """
+        return numpy.nonzero(self._defined)[0]
+
+    def getValueArray(self):
+        """
+            @return: values in the order of keys()
+            @rtype: numpy.ndarray
+        """
+        return self._values[self._defined]
+
+    def getById(self, seqId, default=None):
+        """
+            @return: value of the sequence with the given id
+        """
+        if seqId >= len(self._defined) or not self._defined[seqId]:
+            return default
+        return self._values[seqId].item()
+
+    def _getSeqId(self, name):
+        seqId = self._index.getId(name)
+        if seqId is None or seqId >= len(self._defined) or not self._defined[seqId]:
+            return None
+        return seqId
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, name):
+        return self._getSeqId(name) is not None
+
+    has_key = __contains__
+
+    def __getitem__(self, name):
+        seqId = self._getSeqId(name)
+        if seqId is None:
+            raise KeyError(name)
+        return self._values[seqId].item()
+
+    def get(self, name, default=None):
+        seqId = self._getSeqId(name)
+        if seqId is None:
+            return default
+        return self._values[seqId].item()
+
+    def keys(self):
+        return self._index.getNames(self.getIdArray().tolist())
+
+    def values(self):
+        return self.getValueArray().tolist()
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return izip(self.keys(), self.values())
+
+
+class DuplicateAssignmentError(ValueError):
+    """
+        A sequence is assigned more than once (see policy ERROR).
+    """
+    pass
+
+
+class AssignmentStats():
+    """
+        Statistics of the loaded assignments.
+    """
+    def __init__(self):
+        self.entries = 0  # all assignments
+        self.duplicates = 0  # assignments of already assigned sequences
+        self.conflicts = 0  # duplicates with a different taxon than the assignment kept before
+        self.duplicateSeqCount = 0  # sequences assigned more than once
+        self.examples = []  # names of the first sequences assigned more than once
+
+    def __str__(self):
+        return '%s assignments, %s sequences assigned more than once (%s duplicate assignments, %s conflicting)' % (
+            self.entries, self.duplicateSeqCount, self.duplicates, self.conflicts)
+
+
+class AssignmentLoader():
+    """
+        Collects the assignments (sequence name -> taxon id) in batches. The sequences assigned more than once
+        are resolved according to the policy, the duplicates are counted and reported by one message.
+    """
+    def __init__(self, policy=LAST_WINS, seqIdIndex=None, stats=None, name='AssignmentLoader'):
+        """
+            @param policy: policy for sequences assigned more than once (see DUPLICATE_POLICIES)
+            @param seqIdIndex: the names are added to this index and the assignments are collected in a SeqIdMap
+            @type seqIdIndex: SeqIdIndex
+            @param stats: statistics filled by the loader, if None, the duplicates are reported to stderr
+            @type stats: AssignmentStats
+            @param name: name used in the messages (e.g. the name of the file)
+        """
+        if policy not in DUPLICATE_POLICIES:
+            raise ValueError('Unknown duplicate policy "%s", use one of: %s' % (policy, ', '.join(DUPLICATE_POLICIES)))
+        if policy == MULTI_LABEL and seqIdIndex is not None:
+            raise ValueError('A compact mapping cannot store multiple assignments of a sequence')
+        self._policy = policy
+        self._seqIdIndex = seqIdIndex
+        self._report = stats is None
+        self._stats = AssignmentStats() if stats is None else stats
+        self._name = name
+        self._duplicateSeqs = set()
+        if seqIdIndex is None:
+            self._mapping = {}
+        else:
+            self._mapping = SeqIdMap(seqIdIndex)
+
+    def add(self, names, values):
+        """
+            Adds a batch of assignments.
+
+            @type names: list of str
+            @param values: taxon ids of the sequences
+            @type values: list
+        """
+        self._stats.entries += len(names)
+        if self._seqIdIndex is not None:
+            ids = self._seqIdIndex.getIds(names)
+            values = numpy.asarray(values, dtype=numpy.int64)
+            # the first assignments of new sequences are stored at once, only the duplicates are resolved one by one
+            new = ~self._mapping.hasValues(ids)
+            first = numpy.zeros(len(ids), dtype=bool)
+            first[numpy.unique(ids, return_index=True)[1]] = True
+            new &= first
+            self._mapping.assign(ids[new], values[new])
+            if not new.all():
+                duplicate = ~new
+                resolved = {}
+                self._resolve(ids[duplicate].tolist(), values[duplicate].tolist(), resolved, self._mapping.getById)
+                self._mapping.assign(resolved.keys(), resolved.values())
+            return
+        mapping = self._mapping
+        if self._policy == MULTI_LABEL:
+            values = [[value] for value in values]
+        if len(set(names)) == len(names) and not any(map(mapping.__contains__, names)):
+            mapping.update(izip(names, values))
+        else:
+            self._resolve(names, values, mapping)
+
+    def _resolve(self, keys, values, resolved, getOld=None):
+        """
+            Adds the assignments one by one, resolves and counts the duplicates.
+
+            @param keys: names or ids of the sequences
+            @param resolved: the resulting values are stored in this dictionary
+            @param getOld: returns the value of a key assigned in the previous batches (if not in "resolved")
+        """
+        stats = self._stats
+        policy = self._policy
+        for key, value in izip(keys, values):
+            old = resolved.get(key)
+            if old is None and getOld is not None:
+                old = getOld(key)
+            if old is None:
+                resolved[key] = value
+                continue
+            stats.duplicates += 1
+            if policy == MULTI_LABEL:
+                conflict = value[0] not in old
+            else:
+                conflict = old != value
+            if conflict:
+                stats.conflicts += 1
+            name = key if self._seqIdIndex is None else self._seqIdIndex.getName(key)
+            if name not in self._duplicateSeqs:
+                self._duplicateSeqs.add(name)
+                stats.duplicateSeqCount += 1
+                if len(stats.examples) < MAX_EXAMPLES:
+                    stats.examples.append(name)
+            if policy == ERROR:
+                raise DuplicateAssignmentError('%s: the sequence "%s" is assigned more than once' % (self._name, name))
+            elif policy == LAST_WINS:
+                resolved[key] = value
+            elif policy == FIRST_WINS:
+                resolved[key] = old
+            elif conflict:
+                resolved[key] = old + value
+
+    def getMapping(self):
+        """
+            @return: mapping, sequence name -> taxon id (a list of taxon ids for policy MULTI_LABEL)
+            @rtype: dict or SeqIdMap
+        """
+        if self._report and self._stats.duplicates > 0:
+            sys.stderr.write('%s: %s (policy: %s), e.g.: %s\n' % (self._name, self._stats, self._policy,
+                                                                   ', '.join(self._stats.examples)))
+        return self._mapping
+
+
+def isMapping(obj):
+    """
+        @return: whether the object is a mapping of sequence names (a dictionary or a SeqIdMap)
+        @rtype: bool
+    """
+    return isinstance(obj, (dict, SeqIdMap))
+
+
+def getArray(mapping, names, missing=-1):
+    """
+        Gets the (integer) values of the sequences as an array (see SeqIdMap.getArray).
+
+        @param mapping: sequence name -> value (an int or a string representing an int)
+        @type mapping: dict or SeqIdMap
+        @param names: names of the sequences
+        @param missing: value of the sequences that have no value
+        @return: values aligned with the names, whether the sequences have a value
+        @rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    if isinstance(mapping, SeqIdMap):
+        return mapping.getArray(names, missing)
+    values = map(mapping.get, names)
+    defined = numpy.fromiter(imap(is_, values, repeat(None)), dtype=bool, count=len(values))
+    numpy.logical_not(defined, defined)
+    if not defined.all():
+        values = [missing if v is None else v for v in values]
+    return numpy.fromiter(values, dtype=numpy.int64, count=len(values)), defined
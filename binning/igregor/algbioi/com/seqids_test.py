@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2014  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Tests of the sequence name index and the compact mappings.
+
+    Run from the directory that contains the "algbioi" package: python -m unittest algbioi.com.seqids_test
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from algbioi.com import csv
+from algbioi.com import seqids
+from algbioi.com.seqids import SeqIdIndex, SeqIdMap, AssignmentLoader, AssignmentStats, DuplicateAssignmentError
+
+
+class TestSeqIdIndex(unittest.TestCase):
+
+    def test_ids_in_order_of_first_occurrence(self):
+        index = SeqIdIndex()
+        self.assertEqual([0, 1, 2], index.getIds(['a', 'b', 'c']).tolist())
+        self.assertEqual([3, 1, 4, 3, 0, 4], index.getIds(['d', 'b', 'e', 'd', 'a', 'e']).tolist())
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'], index.getNames())
+        self.assertEqual(['e', 'a'], index.getNames([4, 0]))
+        self.assertEqual('d', index.getName(3))
+        self.assertEqual(5, len(index))
+
+    def test_repeated_new_names(self):
+        index = SeqIdIndex()
+        self.assertEqual([0, 0, 1, 0, 1], index.getIds(['x', 'x', 'y', 'x', 'y']).tolist())
+        self.assertEqual(['x', 'y'], index.getNames())
+
+    def test_lookup_doesnt_add(self):
+        index = SeqIdIndex()
+        index.getIds(['a', 'b'])
+        self.assertEqual([1, -1, 0], index.lookup(['b', 'z', 'a']).tolist())
+        self.assertEqual(None, index.getId('z'))
+        self.assertEqual(1, index.getId('b'))
+        self.assertFalse('z' in index)
+        self.assertTrue('a' in index)
+        self.assertEqual(2, len(index))
+
+
+class TestSeqIdMap(unittest.TestCase):
+
+    def _getMaps(self):
+        """
+            @return: mapping and the equal dictionary, the index is shared with another mapping
+        """
+        index = SeqIdIndex()
+        other = SeqIdMap(index, index.getIds(['o1', 'c', 'o2']), [7, 8, 9])
+        m = SeqIdMap(index, index.getIds(['c', 'a', 'b']), [3, 1, 2])
+        self.assertEqual(3, len(other))
+        return m, {'c': 3, 'a': 1, 'b': 2}
+
+    def test_dict_semantics(self):
+        m, d = self._getMaps()
+        self.assertEqual(len(d), len(m))
+        for name in ['a', 'b', 'c', 'o1', 'o2', 'unknown']:
+            self.assertEqual(name in d, name in m)
+            self.assertEqual(d.has_key(name), m.has_key(name))
+            self.assertEqual(d.get(name), m.get(name))
+            self.assertEqual(d.get(name, -5), m.get(name, -5))
+            if name in d:
+                self.assertEqual(d[name], m[name])
+                self.assertTrue(isinstance(m[name], int))
+            else:
+                self.assertRaises(KeyError, m.__getitem__, name)
+        self.assertEqual(sorted(d.items()), sorted(m.items()))
+        self.assertTrue(seqids.isMapping(m))
+        self.assertTrue(seqids.isMapping(d))
+        self.assertFalse(seqids.isMapping([]))
+
+    def test_iteration_order(self):
+        # the sequences are iterated in the order of their ids in the (shared) index
+        m = self._getMaps()[0]
+        self.assertEqual(['c', 'a', 'b'], m.keys())
+        self.assertEqual(['c', 'a', 'b'], list(m))
+        self.assertEqual(['c', 'a', 'b'], list(m.iterkeys()))
+        self.assertEqual([3, 1, 2], m.values())
+        self.assertEqual([3, 1, 2], list(m.itervalues()))
+        self.assertEqual([('c', 3), ('a', 1), ('b', 2)], m.items())
+        self.assertEqual(m.items(), list(m.iteritems()))
+        self.assertEqual(m.keys(), m.getIndex().getNames(m.getIdArray().tolist()))
+        self.assertEqual(m.values(), m.getValueArray().tolist())
+
+    def test_assign_keeps_last_value(self):
+        index = SeqIdIndex()
+        m = SeqIdMap(index)
+        self.assertEqual([], m.assign(index.getIds(['a', 'b']), [1, 2]))
+        self.assertEqual([1, 2, 2], m.assign(index.getIds(['b', 'c', 'c', 'c']), [5, 6, 7, 8]))
+        self.assertEqual({'a': 1, 'b': 5, 'c': 8}, dict(m.items()))
+        self.assertEqual(3, len(m))
+        self.assertEqual(8, m.getById(2))
+        self.assertEqual(None, m.getById(100))
+
+    def test_get_array(self):
+        m = self._getMaps()[0]
+        values, defined = m.getArray(['b', 'o1', 'unknown', 'a'])
+        self.assertEqual([2, -1, -1, 1], values.tolist())
+        self.assertEqual([True, False, False, True], defined.tolist())
+        values, defined = seqids.getArray({'b': '2', 'a': 1}, ['b', 'o1', 'a'], missing=0)
+        self.assertEqual([2, 0, 1], values.tolist())
+        self.assertEqual([True, False, True], defined.tolist())
+
+    def test_index_grows_after_the_map(self):
+        index = SeqIdIndex()
+        m = SeqIdMap(index, index.getIds(['a']), [1])
+        index.getIds(['n%s' % i for i in range(100)])
+        self.assertFalse('n99' in m)
+        self.assertEqual(None, m.get('n99'))
+        self.assertEqual([False, True], m.hasValues([index.getId('n99'), index.getId('a')]).tolist())
+        m.assign(index.getIds(['n99']), [4])
+        self.assertEqual(['a', 'n99'], m.keys())
+        self.assertEqual(2, len(m))
+
+
+class TestAssignmentLoader(unittest.TestCase):
+
+    # "a" is assigned three times (twice to a different taxon), "b" twice to the same taxon
+    BATCHES = [(['a', 'b', 'c'], [1, 2, 3]), (['a', 'd', 'b'], [4, 5, 2]), (['a'], [6])]
+
+    def _load(self, policy, seqIdIndex=None):
+        stats = AssignmentStats()
+        loader = AssignmentLoader(policy, seqIdIndex, stats)
+        for names, values in self.BATCHES:
+            loader.add(names, values)
+        return dict(loader.getMapping().items()), stats
+
+    def test_first_wins(self):
+        for index in [None, SeqIdIndex()]:
+            mapping, stats = self._load(seqids.FIRST_WINS, index)
+            self.assertEqual({'a': 1, 'b': 2, 'c': 3, 'd': 5}, mapping)
+            self.assertEqual((7, 3, 2, 2), (stats.entries, stats.duplicates, stats.conflicts, stats.duplicateSeqCount))
+            self.assertEqual(['a', 'b'], stats.examples)
+
+    def test_last_wins(self):
+        for index in [None, SeqIdIndex()]:
+            mapping, stats = self._load(seqids.LAST_WINS, index)
+            self.assertEqual({'a': 6, 'b': 2, 'c': 3, 'd': 5}, mapping)
+            self.assertEqual((7, 3, 2, 2), (stats.entries, stats.duplicates, stats.conflicts, stats.duplicateSeqCount))
+
+    def test_duplicates_within_batch(self):
+        for index in [None, SeqIdIndex()]:
+            for policy, expected in [(seqids.FIRST_WINS, 1), (seqids.LAST_WINS, 3)]:
+                loader = AssignmentLoader(policy, index, AssignmentStats())
+                loader.add(['x', 'y', 'x', 'x'], [1, 2, 2, 3])
+                self.assertEqual({'x': expected, 'y': 2}, dict(loader.getMapping().items()))
+
+    def test_error(self):
+        for index in [None, SeqIdIndex()]:
+            loader = AssignmentLoader(seqids.ERROR, index, AssignmentStats(), 'test file')
+            loader.add(['a', 'b'], [1, 2])
+            self.assertRaises(DuplicateAssignmentError, loader.add, ['c', 'b'], [3, 2])
+            loader = AssignmentLoader(seqids.ERROR, index, AssignmentStats())
+            self.assertRaises(DuplicateAssignmentError, loader.add, ['a', 'a'], [1, 1])
+
+    def test_multi_label_keeps_order(self):
+        mapping, stats = self._load(seqids.MULTI_LABEL)
+        self.assertEqual({'a': [1, 4, 6], 'b': [2], 'c': [3], 'd': [5]}, mapping)
+        self.assertEqual((7, 3, 2, 2), (stats.entries, stats.duplicates, stats.conflicts, stats.duplicateSeqCount))
+        self.assertRaises(ValueError, AssignmentLoader, seqids.MULTI_LABEL, SeqIdIndex())
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, AssignmentLoader, 'any')
+
+    def test_examples_limited(self):
+        stats = AssignmentStats()
+        loader = AssignmentLoader(seqids.LAST_WINS, None, stats)
+        names = ['s%s' % i for i in range(seqids.MAX_EXAMPLES + 3)]
+        loader.add(names, range(len(names)))
+        loader.add(names, range(len(names)))
+        self.assertEqual(len(names), stats.duplicateSeqCount)
+        self.assertEqual(names[:seqids.MAX_EXAMPLES], stats.examples)
+
+    def test_message_of_the_caller(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, '#comment\na\t1\nb\t2\na\t3\n')
+        os.close(fd)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            mapping = csv.predToDict(path, name='Accuracy')
+            message = sys.stderr.getvalue()
+            sys.stderr = StringIO()
+            self.assertEqual({'a': 3, 'b': 2}, mapping)
+            csv.predToDict(path, stats=AssignmentStats())
+            self.assertEqual('', sys.stderr.getvalue())
+        finally:
+            sys.stderr = stderr
+            os.remove(path)
+        self.assertTrue(message.startswith('Accuracy: %s: 3 assignments, 1 sequences assigned more than once' % path))
+        self.assertTrue(message.rstrip().endswith('e.g.: a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,33 +22,511 @@
 
 import os
 import sys
+import mmap
+import struct
 import sqlite3
+import numpy
 
 TAXONOMIC_RANKS = ['root','superkingdom','phylum','class','order','family','genus','species']
 
+# binary snapshot of the taxonomy, see function "buildSnapshot"
+SNAPSHOT_MAGIC = 'NCBITAXS'
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<8sIIIIQ')  # magic, version, taxa count, ncbidToIdx length, ranks len, names len
+
+
+class _TaxonomyTree():
+    """
+        Compiled (array based) representation of the whole taxonomy.
+
+        Taxa are addressed by a dense index (0..n-1), the ncbi taxon ids are mapped to the dense index
+        via a direct lookup array, thus all lookups are O(1) and no SQL query is needed.
+    """
+    def __init__(self, ncbids, parentIdx, rankCode, rankNames, ncbidToIdx, nameOffset=None, nameBlob=None,
+                 snapshotMap=None):
+        """
+            @param ncbids: dense index -> ncbi taxon id
+            @param parentIdx: dense index -> dense index of the direct parent (-1 ~ parent not defined)
+            @param rankCode: dense index -> rank code
+            @param rankNames: rank code -> rank (e.g. 'genus', 'no rank')
+            @param ncbidToIdx: ncbi taxon id -> dense index (-1 ~ ncbi taxon id not defined)
+            @param nameOffset: the scientific name of taxon i is nameBlob[nameOffset[i]:nameOffset[i + 1]]
+            @param nameBlob: concatenated scientific names
+            @param snapshotMap: memory map of the snapshot file that backs the arrays
+        """
+        self.ncbids = ncbids
+        self.parentIdx = parentIdx
+        self.rankCode = rankCode
+        self.rankNames = rankNames
+        self.ncbidToIdx = ncbidToIdx
+        self.nameOffset = nameOffset
+        self.nameBlob = nameBlob
+        self.rootIdx = self.getIdx(1)
+        self._snapshotMap = snapshotMap
+        self._levels = None
+        self._lineage = {}
+        self._nameToIdxList = None
+
+    @staticmethod
+    def fromLists(ncbidList, parentList, rankList):
+        """
+            @param ncbidList: ncbi taxon ids
+            @param parentList: ncbi taxon ids of the parents
+            @param rankList: ranks
+            @rtype: _TaxonomyTree
+        """
+        rankNames = sorted(set(rankList))
+        rankToCode = dict((rank, code) for code, rank in enumerate(rankNames))
+        ncbids = numpy.array(ncbidList, dtype=numpy.int32)
+        parents = numpy.array(parentList, dtype=numpy.int64)
+        rankCode = numpy.array([rankToCode[rank] for rank in rankList], dtype=numpy.int16)
+        ncbidToIdx = _TaxonomyTree._getNcbidToIdx(ncbids)
+        return _TaxonomyTree(ncbids, _TaxonomyTree._toIdx(ncbidToIdx, parents), rankCode, rankNames, ncbidToIdx)
+
+    @staticmethod
+    def fromSqlite(cursor):
+        """
+            Reads the whole "taxon" table at once.
+
+            @rtype: _TaxonomyTree
+        """
+        cursor.execute('SELECT ncbi_taxon_id, parent_taxon_id, node_rank FROM taxon T ORDER BY T.taxon_id')
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            return _TaxonomyTree.fromLists([], [], [])
+        ncbidList, parentList, rankList = zip(*rows)
+        return _TaxonomyTree.fromLists(ncbidList, parentList, [str(rank) for rank in rankList])
+
+    @staticmethod
+    def fromSnapshot(snapshotFile):
+        """
+            Opens a binary snapshot (see function "buildSnapshot"), the arrays are memory-mapped,
+            thus the operating system shares them among all processes that use the same snapshot.
+
+            @rtype: _TaxonomyTree
+        """
+        f = open(os.path.normpath(snapshotFile), 'rb')
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        magic, version, n, lookupLen, ranksLen, namesLen = _SNAPSHOT_HEADER.unpack_from(m, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            m.close()
+            raise ValueError('TaxonomyNcbi: unsupported snapshot file: ' + snapshotFile)
+        offset = [_SNAPSHOT_HEADER.size]
+
+        def section(dtype, count):
+            a = numpy.frombuffer(m, dtype=dtype, count=count, offset=offset[0])
+            offset[0] += _align(a.nbytes)
+            return a
+
+        rankNames = m[offset[0]:offset[0] + ranksLen].split('\n') if ranksLen > 0 else []
+        offset[0] += _align(ranksLen)
+        ncbids = section(numpy.int32, n)
+        parentIdx = section(numpy.int32, n)
+        rankCode = section(numpy.int16, n)
+        nameOffset = section(numpy.int64, n + 1)
+        ncbidToIdx = section(numpy.int32, lookupLen)
+        nameBlob = buffer(m, offset[0], namesLen)
+        return _TaxonomyTree(ncbids, parentIdx, rankCode, rankNames, ncbidToIdx, nameOffset, nameBlob, m)
+
+    def writeSnapshot(self, snapshotFile, idxToName):
+        """
+            Stores the tree as a binary snapshot, the file is written to a temporary file first and then renamed,
+            thus concurrent readers never see an incomplete snapshot.
+
+            @param idxToName: dense index -> scientific name (or None)
+        """
+        names = []
+        for name in idxToName:
+            if name is None:
+                name = ''
+            elif isinstance(name, unicode):
+                name = name.encode('utf-8')
+            names.append(name)
+        nameOffset = numpy.zeros(len(names) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(name) for name in names], out=nameOffset[1:])
+        nameBlob = ''.join(names)
+        ranks = '\n'.join(self.rankNames)
+
+        tmpFile = '%s.tmp%s' % (snapshotFile, os.getpid())
+        f = open(os.path.normpath(tmpFile), 'wb')
+        try:
+            f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.ncbids), len(self.ncbidToIdx),
+                                          len(ranks), len(nameBlob)))
+            for data in [ranks,
+                         numpy.asarray(self.ncbids, dtype='<i4').tostring(),
+                         numpy.asarray(self.parentIdx, dtype='<i4').tostring(),
+                         numpy.asarray(self.rankCode, dtype='<i2').tostring(),
+                         nameOffset.astype('<i8').tostring(),
+                         numpy.asarray(self.ncbidToIdx, dtype='<i4').tostring()]:
+                f.write(data)
+                f.write('\0' * (_align(len(data)) - len(data)))
+            f.write(nameBlob)
+        finally:
+            f.close()
+        os.rename(tmpFile, snapshotFile)
+
+    def close(self):
+        """
+            Releases the arrays, the memory map of a snapshot is unmapped when the last array that uses it is released.
+        """
+        self.ncbids = self.parentIdx = self.rankCode = self.nameOffset = self.ncbidToIdx = self.nameBlob = None
+        self._levels = None
+        self._lineage = {}
+        self._nameToIdxList = None
+        self._snapshotMap = None
+
+    @staticmethod
+    def _getNcbidToIdx(ncbids):
+        """
+            @return: direct lookup array, ncbi taxon id -> dense index
+        """
+        size = int(ncbids.max()) + 1 if len(ncbids) > 0 else 1
+        ncbidToIdx = numpy.empty(size, dtype=numpy.int32)
+        ncbidToIdx.fill(-1)
+        ncbidToIdx[ncbids] = numpy.arange(len(ncbids), dtype=numpy.int32)
+        return ncbidToIdx
+
+    @staticmethod
+    def _toIdx(ncbidToIdx, ncbids):
+        """
+            Vectorized version of "getIdx", undefined ncbi taxon ids are mapped to -1.
+        """
+        ncbids = numpy.asarray(ncbids, dtype=numpy.int64)
+        inRange = (ncbids >= 0) & (ncbids < len(ncbidToIdx))
+        idx = numpy.empty(len(ncbids), dtype=numpy.int32)
+        idx.fill(-1)
+        idx[inRange] = ncbidToIdx[ncbids[inRange]]
+        return idx
+
+    def getIdx(self, ncbid):
+        """
+            @return: dense index of the ncbi taxon id or -1 if it is not defined
+            @rtype: int
+        """
+        try:
+            ncbid = int(ncbid)
+        except (TypeError, ValueError):
+            return -1
+        if ncbid == -1:
+            ncbid = 1
+        if ncbid < 0 or ncbid >= len(self.ncbidToIdx):
+            return -1
+        return int(self.ncbidToIdx[ncbid])
+
+    def getRank(self, idx):
+        """
+            @rtype: str
+        """
+        if idx < 0:
+            return None
+        return self.rankNames[self.rankCode[idx]]
+
+    def getName(self, idx):
+        """
+            @return: scientific name stored in the snapshot or None
+            @rtype: str
+        """
+        if idx < 0 or self.nameOffset is None or self.nameOffset[idx] == self.nameOffset[idx + 1]:
+            return None
+        return self.nameBlob[self.nameOffset[idx]:self.nameOffset[idx + 1]]
+
+    def getIdxListByName(self, name):
+        """
+            @return: dense indices of all taxa with the given scientific name
+            @rtype: list of int
+        """
+        if self._nameToIdxList is None:
+            self._nameToIdxList = {}
+            for idx in range(len(self.ncbids)):
+                self._nameToIdxList.setdefault(self.getName(idx), []).append(idx)
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return self._nameToIdxList.get(name, [])
+
+    def getLevels(self):
+        """
+            Gets the taxa grouped according to their distance from the root (or from a taxon with undefined parent).
+
+            @return: list of arrays of dense indices, the i-th array contains taxa in depth i
+        """
+        if self._levels is None:
+            n = len(self.ncbids)
+            depth = _getDepths(self.parentIdx)[0]
+            order = numpy.argsort(depth, kind='mergesort').astype(numpy.int32)
+            bounds = numpy.searchsorted(depth[order], numpy.arange(int(depth.max()) + 2 if n > 0 else 1))
+            self._levels = [order[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+        return self._levels
+
+    def getAllowedParentIdx(self, allowedRanks):
+        """
+            For each taxon gets the closest parent that is defined at an allowed rank (see TaxonomyNcbi.getParentNcbid).
+
+            @param allowedRanks: set of allowed ranks (where 'root' stands for the root of the taxonomy)
+            @return: dense index -> dense index of the closest allowed parent (-1 ~ not defined)
+        """
+        allowedCode = numpy.array([rank in allowedRanks for rank in self.rankNames], dtype=bool)
+        allowed = allowedCode[self.rankCode]
+        if self.rootIdx >= 0 and 'root' in allowedRanks:
+            allowed[self.rootIdx] = True
+
+        allowedParent = numpy.empty(len(self.ncbids), dtype=numpy.int32)
+        allowedParent.fill(-1)
+        levels = self.getLevels()
+        if self.rootIdx >= 0 and allowed[self.rootIdx] and self.parentIdx[self.rootIdx] == self.rootIdx:
+            allowedParent[self.rootIdx] = self.rootIdx
+        for level in levels[1:]:
+            parent = self.parentIdx[level]
+            allowedParent[level] = numpy.where(allowed[parent], parent, allowedParent[parent])
+        return allowedParent
+
+    def getLineageAtRanks(self, ranks):
+        """
+            For each taxon gets the taxon itself or its closest ancestor that is defined at the given ranks.
+            The matrix is computed top-down (level by level) at the first request and cached.
+
+            @param ranks: list of ranks (where 'root' stands for the root of the taxonomy)
+            @return: matrix [dense index, position of the rank in ranks] -> dense index (-1 ~ not defined)
+        """
+        key = tuple(ranks)
+        lineage = self._lineage.get(key, None)
+        if lineage is None:
+            codeToPos = numpy.empty(len(self.rankNames), dtype=numpy.int32)
+            codeToPos.fill(-1)
+            for pos, rank in enumerate(ranks):
+                if rank in self.rankNames:
+                    codeToPos[self.rankNames.index(rank)] = pos
+            rankPos = codeToPos[self.rankCode]
+            if self.rootIdx >= 0 and 'root' in ranks:
+                rankPos[self.rootIdx] = list(ranks).index('root')
+
+            lineage = numpy.empty((len(self.ncbids), len(ranks)), dtype=numpy.int32)
+            lineage.fill(-1)
+            for depth, level in enumerate(self.getLevels()):
+                if depth > 0:
+                    lineage[level] = lineage[self.parentIdx[level]]
+                level = level[rankPos[level] >= 0]
+                lineage[level, rankPos[level]] = level
+            self._lineage[key] = lineage
+        return lineage
+
+    def toNcbids(self, idx):
+        """
+            Vectorized conversion of dense indices to ncbi taxon ids, -1 is kept as -1.
+        """
+        idx = numpy.asarray(idx)
+        ncbids = numpy.empty(idx.shape, dtype=numpy.int32)
+        ncbids.fill(-1)
+        defined = idx >= 0
+        ncbids[defined] = self.ncbids[idx[defined]]
+        return ncbids
+
+
+class AncestorIndex():
+    """
+        Depths and a binary lifting table of a taxonomy tree (given by the parents of the taxa), the ancestors
+        and the lowest common ancestors (LCA) of arrays of taxa are found in O(log(depth)) vectorized steps.
+
+        Taxa are addressed by the dense index of the taxonomy tree. The depth is the number of edges to the top
+        ancestor of a taxon, a taxon is rooted if its top ancestor is the root of the taxonomy (ncbi taxon id 1).
+    """
+    def __init__(self, parentIdx, rootIdx, ncbidToIdx):
+        """
+            @param parentIdx: dense index -> dense index of the parent (-1 or the taxon itself ~ no parent)
+            @param rootIdx: dense index of the root of the taxonomy (-1 ~ not defined)
+            @param ncbidToIdx: ncbi taxon id -> dense index (-1 ~ ncbi taxon id not defined)
+        """
+        n = len(parentIdx)
+        depth, anc, parent = _getDepths(parentIdx)
+        self.depth = depth
+        self.rooted = (anc == rootIdx) if rootIdx >= 0 else numpy.zeros(n, dtype=bool)
+        self._ncbidToIdx = ncbidToIdx
+        # up[k][i] ~ ancestor of taxon i in distance 2^k (or the top ancestor)
+        self._up = [parent]
+        maxDepth = int(depth.max()) if n > 0 else 0
+        while (1 << len(self._up)) <= maxDepth:
+            self._up.append(self._up[-1][self._up[-1]])
+
+    def toIdx(self, ncbids):
+        """
+            @return: dense indices of the ncbi taxon ids (-1 ~ not defined)
+            @rtype: numpy.ndarray
+        """
+        return _TaxonomyTree._toIdx(self._ncbidToIdx, ncbids)
+
+    def getAncestors(self, idx, dist):
+        """
+            @param idx: dense indices of taxa
+            @param dist: distances (at most the depths of the taxa)
+            @return: dense indices of the ancestors of the taxa in the given distances
+            @rtype: numpy.ndarray
+        """
+        idx = numpy.asarray(idx, dtype=numpy.int32)
+        dist = numpy.asarray(dist)
+        maxDist = int(dist.max()) if dist.size > 0 else 0
+        for k, up in enumerate(self._up):
+            if (1 << k) > maxDist:
+                break
+            idx = numpy.where((dist >> k) & 1, up[idx], idx)
+        return idx
+
+    def getParents(self, idx):
+        """
+            @return: dense indices of the parents of the taxa (a taxon without a parent is its own parent)
+            @rtype: numpy.ndarray
+        """
+        return self._up[0][idx]
+
+    def getLca(self, idxA, idxB):
+        """
+            @param idxA: dense indices of taxa
+            @param idxB: dense indices of taxa (of the same length as idxA)
+            @return: dense indices of the lowest common ancestors of the pairs of taxa (-1 ~ no common ancestor)
+            @rtype: numpy.ndarray
+        """
+        a = numpy.asarray(idxA, dtype=numpy.int32)
+        b = numpy.asarray(idxB, dtype=numpy.int32)
+        depthA = self.depth[a]
+        depthB = self.depth[b]
+        a = self.getAncestors(a, numpy.maximum(depthA - depthB, 0))
+        b = self.getAncestors(b, numpy.maximum(depthB - depthA, 0))
+        for up in reversed(self._up):
+            upA = up[a]
+            upB = up[b]
+            differ = upA != upB
+            a[differ] = upA[differ]
+            b[differ] = upB[differ]
+        parentA = self._up[0][a]
+        parentB = self._up[0][b]
+        return numpy.where(a == b, a, numpy.where(parentA == parentB, parentA, -1))
+
+
+def _getDepths(parentIdx):
+    """
+        Gets the depths of the taxa of a tree by pointer jumping, in O(log(depth)) vectorized steps.
+
+        @param parentIdx: dense index -> dense index of the parent (-1 or the taxon itself ~ no parent)
+        @return: depths (number of edges to the top ancestor), top ancestors, parents (a taxon without a parent
+            is its own parent)
+        @rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    idx = numpy.arange(len(parentIdx), dtype=numpy.int32)
+    parent = numpy.where(parentIdx < 0, idx, parentIdx).astype(numpy.int32)
+    anc = parent
+    depth = (anc != idx).astype(numpy.int32)
+    while True:
+        ancAnc = anc[anc]
+        if numpy.array_equal(ancAnc, anc):
+            break
+        depth = depth + depth[anc]
+        anc = ancAnc
+    return depth, anc, parent
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+def isSnapshot(filePath):
+    """
+        @return: True if the file is a binary taxonomy snapshot (see function "buildSnapshot")
+        @rtype: bool
+    """
+    try:
+        f = open(os.path.normpath(filePath), 'rb')
+    except IOError:
+        return False
+    try:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+    finally:
+        f.close()
+
+
+def buildSnapshot(snapshotFile, ncbidList, parentList, rankList, ncbidToName):
+    """
+        Stores the taxonomy as a binary snapshot that can be opened by TaxonomyNcbi (instead of a sqlite3 database).
+        The snapshot consists of the parent, rank and name offset arrays and a blob of the scientific names.
+        It is memory-mapped on opening, i.e. it is opened in milliseconds and concurrent processes share it.
+
+        @param ncbidList: ncbi taxon ids
+        @param parentList: ncbi taxon ids of the parents
+        @param rankList: ranks
+        @param ncbidToName: mapping, ncbi taxon id -> scientific name
+    """
+    tree = _TaxonomyTree.fromLists(ncbidList, parentList, rankList)
+    tree.writeSnapshot(snapshotFile, [ncbidToName.get(ncbid, None) for ncbid in ncbidList])
+
+
+def sqliteToSnapshot(databaseFile, snapshotFile):
+    """
+        Converts the taxonomy stored in the sqlite3 format to a binary snapshot (see function "buildSnapshot").
+    """
+    conn = sqlite3.connect(os.path.normpath(databaseFile))
+    try:
+        cursor = conn.cursor()
+        tree = _TaxonomyTree.fromSqlite(cursor)
+        cursor.execute('SELECT T.ncbi_taxon_id, TN.name FROM taxon_name TN, taxon T '
+                       'WHERE T.taxon_id = TN.taxon_id AND TN.name_class="scientific name"')
+        ncbidToName = {}
+        for ncbid, name in cursor:
+            ncbidToName[ncbid] = None if ncbid in ncbidToName else name  # ambiguous names are not stored
+        cursor.close()
+    finally:
+        conn.close()
+    tree.writeSnapshot(snapshotFile, [ncbidToName.get(int(ncbid), None) for ncbid in tree.ncbids])
+
 
 class TaxonomyNcbi():
     """
-        Represents an interface to the sqlite3 database in which the NCBI taxonomy is stored.
+        Represents an interface to the sqlite3 database in which the NCBI taxonomy is stored,
+        or to the binary snapshot of the taxonomy (see function "buildSnapshot").
         (NOTE that methods and variables starting with "_" are local and shouldn`t be used from the outside)
 
         @author: Ivan
     """
-    def __init__(self, databaseFile, allowedRanks=TAXONOMIC_RANKS, considerNoRank=False):
+    def __init__(self, databaseFile, allowedRanks=TAXONOMIC_RANKS, considerNoRank=False, preload=False):
         """
-            @param databaseFile: usually file named "ncbitax_sqlite.db"
+            @param databaseFile: usually file named "ncbitax_sqlite.db"; or a binary snapshot of the taxonomy
             @param allowedRanks: taxonomic ranks that will be considered (where 'root' is the root of the taxonomy)
             @param considerNoRank: consider ranks 'no rank' if true
+            @param preload: read the whole taxonomy tree into memory at once, parents and ranks are then
+                looked up without any SQL query (recommended if many taxa are queried, a snapshot is always
+                accessed this way)
         """
         self._allowedRanks = set(allowedRanks)
         if considerNoRank:
             self._allowedRanks.add('no rank')
-        try:
-            self.conn = sqlite3.connect(os.path.normpath(databaseFile))
-            self.cursor = self.conn.cursor()
-        except Exception:
-            sys.stderr.write(str('TaxonomyNcbi: Failed to create connection to database: ' + databaseFile))
-            raise
+        self.conn = None
+        self.cursor = None
+        self._tree = None
+        self._allowedParentIdx = None
+        self._ancestorIndex = None
+        if isSnapshot(databaseFile):
+            try:
+                self._tree = _TaxonomyTree.fromSnapshot(databaseFile)
+            except Exception:
+                sys.stderr.write(str('TaxonomyNcbi: Failed to open the taxonomy snapshot: ' + databaseFile))
+                raise
+        else:
+            try:
+                self.conn = sqlite3.connect(os.path.normpath(databaseFile))
+                self.cursor = self.conn.cursor()
+            except Exception:
+                sys.stderr.write(str('TaxonomyNcbi: Failed to create connection to database: ' + databaseFile))
+                raise
+            if preload:
+                self._tree = _TaxonomyTree.fromSqlite(self.cursor)
+        if self._tree is not None:
+            self._allowedParentIdx = self._tree.getAllowedParentIdx(self._allowedRanks)
+
+    def isPreloaded(self):
+        """
+            @return: True if the taxonomy tree is held in memory
+            @rtype: bool
+        """
+        return self._tree is not None
 
     def getScientificName(self, ncbid, checkRank=False):
         """
@@ -62,6 +540,12 @@ class TaxonomyNcbi():
         if checkRank and (not self.isRankNcbidAllowed(ncbid)):
             return None
 
+        if self.cursor is None:
+            name = self._tree.getName(self._tree.getIdx(ncbid))
+            if name is None:
+                sys.stderr.write(str('TaxonomyNcbi: Cannot find name for ncbi: ' + str(ncbid)))
+            return name
+
         self.cursor.execute(str('SELECT TN.name FROM taxon_name TN, taxon T WHERE T.ncbi_taxon_id=?' +
                                 ' AND T.taxon_id = TN.taxon_id AND TN.name_class="scientific name"'),(ncbid,))
         result = self.cursor.fetchall()
@@ -76,10 +560,13 @@ class TaxonomyNcbi():
             @return: ncbid or None
             @rtype: int
         """
-        self.cursor.execute(str('SELECT T.ncbi_taxon_id FROM taxon_name TN, taxon T ' +
-                                'WHERE TN.name_class="scientific name" AND TN.name=? AND TN.taxon_id=T.taxon_id'),
-                                (scientificName,))
-        result = self.cursor.fetchall()
+        if self.cursor is None:
+            result = [(self._tree.ncbids[idx],) for idx in self._tree.getIdxListByName(scientificName)]
+        else:
+            self.cursor.execute(str('SELECT T.ncbi_taxon_id FROM taxon_name TN, taxon T ' +
+                                    'WHERE TN.name_class="scientific name" AND TN.name=? AND TN.taxon_id=T.taxon_id'),
+                                    (scientificName,))
+            result = self.cursor.fetchall()
         if len(result) == 1:
             ncbid = int(result[0][0])
             if checkRank and (not self.isRankNcbidAllowed(ncbid)):
@@ -94,14 +581,17 @@ class TaxonomyNcbi():
 
     def getNcbid2(self, name, checkRank = False):
         """
-            @param name: doesn`t have to be a scientific name
+            @param name: doesn`t have to be a scientific name (a snapshot contains only scientific names)
             @return: ncbid or None
             @rtype: int
         """
-        self.cursor.execute(str('SELECT T.ncbi_taxon_id FROM taxon_name TN, taxon T ' +
-                                'WHERE TN.name=? AND TN.taxon_id=T.taxon_id'),
-                                (name,))
-        result = self.cursor.fetchall()
+        if self.cursor is None:
+            result = [(self._tree.ncbids[idx],) for idx in self._tree.getIdxListByName(name)]
+        else:
+            self.cursor.execute(str('SELECT T.ncbi_taxon_id FROM taxon_name TN, taxon T ' +
+                                    'WHERE TN.name=? AND TN.taxon_id=T.taxon_id'),
+                                    (name,))
+            result = self.cursor.fetchall()
         if len(result) == 1:
             ncbid = int(result[0][0])
             if checkRank and (not self.isRankNcbidAllowed(ncbid)):
@@ -115,8 +605,14 @@ class TaxonomyNcbi():
             return None
 
     def getChildrenNcbids(self, ncbid):  # SELECT T1.ncbi_taxon_id from taxon T1 where T1.parent_taxon_id=818;
-        self.cursor.execute(str('SELECT T1.ncbi_taxon_id from taxon T1 where T1.parent_taxon_id=?'),(ncbid,))
-        result = self.cursor.fetchall()
+        if self.cursor is None:
+            idx = self._tree.getIdx(ncbid)
+            result = []
+            if idx >= 0 and ncbid != -1:
+                result = [(int(n),) for n in self._tree.ncbids[numpy.nonzero(self._tree.parentIdx == idx)[0]]]
+        else:
+            self.cursor.execute(str('SELECT T1.ncbi_taxon_id from taxon T1 where T1.parent_taxon_id=?'),(ncbid,))
+            result = self.cursor.fetchall()
         if len(result) == 0:
             return None
         else:
@@ -132,6 +628,14 @@ class TaxonomyNcbi():
         """
         if ncbid == 1:
             return None
+        if self._tree is not None:
+            idx = self._tree.getIdx(ncbid)
+            if idx < 0:
+                return None
+            parentIdx = self._allowedParentIdx[idx]
+            if parentIdx < 0:
+                return None
+            return int(self._tree.ncbids[parentIdx])
         taxonId = self._getTaxonId(ncbid)
 
         while True:
@@ -144,6 +648,52 @@ class TaxonomyNcbi():
             if (rank in self._allowedRanks) or (ncbid == 1 and 'root' in self._allowedRanks):
                 return ncbid
 
+    def getNcbidsAtRank(self, ncbids, rank):
+        """
+            Projects taxa to the given rank at once (see method "getLineageAtRanks").
+
+            @param ncbids: ncbi taxon ids
+            @type ncbids: list or numpy.ndarray
+            @param rank: taxonomic rank (where 'root' stands for the root of the taxonomy)
+            @return: ncbi taxon ids of the taxa (or their ancestors) defined at the rank (-1 ~ not defined)
+            @rtype: numpy.ndarray
+        """
+        return self.getLineageAtRanks(ncbids, [rank])[:, 0]
+
+    def getLineageAtRanks(self, ncbids, ranks=TAXONOMIC_RANKS):
+        """
+            Gets the lineages of the taxa at the given ranks, i.e. for each taxon and rank the taxon itself
+            or its closest ancestor defined at the rank. The lineages of all taxa are computed only once and cached,
+            the projection of the input taxa is then a single lookup (the whole tree is loaded if not preloaded).
+
+            @param ncbids: ncbi taxon ids
+            @type ncbids: list or numpy.ndarray
+            @param ranks: taxonomic ranks (where 'root' stands for the root of the taxonomy)
+            @return: matrix [position of the taxon in ncbids, position of the rank in ranks] -> ncbi taxon id
+                (-1 ~ not defined)
+            @rtype: numpy.ndarray
+        """
+        tree = self._getTree()
+        idx = self._getIdxArray(ncbids)
+        lineage = numpy.empty((len(idx), len(ranks)), dtype=numpy.int32)
+        lineage.fill(-1)
+        defined = idx >= 0
+        lineage[defined] = tree.getLineageAtRanks(ranks)[idx[defined]]
+        return tree.toNcbids(lineage)
+
+    def getAncestorIndex(self):
+        """
+            Gets the index of the ancestors of the taxa, the parents are the closest ancestors defined at the allowed
+            ranks (as returned by method "getParentNcbid"). The index is built at the first request (the whole tree
+            is loaded if not preloaded).
+
+            @rtype: AncestorIndex
+        """
+        if self._ancestorIndex is None:
+            tree = self._getTree()
+            self._ancestorIndex = AncestorIndex(self._allowedParentIdx, tree.rootIdx, tree.ncbidToIdx)
+        return self._ancestorIndex
+
     def getParentsNcbidSet(self, ncbid):
         """
             @return: set of parent ncbi taxon ids.
@@ -166,14 +716,18 @@ class TaxonomyNcbi():
         """
         if checkRank and (not self.isRankNcbidAllowed(ncbid)):
             return None
+        if self._tree is not None:
+            return self._tree.getRank(self._tree.getIdx(ncbid))
         return self._getRank(self._getTaxonId(ncbid))
 
     def isRankNcbidAllowed(self, ncbid):
         """
             @rtype: bool
         """
-        taxonId = self._getTaxonId(ncbid)
-        rank = self._getRank(taxonId)
+        if self._tree is not None:
+            rank = self._tree.getRank(self._tree.getIdx(ncbid))
+        else:
+            rank = self._getRank(self._getTaxonId(ncbid))
         if rank in self._allowedRanks:
             return True
         else:
@@ -189,6 +743,8 @@ class TaxonomyNcbi():
             return False
 
     def exists(self, ncbid):
+        if self._tree is not None:
+            return self._tree.getIdx(ncbid) >= 0
         if self._getTaxonId(ncbid) is None:
             return False
         else:
@@ -198,8 +754,12 @@ class TaxonomyNcbi():
         """
             Close the database after you stop using it.
         """
-        self.cursor.close()
-        self.conn.close()
+        if self._tree is not None:
+            self._tree.close()
+        self._ancestorIndex = None
+        if self.conn is not None:
+            self.cursor.close()
+            self.conn.close()
 
     def _getTaxonId(self, ncbid):
         if ncbid is None:
@@ -234,6 +794,27 @@ class TaxonomyNcbi():
             return None
         return str(result[0][0])
 
+    def _getTree(self):
+        """
+            @return: the taxonomy tree, it is loaded from the database if it hasn`t been preloaded
+            @rtype: _TaxonomyTree
+        """
+        if self._tree is None:
+            self._tree = _TaxonomyTree.fromSqlite(self.cursor)
+            self._allowedParentIdx = self._tree.getAllowedParentIdx(self._allowedRanks)
+        return self._tree
+
+    def _getIdxArray(self, ncbids):
+        """
+            Vectorized version of "_TaxonomyTree.getIdx".
+        """
+        tree = self._getTree()
+        try:
+            ncbids = numpy.asarray(ncbids, dtype=numpy.int64)
+        except (TypeError, ValueError):
+            return numpy.array([tree.getIdx(ncbid) for ncbid in ncbids], dtype=numpy.int32)
+        return _TaxonomyTree._toIdx(tree.ncbidToIdx, numpy.where(ncbids == -1, 1, ncbids))
+
 
 def test():
     databaseFile = "/Users/ivan/Documents/work/binning/taxonomy/ncbi_taxonomy_20110629/ncbitax_sqlite.db"
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2014  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Tests of the preloaded taxonomy tree, the binary snapshot and the lineage table against the sqlite3 database.
+
+    Run from the directory that contains the "algbioi" package: python -m unittest algbioi.com.taxonomy_ncbi_test
+"""
+
+import os
+import sys
+import sqlite3
+import random
+import shutil
+import argparse
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from algbioi.com import ncbitax2sqlite
+from algbioi.com import taxonomy_ncbi
+from algbioi.com.taxonomy_ncbi import TaxonomyNcbi, TAXONOMIC_RANKS
+
+OTHER_RANKS = ['no rank', 'subspecies', 'subgenus', 'species group']
+
+
+def _writeDumps(dmpDir, size, seed):
+    """
+        Writes a random taxonomy (nodes.dmp, names.dmp), the taxa are ordered arbitrarily with respect to the tree.
+        @return: list of ncbi taxon ids
+    """
+    rnd = random.Random(seed)
+    ncbids = [1]
+    parents = [1]
+    ranks = ['no rank']
+    for i in range(size):
+        ncbid = rnd.randint(2, 10 ** 7)
+        while ncbid in ncbids:
+            ncbid = rnd.randint(2, 10 ** 7)
+        ncbids.append(ncbid)
+        parents.append(rnd.choice(ncbids[:-1]))
+        ranks.append(rnd.choice(TAXONOMIC_RANKS[1:] + OTHER_RANKS))
+    order = range(len(ncbids))
+    rnd.shuffle(order)
+    nodes = open(os.path.join(dmpDir, 'nodes.dmp'), 'w')
+    names = open(os.path.join(dmpDir, 'names.dmp'), 'w')
+    for i in order:
+        nodes.write('%s\t|\t%s\t|\t%s\t|\tXX\t|\t0\t|\n' % (ncbids[i], parents[i], ranks[i]))
+        if i % 10 != 3:  # some taxa have no scientific name
+            names.write('%s\t|\tname %s\t|\t\t|\tscientific name\t|\n' % (ncbids[i], ncbids[i]))
+        names.write('%s\t|\tsynonym %s\t|\t\t|\tsynonym\t|\n' % (ncbids[i], ncbids[i]))
+    nodes.close()
+    names.close()
+    return ncbids
+
+
+class TestTaxonomy(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpDir = tempfile.mkdtemp()
+        cls.ncbids = _writeDumps(cls.tmpDir, 600, 1)
+        cls.database = os.path.join(cls.tmpDir, 'taxonomy.db')
+        cls.snapshot = os.path.join(cls.tmpDir, 'taxonomy.snapshot')
+        cls.snapshotFromDatabase = os.path.join(cls.tmpDir, 'taxonomy_db.snapshot')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            ncbitax2sqlite.build_database(argparse.Namespace(db=cls.database, dmp=cls.tmpDir))
+            ncbitax2sqlite.build_snapshot(argparse.Namespace(db=cls.snapshot, dmp=cls.tmpDir))
+        finally:
+            sys.stdout = stdout
+        taxonomy_ncbi.sqliteToSnapshot(cls.database, cls.snapshotFromDatabase)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir)
+
+    def _walkLineage(self, taxonomy, ncbid, rank):
+        """
+            The taxon or its closest ancestor at the rank, walking the parents one by one.
+        """
+        if rank == 'root':
+            return 1
+        current = ncbid
+        while current is not None:
+            if taxonomy.getRank(current) == rank:
+                return current
+            current = taxonomy.getParentNcbid(current)
+        return -1
+
+    def test_failed_build_leaves_no_database(self):
+        dmpDir = tempfile.mkdtemp(dir=self.tmpDir)
+        _writeDumps(dmpDir, 10, 2)
+        nodes = open(os.path.join(dmpDir, 'nodes.dmp'), 'a')
+        nodes.write('1\t|\t1\t|\tno rank\t|\tXX\t|\t0\t|\n')  # duplicate ncbi taxon id
+        nodes.close()
+        database = os.path.join(dmpDir, 'taxonomy.db')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertRaises(sqlite3.IntegrityError, ncbitax2sqlite.build_database,
+                              argparse.Namespace(db=database, dmp=dmpDir))
+        finally:
+            sys.stdout = stdout
+        self.assertFalse(os.path.exists(database))
+
+    def test_snapshot_format(self):
+        self.assertTrue(taxonomy_ncbi.isSnapshot(self.snapshot))
+        self.assertTrue(taxonomy_ncbi.isSnapshot(self.snapshotFromDatabase))
+        self.assertFalse(taxonomy_ncbi.isSnapshot(self.database))
+
+    def test_snapshot_round_trip(self):
+        database = TaxonomyNcbi(self.database)
+        self.assertFalse(database.isPreloaded())
+        for path, preload in [(self.snapshot, False), (self.snapshotFromDatabase, False), (self.database, True)]:
+            taxonomy = TaxonomyNcbi(path, preload=preload)
+            self.assertTrue(taxonomy.isPreloaded())
+            for ncbid in self.ncbids:
+                self.assertTrue(taxonomy.exists(ncbid))
+                self.assertEqual(database.getParentNcbid(ncbid), taxonomy.getParentNcbid(ncbid))
+                self.assertEqual(database.getRank(ncbid), taxonomy.getRank(ncbid))
+                self.assertEqual(database.isRankNcbidAllowed(ncbid), taxonomy.isRankNcbidAllowed(ncbid))
+                if ncbid in self.ncbids[3::10]:
+                    continue  # no scientific name (reported to stderr)
+                self.assertEqual(database.getScientificName(ncbid), taxonomy.getScientificName(ncbid))
+            self.assertFalse(taxonomy.exists(10 ** 8))
+            self.assertEqual(None, taxonomy.getParentNcbid(10 ** 8))
+            taxonomy.close()
+        database.close()
+
+    def test_lineage_at_ranks(self):
+        database = TaxonomyNcbi(self.database)
+        ncbids = self.ncbids + [10 ** 8]
+        for path in [self.snapshot, self.database]:
+            taxonomy = TaxonomyNcbi(path, preload=True)
+            lineage = taxonomy.getLineageAtRanks(ncbids, TAXONOMIC_RANKS)
+            self.assertEqual((len(ncbids), len(TAXONOMIC_RANKS)), lineage.shape)
+            for i, ncbid in enumerate(self.ncbids):
+                expected = [self._walkLineage(database, ncbid, rank) for rank in TAXONOMIC_RANKS]
+                self.assertEqual(expected, lineage[i].tolist())
+            self.assertEqual([-1] * len(TAXONOMIC_RANKS), lineage[-1].tolist())
+            for rank in ['species', 'phylum']:
+                self.assertEqual(lineage[:, TAXONOMIC_RANKS.index(rank)].tolist(),
+                                 taxonomy.getNcbidsAtRank(ncbids, rank).tolist())
+            taxonomy.close()
+        database.close()
+
+    def test_lineage_of_subset_of_ranks(self):
+        taxonomy = TaxonomyNcbi(self.snapshot)
+        lineage = taxonomy.getLineageAtRanks(self.ncbids, TAXONOMIC_RANKS)
+        ranks = ['genus', 'root', 'class']
+        subset = taxonomy.getLineageAtRanks(self.ncbids, ranks)
+        for pos, rank in enumerate(ranks):
+            self.assertEqual(lineage[:, TAXONOMIC_RANKS.index(rank)].tolist(), subset[:, pos].tolist())
+        taxonomy.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
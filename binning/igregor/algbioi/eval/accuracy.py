@@ -21,10 +21,15 @@
 
 import os
 import argparse
+import numpy
 
 from algbioi.com import fasta
+from algbioi.com import seqids
 from algbioi.com import taxonomy_ncbi
 from algbioi.eval import cami
+from algbioi.eval import session
+
+PRINT_HEADER = '# precision, recall, #classes precision, #classes recall, seq. count/bp, weighted bins\n'
 
 
 class _TaxonomyWrapperA():
@@ -32,47 +37,16 @@ class _TaxonomyWrapperA():
         Wraps the functionality of the database.
     """
 
-    def __init__(self, databaseFile):
-        self._taxonomy = taxonomy_ncbi.TaxonomyNcbi(databaseFile)
-        self._rankToId = {}
-        self._ncbidToRankId = {}
-        self._predAtRankId = {}  # rankId -> ncbid -> ncbid at given rank
-        self._noDefAtRankId = {}  # rankId -> set of ncbids for which the ncbid at given rank is not defined
-        self._ncbidToNcbidParent = {}  # ncbid -> parent ncbid
-
-        id = 0
-        for rank in taxonomy_ncbi.TAXONOMIC_RANKS:
-            self._rankToId[rank] = id
-            self._predAtRankId[id] = {}
-            self._noDefAtRankId[id] = set()
-            id += 1
-
-    def _getRankId(self, ncbid):
+    def __init__(self, taxonomy):
         """
-            Gets a rankId given an ncbi taxon id
-            @rtype: int
+            @param taxonomy: database file in the sqlite3 format; or an evaluation session (see session.EvalSession)
         """
-        rankId = self._ncbidToRankId.get(ncbid, None)
-        if rankId is not None:
-            return rankId
+        if isinstance(taxonomy, session.EvalSession):
+            self._session = taxonomy
+            self._taxonomy = taxonomy.getTaxonomy()
         else:
-            rank = self._taxonomy.getRank(ncbid)
-            if rank is None:
-                return None
-            else:
-                rankId = self._rankToId.get(rank, None)
-                self._ncbidToRankId[ncbid] = rankId
-                return rankId
-
-    def _getParent(self, ncbid):
-        """
-            Gets direct parent ncbi taxon id.
-        """
-        parent = self._ncbidToNcbidParent.get(ncbid, None)
-        if parent is None:
-            parent = self._taxonomy.getParentNcbid(ncbid)
-            self._ncbidToNcbidParent[ncbid] = parent
-        return parent
+            self._session = None
+            self._taxonomy = taxonomy_ncbi.TaxonomyNcbi(taxonomy, preload=True)
 
     def getPredDictAtRank(self, seqToNcbid, rank):
         """
@@ -85,47 +59,70 @@ class _TaxonomyWrapperA():
             @return: mapping, sequence name -> ncbi taxon id at given rank
             @rtype: dict
         """
-        rankId = self._rankToId[rank]
+        seqList = seqToNcbid.keys()
+        ncbidAtRankList = self._taxonomy.getNcbidsAtRank(seqToNcbid.values(), rank).tolist()
         retDict = {}
-        predAtRankBuff = self._predAtRankId[rankId]
-        noDefAtRankBuff = self._noDefAtRankId[rankId]
+        for seq, ncbid in zip(seqList, ncbidAtRankList):
+            if ncbid != -1:
+                retDict[seq] = ncbid
+        return retDict
 
-        for seq, ncbid in seqToNcbid.iteritems():
+    def getLineageAtRanks(self, seqToNcbid, seqList, ranks):
+        """
+            Gets predictions at the given ranks as a matrix.
 
-            pred = predAtRankBuff.get(ncbid, None)
-            if pred is not None:
-                retDict[seq] = pred  # we already know the ncbid at given rank
-                continue
+            @param seqToNcbid: contain mapping, sequence name -> ncbi taxon id
+            @type seqToNcbid: dict
+            @param seqList: sequence names that correspond to the rows of the matrix
+            @param ranks: ranks that correspond to the columns of the matrix
+            @return: matrix [sequence, rank] -> ncbi taxon id at given rank (-1 ~ not defined or not assigned)
+            @rtype: numpy.ndarray
+        """
+        if self._session is not None:
+            return self._session.getLineageAtRanks(seqToNcbid, seqList, ranks)
+        return session.getLineageAtRanks(self._taxonomy, seqToNcbid, seqList, ranks)
+
+    def close(self):
+        if self._session is None:  # the taxonomy of a session is closed by the session
+            self._taxonomy.close()
 
-            if ncbid in noDefAtRankBuff:
-                continue  # the ncbid is not defined at this rank (we already know)
 
-            ncbidRankId = self._getRankId(ncbid)
-            #if ncbidRankId is None:
-            #    noDefAtRankBuff.add(ncbid)
-            #    continue  # we have just found out that the ncbid is not defined at this rank
+def _getDictOrder(labels, codes):
+    """
+        Gets the classes in the order in which a dictionary iterates them if they are inserted in the order of
+        their first occurrence (as the counts of the classes were collected in a loop over the sequences).
 
-            if ncbidRankId == rankId:  # the ncbid is defined already at the right rank
-                predAtRankBuff[ncbid] = ncbid
-                retDict[seq] = ncbid
-                continue
+        @param labels: labels of the classes
+        @param codes: class of each sequence (an index to labels)
+        @return: classes (indices to labels)
+        @rtype: numpy.ndarray
+    """
+    classes, first = numpy.unique(codes, return_index=True)
+    classes = classes[numpy.argsort(first)].tolist()
+    labelToClass = dict(zip(labels[classes].tolist(), classes))
+    return numpy.array([labelToClass[label] for label in dict.fromkeys(labels[classes].tolist())],
+                       dtype=numpy.int64)
 
-            if (ncbidRankId is None) or (ncbidRankId > rankId):  # the right ncbid may be defined at a higher rank
-                current = self._getParent(ncbid)
-                while current is not None:
-                    currentRankId = self._getRankId(current)
-                    if currentRankId == rankId:
-                        retDict[seq] = current
-                        predAtRankBuff[ncbid] = current
-                        break
-                    current = self._getParent(current)
-                if current is None:
-                    noDefAtRankBuff.add(ncbid)  # we have just found out that the ncbid is not defined at this rank
 
-        return retDict
+def _sumInOrder(values):
+    """
+        Adds up the values one by one (numpy "sum" uses pairwise summation, which rounds differently).
+        @rtype: float
+    """
+    if len(values) == 0:
+        return 0.0
+    return float(numpy.cumsum(values)[-1])
 
-    def close(self):
-        self._taxonomy.close()
+
+def _toNcbid(taxonId):
+    """
+        @return: ncbi taxon id as int (-1 ~ not defined)
+        @rtype: int
+    """
+    try:
+        return int(taxonId)
+    except (TypeError, ValueError):
+        return -1
 
 
 class Accuracy():
@@ -139,92 +136,97 @@ class Accuracy():
             @param seqIdToBp: dictionary or a fasta file
             @param seqIdToPred: dictionary or a prediction file
             @param seqIdToTruePred: dictionary or a true prediction file
-            @param taxonomy: database file in the sqlite3 format, or taxonomy object retrieved from not closed Accuracy
+            @param taxonomy: database file in the sqlite3 format, or taxonomy object retrieved from not closed Accuracy,
+                or an evaluation session (see session.EvalSession)
         """
-        if isinstance(seqIdToBp, dict):
+        if seqids.isMapping(seqIdToBp):
             self._seqToBp = seqIdToBp
         else:
             assert os.path.isfile(seqIdToBp)
             self._seqToBp = fasta.getSequenceToBpDict(seqIdToBp)
 
-        if isinstance(seqIdToPred, dict):
+        if seqids.isMapping(seqIdToPred):
             self._seqToPred = seqIdToPred
         else:
             assert os.path.isfile(seqIdToPred)
-            self._seqToPred = cami.readAssignments(seqIdToPred)
+            self._seqToPred = cami.readAssignments(seqIdToPred, name='Accuracy')
 
-        if isinstance(seqIdToTruePred, dict):
+        if seqids.isMapping(seqIdToTruePred):
             self._seqToTrue = seqIdToTruePred
         else:
             assert os.path.isfile(seqIdToTruePred)
-            self._seqToTrue = cami.readAssignments(seqIdToTruePred)
+            self._seqToTrue = cami.readAssignments(seqIdToTruePred, name='Accuracy')
 
         if isinstance(taxonomy, _TaxonomyWrapperA):
             self._taxonomy = taxonomy
+        elif isinstance(taxonomy, session.EvalSession):
+            self._taxonomy = _TaxonomyWrapperA(taxonomy)
         else:
             assert os.path.isfile(taxonomy)
             self._taxonomy = _TaxonomyWrapperA(taxonomy)
 
+        # sequences and their lengths encoded as arrays, the counts are computed from them (see _getRankStats)
+        if isinstance(taxonomy, session.EvalSession) and self._seqToBp is taxonomy.getSeqIdToBp():
+            self._seqList = taxonomy.getSeqList()
+            self._bp = taxonomy.getBpArray().astype(numpy.float64)
+        else:
+            self._seqList = self._seqToBp.keys()
+            self._bp = numpy.array([self._seqToBp[seq] for seq in self._seqList], dtype=numpy.float64)
+        self._rankToStats = {}  # rank -> statistics computed by _computeRankStats
+
         # correct the predictions self._seqToPred
         if correctLabelThreshold is not None:
-            self._seqToPred = self._correctPredictions(
-                self._seqToBp, self._seqToPred, self._seqToTrue, self._taxonomy, correctLabelThreshold)
-
+            self._seqToPred = self._correctPredictions(self._seqToPred, self._seqToTrue, correctLabelThreshold)
 
-    def _correctPredictions(self, seqIdToBp, seqIdToPred, seqIdToTruePred, taxonomy, correctLabelThreshold):
+    def _correctPredictions(self, seqIdToPred, seqIdToTruePred, correctLabelThreshold):
         """
+            Corrects the predictions by mapping them to the most probable label. Going from the lowest rank up,
+            if at least "correctLabelThreshold" of bp of a true clade is predicted as a particular other clade,
+            then the sequences of the true clade that are assigned to this other clade are assigned to the true clade.
 
+            @return: corrected predictions, mapping: sequence name -> ncbi taxon id
+            @rtype: dict
         """
         newPred = {}
 
         ranks = taxonomy_ncbi.TAXONOMIC_RANKS[1:]
         ranks.reverse()
-        for rank in ranks:
-
-            # get true clades at given rank
-            seqIdToLabelRank = taxonomy.getPredDictAtRank(seqIdToTruePred, rank)
-
-            # get pred clades at given rank
-            seqIdToPredRank = taxonomy.getPredDictAtRank(seqIdToPred, rank)
-
-            # map: true taxonId -> seqId
-            labelToSeqIdList = {}
-            for seqId, taxonId in seqIdToLabelRank.iteritems():
-                if taxonId in labelToSeqIdList:
-                    labelToSeqIdList[taxonId].append(seqId)
-                else:
-                    labelToSeqIdList[taxonId] = [seqId]
-
-            for taxonId, seqIdList in labelToSeqIdList.iteritems():
-
-                idToBp = {}
-                sumBp = 0
-                for seqId in seqIdList:
-                    id = seqIdToPredRank.get(seqId, None)
-                    if id is None:
-                        continue
-                    bp = seqIdToBp[seqId]
-                    if id in idToBp:
-                        idToBp[id] += bp
-                    else:
-                        idToBp[id] = bp
-                    sumBp += bp
-
-                entryList = []
-                for id, bp in idToBp.iteritems():
-                    entryList.append((id, bp))
-                if len(entryList) == 0:
-                    continue
-                entryList.sort(key=lambda x: x[1], reverse=True)
-
-                id, bp = entryList[0]
-                if id == taxonId:
-                    continue
-                percent = float(bp) / float(sumBp)
-                if percent >= correctLabelThreshold:
-                    for seqId in seqIdList:
-                        if seqIdToPred.get(seqId, None) == id:
-                            newPred[seqId] = taxonId
+        trueLineage = self._taxonomy.getLineageAtRanks(seqIdToTruePred, self._seqList, ranks)
+        predLineage = self._taxonomy.getLineageAtRanks(seqIdToPred, self._seqList, ranks)
+        pred = numpy.array([_toNcbid(seqIdToPred.get(seq, None)) for seq in self._seqList], dtype=numpy.int64)
+
+        for pos, rank in enumerate(ranks):
+            # true clades and pred clades at given rank, both defined
+            true = trueLineage[:, pos]
+            predAtRank = predLineage[:, pos]
+            labels = numpy.unique(numpy.concatenate((true[true >= 0], predAtRank[predAtRank >= 0])))
+            both = (true >= 0) & (predAtRank >= 0)
+            if not both.any():
+                continue
+            trueCode = numpy.searchsorted(labels, true[both])
+            predCode = numpy.searchsorted(labels, predAtRank[both])
+
+            # bp of the (true clade, pred clade) pairs, for each true clade the pred clade with the most bp
+            pair, pairIdx = numpy.unique(trueCode * len(labels) + predCode, return_inverse=True)
+            pairBp = numpy.bincount(pairIdx, self._bp[both], minlength=len(pair))
+            pairTrue = pair // len(labels)
+            pairPred = pair % len(labels)
+            sumBp = numpy.bincount(pairTrue, pairBp, minlength=len(labels))
+            order = numpy.lexsort((pairPred, -pairBp, pairTrue))
+            first = order[numpy.concatenate(([True], pairTrue[order][1:] != pairTrue[order][:-1]))]
+            first = first[(pairPred[first] != pairTrue[first]) & (sumBp[pairTrue[first]] > 0)]
+            first = first[pairBp[first] / sumBp[pairTrue[first]] >= correctLabelThreshold]
+
+            # the sequences of the true clade predicted as the most probable clade are assigned to the true clade
+            mapTo = numpy.empty(len(labels), dtype=numpy.int64)
+            mapTo.fill(-1)
+            mapTo[pairTrue[first]] = labels[pairPred[first]]
+            mapped = numpy.zeros(len(self._seqList), dtype=numpy.int64)
+            mapped.fill(-1)
+            defined = true >= 0
+            mapped[defined] = mapTo[numpy.searchsorted(labels, true[defined])]
+            for i in numpy.nonzero((mapped >= 0) & (pred == mapped))[0].tolist():
+                newPred[self._seqList[i]] = int(true[i])
 
         for seqId, taxonId in seqIdToPred.iteritems():
             if seqId not in newPred:
@@ -232,6 +234,61 @@ class Accuracy():
 
         return newPred
 
+    def _computeRankStats(self, ranks):
+        """
+            Computes the per class counts at the given ranks at once, all sequences, true labels and predictions are
+            projected to all ranks by one lookup and the classes are counted via "bincount" on the label codes.
+            The counts are stored both as sequence counts and as bp (see _getRankStats).
+
+            @param ranks: compute the counts at these ranks
+        """
+        ranks = [rank for rank in ranks if rank not in self._rankToStats]
+        if len(ranks) == 0:
+            return
+        trueLineage = self._taxonomy.getLineageAtRanks(self._seqToTrue, self._seqList, ranks)
+        predLineage = self._taxonomy.getLineageAtRanks(self._seqToPred, self._seqList, ranks)
+        ones = numpy.ones(len(self._seqList), dtype=numpy.float64)
+
+        for pos, rank in enumerate(ranks):
+            true = trueLineage[:, pos]
+            pred = predLineage[:, pos]
+            trueDef = true >= 0
+            predDef = pred >= 0
+            match = trueDef & (true == pred)
+            labels = numpy.unique(numpy.concatenate((true[trueDef], pred[predDef])))
+            trueCode = numpy.searchsorted(labels, true[trueDef])
+            predCode = numpy.searchsorted(labels, pred[predDef])
+            matchCode = numpy.searchsorted(labels, true[match])
+            otherCorrect = ~(trueDef | predDef)
+
+            stats = {}
+            for asBp, weights in [(False, ones), (True, self._bp)]:
+                t = numpy.bincount(trueCode, weights[trueDef], minlength=len(labels))
+                p = numpy.bincount(predCode, weights[predDef], minlength=len(labels))
+                tp = numpy.bincount(matchCode, weights[match], minlength=len(labels))
+                tOther = weights[~trueDef].sum()
+                tpOther = weights[otherCorrect].sum()
+                stats[asBp] = (t, p, tp, tOther, tpOther)
+            # classes for recall and precision (a class is defined if it contains at least one sequence)
+            stats['classesR'] = stats[False][0] > 0
+            stats['classesP'] = stats[False][1] > 0
+            stats['orderR'] = _getDictOrder(labels, trueCode)
+            stats['orderP'] = _getDictOrder(labels, predCode)
+            self._rankToStats[rank] = stats
+
+    def _getRankStats(self, rank, asBp):
+        """
+            @return: class label arrays (true count, predicted count, true positives), count of sequences
+                that are unassigned at given rank, count of sequences correctly unassigned,
+                mask of classes for recall, mask of classes for precision,
+                order of the classes for recall, order of the classes for precision (see _getDictOrder)
+            @rtype: tuple
+        """
+        self._computeRankStats([rank])
+        stats = self._rankToStats[rank]
+        t, p, tp, tOther, tpOther = stats[asBp]
+        return (t, p, tp, tOther, tpOther, stats['classesR'].copy(), stats['classesP'].copy(), stats['orderR'],
+                stats['orderP'])
 
     def getAccuracy(self, rank, minFracClade=None, minFracPred=None, asBp=True, weightAccordingBinSize=True):
         """
@@ -250,142 +307,69 @@ class Accuracy():
 
             @return: [precision, recall, classPrecisionNum, classRecallNum]
         """
-        predAtRankDict = self._taxonomy.getPredDictAtRank(self._seqToPred, rank)
-        trueAtRankDict = self._taxonomy.getPredDictAtRank(self._seqToTrue, rank)
-        tp = {}  # class label -> count of sequences correctly assigned to clade i
-        t = {}  # class label -> true count of sequences of clade i
-        p = {}  # class label -> count of sequences assigned to clade i
-        tpOther = 0  # count of sequences correctly unassigned
-        tOther = 0  # true count of sequences that are unassigned at given rank
-
-        # iterate over all sequences
-        for seq, seqLen in self._seqToBp.iteritems():
-            # bp
-            if asBp:
-                bp = seqLen
-            else:
-                bp = 1
-
-            # true
-            i = None
-            if seq in trueAtRankDict:
-                i = trueAtRankDict[seq]
-                if i not in t:
-                    t[i] = bp
-                else:
-                    t[i] += bp
-            else:
-                tOther += bp
-                if seq not in predAtRankDict:
-                    tpOther += bp
-
-            # pred
-            j = None
-            if seq in predAtRankDict:
-                j = predAtRankDict[seq]
-                if j not in p:
-                    p[j] = bp
-                else:
-                    p[j] += bp
-
-            # match
-            if i == j and i is not None:
-                if i not in tp:
-                    tp[i] = bp
-                else:
-                    tp[i] += bp
-
-        classesP = p.keys()  # classes for precision
-        classesR = t.keys()  # classes for recall
+        t, p, tp, tOther, tpOther, classesR, classesP, orderR, orderP = self._getRankStats(rank, asBp)
 
         # filter out least abundant TRUE clades
         if minFracClade is not None:
-            sumT = tOther  # true bin containing all sequences undefined at this rank
-            for i in classesR:
-                sumT += t[i]
-            rmList = []
-            for i in classesR:
-                if (sumT == 0) or (float(t[i]) / float(sumT) < minFracClade):
-                    rmList.append(i)
-            for i in rmList:
-                classesR.remove(i)
-            if (sumT == 0) or (float(tOther) / float(sumT) < minFracClade):
+            sumT = tOther + t[classesR].sum()  # true bin containing all sequences undefined at this rank
+            if sumT == 0:
+                classesR[:] = False
                 tOther = 0
+            else:
+                classesR &= t / sumT >= minFracClade
+                if tOther / sumT < minFracClade:
+                    tOther = 0
 
         # filter out least abundant PREDICTED clades
         if minFracPred is not None:
-            sumT = 0
-            for i in classesP:
-                sumT += p[i]
-            rmList = []
-            for i in classesP:
-                if (sumT == 0) or (float(p[i]) / float(sumT) < minFracPred):
-                    rmList.append(i)
-            for i in rmList:
-                classesP.remove(i)
-
-        # zero missing entries
-        for i in classesR:
-            if i not in tp:
-                tp[i] = 0
-            if i not in p:
-                p[i] = 0
-        for i in classesP:
-            if i not in tp:
-                tp[i] = 0
-            if i not in t:
-                t[i] = 0
-
-        wp = {}  # weights for precision
-        wr = {}  # weights for recall
+            sumP = p[classesP].sum()
+            if sumP == 0:
+                classesP[:] = False
+            else:
+                classesP &= p / sumP >= minFracPred
+
+        # the classes are taken in the order of the previous dictionary based implementation, thus the precision and
+        # recall (added up class by class) are exactly the same
+        classesR = orderR[classesR[orderR]]
+        classesP = orderP[classesP[orderP]]
+        t, tpR = t[classesR], tp[classesR]
+        p, tpP = p[classesP], tp[classesP]
+        classesRCount = len(t)
+        classesPCount = len(p)
+
+        wrOther = 0.0
         if weightAccordingBinSize:
             # compute weights of individual bins that correspond to the number of bp/sequences
             # assigned to individual bins
-            sumP = 0.0
-            sumR = 0.0
-            for i in classesP:
-                sumP += p[i]
-            for i in classesR:
-                sumR += t[i]
-            sumR += tOther
-
-            for i in classesP:
-                wp[i] = float(p[i]) / sumP
-            for i in classesR:
-                wr[i] = float(t[i]) / sumR
+            sumP = p.sum()
+            sumR = t.sum() + tOther
+            wp = p / sumP if sumP > 0 else numpy.zeros(classesPCount)
+            wr = t / sumR if sumR > 0 else numpy.zeros(classesRCount)
             if tOther > 0:
-                wrOther = float(tOther) / sumR
+                wrOther = float(tOther / sumR)
         else:
             # all bins are equally important
-            for i in classesP:
-                wp[i] = 1.0 / float(len(classesP))
-
-            for i in classesR:
-                if tOther > 0:
-                    w = 1.0 / float(len(classesR) + 1)
-                    wr[i] = w
-                    wrOther = w
-                else:
-                    wr[i] = 1.0 / float(len(classesR))
-        if len(classesR) == 0 and tOther > 0:
-            wrOther = 1.0
+            wp = numpy.empty(classesPCount)
+            wp.fill(1.0 / classesPCount if classesPCount > 0 else 0.0)
+            wr = numpy.empty(classesRCount)
+            if tOther > 0:
+                wr.fill(1.0 / (classesRCount + 1))
+                wrOther = 1.0 / (classesRCount + 1)
+            else:
+                wr.fill(1.0 / classesRCount if classesRCount > 0 else 0.0)
 
         # precision
-        precision = 0.0
-        for i in classesP:
-            if p[i] > 0:
-                precision += (float(tp[i]) / float(p[i])) * wp[i]
+        nonEmpty = p > 0
+        precision = _sumInOrder((tpP[nonEmpty] / p[nonEmpty]) * wp[nonEmpty])
 
         # recall
-        recall = 0.0
-        classesRCount = len(classesR)
-        for i in classesR:
-            recall += (float(tp[i]) / float(t[i])) * wr[i]
+        nonEmpty = t > 0
+        recall = _sumInOrder((tpR[nonEmpty] / t[nonEmpty]) * wr[nonEmpty])
         if tOther > 0:
-            recall += (float(tpOther) / float(tOther)) * wrOther
+            recall += float(tpOther / tOther) * wrOther
             classesRCount += 1
-            #
-        return [precision, recall, len(classesP), classesRCount]
+
+        return [precision, recall, classesPCount, classesRCount]
 
 
     def getAccuracyPrint(self, ranks, minFracClade, minFracPred, overview=True, asBp=True, weightAccordingBinSize=True):
@@ -396,19 +380,30 @@ class Accuracy():
 
             @rtype: str
         """
-        buff = '# precision, recall, #classes precision, #classes recall, seq. count/bp, weighted bins\n'
+        buff = PRINT_HEADER
+        self._computeRankStats(ranks)
         for rank in ranks:
-            if overview:  # overview
-                buff += str(rank + ',--,--,--,----------,----------\n')
-                buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred, False, False)  # asBp, weighted
-                buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred, True, False)
-                buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred, False, True)
-                buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred, True, True)
-            else:  # custom
-                buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred,
-                                                   asBp=asBp, weightAccordingBinSize=weightAccordingBinSize)
+            buff += self.getAccuracyPrintRank(rank, minFracClade, minFracPred, overview, asBp, weightAccordingBinSize)
         return buff
 
+    def getAccuracyPrintRank(self, rank, minFracClade, minFracPred, overview=True, asBp=True,
+                             weightAccordingBinSize=True):
+        """
+            Gets the precision and recall values at one rank printed as a string (see getAccuracyPrint),
+            the ranks are independent thus they can be computed in parallel and concatenated.
+
+            @rtype: str
+        """
+        if overview:  # overview
+            buff = str(rank + ',--,--,--,----------,----------\n')
+            buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred, False, False)  # asBp, weighted
+            buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred, True, False)
+            buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred, False, True)
+            buff += self.getAccuracyPrintEntry(rank, minFracClade, minFracPred, True, True)
+        else:  # custom
+            buff = self.getAccuracyPrintEntry(rank, minFracClade, minFracPred,
+                                              asBp=asBp, weightAccordingBinSize=weightAccordingBinSize)
+        return buff
 
     def getAccuracyPrintEntry(self, rank, minFracClade, minFracPred, asBp=True, weightAccordingBinSize=True):
         p, r, cp, cr = self.getAccuracy(rank, minFracClade, minFracPred, asBp, weightAccordingBinSize)
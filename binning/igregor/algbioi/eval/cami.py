@@ -20,8 +20,32 @@
 """
 
 import os
+import sys
+import json
+import struct
+import numpy
+
+from algbioi.com import common
+from algbioi.com import compression
 from algbioi.com import csv
 from algbioi.com import fasta
+from algbioi.com import seqids
+
+# approximate size of a batch of lines read at once
+_BATCH_BYTES = 4 * 1024 * 1024
+
+# taxon id stored in a compact mapping for a taxon id that is not an integer (e.g. "NA"), the taxonomy doesn't
+# know it (-1 cannot be used, it stands for the root)
+UNKNOWN_TAXON_ID = 0
+
+# column cache stored next to a cami file (written by the cami.io readers, see cami/cache.py), the cami package
+# is deployed separately, thus the format is read here, the constants must be the same as in cami/cache.py
+# (see cami_test.py)
+CACHE_SUFFIX = '.colcache'
+CACHE_MAGIC = 'CAMICOLS'
+CACHE_VERSION = 1
+# magic, version, cami file size, cami file mtime, cami file fingerprint, metadata length
+_CACHE_HEADER = struct.Struct('<8sIQd20sQ')
 
 
 def concatenate(directory, outputFile):
@@ -71,9 +95,14 @@ def outToCami(ppspOutFile):
 @@SEQUENCEID	TAXID	BINID
 
 """)
-    for line in open(ppspOutFile):
-        name, taxonId = line.strip('\n').split('\t', 2)
-        out.writeText("%s\t%s\t%s\n" % (name, taxonId, taxonId))
+    f = compression.openInput(ppspOutFile)
+    try:
+        # the lines are converted and written in batches
+        for lines in iter(lambda: f.readlines(_BATCH_BYTES), []):
+            out.writeText(''.join(["%s\t%s\t%s\n" % (name, taxonId, taxonId)
+                                   for name, taxonId in (line.strip('\n').split('\t', 2) for line in lines)]))
+    finally:
+        f.close()
     out.close()
 
 
@@ -97,31 +126,137 @@ def getPPSPOutPathList(outDir):
     return retList
 
 
-def readAssignments(assignmentFile):
+def readAssignments(assignmentFile, seqIdIndex=None, duplicates=seqids.LAST_WINS, stats=None, name=None):
     """
-        Reads an assingment file, either in the cami format or in the PPS output (out) format
+        Reads an assingment file, either in the cami format or in the PPS output (out) format, the file can be
+        compressed (e.g. "assignments.cami.gz")
 
-        @rtype: dict
+        @param seqIdIndex: the names are added to this index and the assignments are returned as a compact mapping
+        @type seqIdIndex: seqids.SeqIdIndex
+        @param duplicates: policy for sequences assigned more than once (see seqids.DUPLICATE_POLICIES)
+        @param stats: statistics of the assignments filled by the function (None ~ duplicates reported to stderr)
+        @type stats: seqids.AssignmentStats
+        @param name: name of the caller used in the messages about the duplicates (followed by the file name, None ~ the name of the reader)
+        @rtype: dict or seqids.SeqIdMap (if seqIdIndex is given)
         @return: mapping(name->taxonId)
     """
-    if os.path.basename(assignmentFile).split('.')[-1] == 'cami':
-        return readCami(assignmentFile)
+    suffixes = os.path.basename(assignmentFile).split('.')
+    if suffixes[-1] in compression.SUFFIXES:
+        suffixes.pop()
+    if suffixes[-1] == 'cami':
+        return readCami(assignmentFile, seqIdIndex, duplicates, stats, name or 'readCami')
     else:
-        return csv.predToDict(assignmentFile)
+        return csv.predToDict(assignmentFile, seqIdIndex, duplicates, stats, name or 'predToDict')
+
+
+def readCami(camiAssignFile, seqIdIndex=None, duplicates=seqids.LAST_WINS, stats=None, name='readCami'):
+    """
+        Reads a file in the cami format, the column cache of the file is used if it's up to date.
+        The taxon ids are strings in a dictionary and integers in a compact mapping (UNKNOWN_TAXON_ID if the taxon id
+        is not an integer).
+
+        @param seqIdIndex: the names are added to this index and the assignments are returned as a compact mapping
+        @type seqIdIndex: seqids.SeqIdIndex
+        @param duplicates: policy for sequences assigned more than once (see seqids.DUPLICATE_POLICIES)
+        @param stats: statistics of the assignments filled by the function (None ~ duplicates reported to stderr)
+        @type stats: seqids.AssignmentStats
+        @param name: name of the caller used in the messages about the duplicates (followed by the file name)
+        @rtype: dict or seqids.SeqIdMap (if seqIdIndex is given)
+    """
+    ret = readCamiCache(camiAssignFile, seqIdIndex, duplicates, stats, name)
+    if ret is not None:
+        return ret
+    loader = seqids.AssignmentLoader(duplicates, seqIdIndex, stats, name + ': ' + camiAssignFile)
+    f = compression.openInput(camiAssignFile)
+    try:
+        while True:
+            lines = f.readlines(_BATCH_BYTES)
+            if len(lines) == 0:
+                break
+            names = []
+            taxonIds = []
+            for line in lines:
+                line = line.strip()
+                if not (line.startswith('#') or line.startswith('@') or len(line) == 0):
+                    name, taxonId = line.split('\t')[0:2]
+                    names.append(name)
+                    taxonIds.append(taxonId)
+                else:
+                    print line
+            loader.add(names, taxonIds if seqIdIndex is None else _toTaxonIds(taxonIds))
+    finally:
+        f.close()
+    return loader.getMapping()
 
 
-def readCami(camiAssignFile):
+def _toTaxonIds(taxonIds):
     """
-        Reads a file in the cami format
+        @param taxonIds: taxon ids as strings
+        @return: integer taxon ids, UNKNOWN_TAXON_ID for the taxon ids that are not integers
+        @rtype: list of int
+    """
+    try:
+        return map(int, taxonIds)
+    except ValueError:
+        ret = []
+        for taxonId in taxonIds:
+            try:
+                ret.append(int(taxonId))
+            except ValueError:
+                ret.append(UNKNOWN_TAXON_ID)
+        return ret
+
 
-        @rtype: dict
+def readCamiCache(camiAssignFile, seqIdIndex=None, duplicates=seqids.LAST_WINS, stats=None, name='readCami'):
     """
-    ret = {}
-    for line in open(camiAssignFile):
-        line = line.strip()
-        if not (line.startswith('#') or line.startswith('@') or len(line) == 0):
-            name, taxonId = line.split('\t')[0:2]
-            ret[name] = taxonId
-        else:
-            print line
-    return ret
+        Reads the assignments from the column cache "camiAssignFile.colcache" of a cami binning file.
+        The cache holds the parsed columns of the file, it's valid if the size, the modification time and
+        the fingerprint of the file are the same as when the cache was written.
+
+        @param seqIdIndex: the names are added to this index and the assignments are returned as a compact mapping
+        @param duplicates: policy for sequences assigned more than once (see seqids.DUPLICATE_POLICIES)
+        @param stats: statistics of the assignments filled by the function (None ~ duplicates reported to stderr)
+        @param name: name of the caller used in the messages about the duplicates (followed by the file name)
+        @return: mapping(name->taxonId) or None if there is no valid cache
+        @rtype: dict or seqids.SeqIdMap (if seqIdIndex is given)
+    """
+    cacheFile = camiAssignFile + CACHE_SUFFIX
+    if not os.path.isfile(cacheFile):
+        return None
+    try:
+        f = open(os.path.normpath(cacheFile), 'rb')
+        try:
+            header = f.read(_CACHE_HEADER.size)
+            magic, version, size, mtime, fingerprint, metadataLen = _CACHE_HEADER.unpack(header)
+            if magic == CACHE_MAGIC and version != CACHE_VERSION:
+                sys.stderr.write('Unsupported version %s of the column cache: %s (version %s expected), '
+                                 'the file is parsed\n' % (version, cacheFile, CACHE_VERSION))
+                return None
+            if magic != CACHE_MAGIC or (size, mtime, fingerprint) != common.getFileSignature(camiAssignFile):
+                return None
+            metadata = json.loads(f.read(metadataLen))
+            if metadata['column_definition'][:2] != ['SEQUENCEID', 'TAXID'] \
+                    or [c['type'] for c in metadata['columns'][:2]] != ['str', 'int64']:
+                return None
+            base = _CACHE_HEADER.size + metadataLen
+            n = metadata['rows']
+            blocks = []
+            for offset, length in (metadata['columns'][0]['blocks'][0], metadata['columns'][1]['blocks'][0]):
+                f.seek(base + offset)
+                blocks.append(f.read(length))
+        finally:
+            f.close()
+        names = blocks[0].split('\n') if n > 0 else []
+        taxonIds = numpy.frombuffer(blocks[1], dtype='<i8')
+        if len(names) != n or len(taxonIds) != n:
+            raise ValueError('inconsistent cache file')
+    except (ValueError, KeyError, IndexError, struct.error) as e:
+        sys.stderr.write('Cannot read the column cache: %s (%s)\n' % (cacheFile, e))
+        return None
+    loader = seqids.AssignmentLoader(duplicates, seqIdIndex, stats, name + ': ' + camiAssignFile)
+    if seqIdIndex is not None:
+        loader.add(names, taxonIds)
+    else:
+        # the taxon ids are strings as if the file was parsed
+        loader.add(names, map(str, taxonIds.tolist()))
+    return loader.getMapping()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2014  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Tests of the column caches written by the cami package (cami/cache.py) and read by readCamiCache.
+    The tests are skipped if the cami package is not found at the root of the repository.
+
+    Run from the directory that contains the "algbioi" package: python -m unittest algbioi.eval.cami_test
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from algbioi.com import common
+from algbioi.com import seqids
+from algbioi.eval import cami
+
+_REPOSITORY = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..'))
+try:
+    sys.path.append(_REPOSITORY)
+    from cami import cache as camiCache
+    from cami import io as camiIo
+except ImportError:
+    camiCache = None
+finally:
+    sys.path.remove(_REPOSITORY)
+
+
+@unittest.skipIf(camiCache is None, 'the cami package is not available')
+class TestColumnCache(unittest.TestCase):
+
+    ROWS = [('read%s' % i, str(i % 7 * 1000 + 1), 'bin%s' % (i % 3)) for i in range(50)] + [('read3', '12', 'bin1')]
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.version = camiCache.CACHE_VERSION
+        self.camiFile = os.path.join(self.tmpDir, 'binning.txt')
+        f = open(self.camiFile, 'w')
+        f.write('#CAMI Format for Binning\n@Task:Binning\n@Version:1.0\n@ContestantID:C\n@SampleID:S\n'
+                '@Referencebased:T\n@Assemblybased:T\n@ReplicateInfo:T\n\n@@SEQUENCEID\tTAXID\tBINID\n')
+        f.write(''.join('\t'.join(row) + '\n' for row in self.ROWS))
+        f.close()
+
+    def tearDown(self):
+        camiCache.CACHE_VERSION = self.version
+        shutil.rmtree(self.tmpDir)
+
+    def _writeCache(self):
+        camiIo.BinningReader(self.camiFile).write_cache()
+        self.assertTrue(os.path.isfile(self.camiFile + cami.CACHE_SUFFIX))
+
+    def test_format_constants(self):
+        self.assertEqual(camiCache.CACHE_SUFFIX, cami.CACHE_SUFFIX)
+        self.assertEqual(camiCache.CACHE_MAGIC, cami.CACHE_MAGIC)
+        self.assertEqual(camiCache.CACHE_VERSION, cami.CACHE_VERSION)
+        self.assertEqual(camiCache.HEADER.format, cami._CACHE_HEADER.format)
+        self.assertEqual(camiCache.FINGERPRINT_BLOCK, common.FINGERPRINT_BLOCK)
+        self.assertEqual(camiCache.file_signature(self.camiFile), common.getFileSignature(self.camiFile))
+
+    def test_read_cache_written_by_cami(self):
+        self.assertEqual(None, cami.readCamiCache(self.camiFile))
+        stdout = sys.stdout
+        sys.stdout = StringIO()  # the header of the file is printed
+        try:
+            expected = cami.readCami(self.camiFile, stats=seqids.AssignmentStats())
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(dict((row[0], row[1]) for row in self.ROWS), expected)
+        self._writeCache()
+        self.assertEqual(expected, cami.readCamiCache(self.camiFile, stats=seqids.AssignmentStats()))
+        seqIdIndex = seqids.SeqIdIndex()
+        mapping = cami.readCamiCache(self.camiFile, seqIdIndex, stats=seqids.AssignmentStats())
+        self.assertTrue(isinstance(mapping, seqids.SeqIdMap))
+        self.assertEqual(dict((name, int(value)) for name, value in expected.items()), dict(mapping.items()))
+
+    def test_taxon_id_not_integer(self):
+        f = open(self.camiFile, 'a')
+        f.write('s1\t562\tb1\ns3\tNA\tb2\n')
+        f.close()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            mapping = cami.readCami(self.camiFile, stats=seqids.AssignmentStats())
+            compact = cami.readCami(self.camiFile, seqids.SeqIdIndex(), stats=seqids.AssignmentStats())
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(('562', 'NA'), (mapping['s1'], mapping['s3']))
+        self.assertEqual((562, cami.UNKNOWN_TAXON_ID), (compact['s1'], compact['s3']))
+        self.assertEqual(len(mapping), len(compact))
+
+    def test_other_version_is_not_read(self):
+        camiCache.CACHE_VERSION = cami.CACHE_VERSION + 1
+        self._writeCache()
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertEqual(None, cami.readCamiCache(self.camiFile))
+            message = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertTrue(message.startswith('Unsupported version %s of the column cache' % camiCache.CACHE_VERSION))
+
+
+if __name__ == '__main__':
+    unittest.main()
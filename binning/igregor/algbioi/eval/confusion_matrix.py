@@ -24,24 +24,30 @@
 
 import os
 import argparse
+import numpy
 from algbioi.com import taxonomy_ncbi
 from algbioi.com import csv
 from algbioi.com import fasta as fas
+from algbioi.com import seqids
 from algbioi.eval import cami
+from algbioi.eval import session
 
 
 class _TaxonomyWrapCM():
-    def __init__(self, databaseFile):
+    def __init__(self, taxonomy):
         """
             Taxonomy wrapper that buffers frequently used operations for this module.
-            @param databaseFile: database in the sqlite3 format
+            @param taxonomy: database in the sqlite3 format; or an evaluation session (see session.EvalSession)
         """
-        self._taxonomy = taxonomy_ncbi.TaxonomyNcbi(databaseFile)
+        if isinstance(taxonomy, session.EvalSession):
+            self._session = taxonomy
+            self._taxonomy = taxonomy.getTaxonomy()
+        else:
+            self._session = None
+            self._taxonomy = taxonomy_ncbi.TaxonomyNcbi(taxonomy, preload=True)
         # buffers
         self._rankToRankId = {}
         self._rankIdToRank = {}
-        self._taxonIdToParentTaxonId = {}
-        self._taxonIdToRankId = {}
         self._taxonIdToScientificName = {}
         # map: rank <-> rankId
         rankId = 0
@@ -50,28 +56,27 @@ class _TaxonomyWrapCM():
             self._rankIdToRank[rankId] = rank
             rankId += 1
 
-    def getParent(self, taxonId):
-        """
-            @return: parent taxonId
-            @rtype int
+    def getPredAtRanks(self, seqNameToTaxonId, seqNameList, rankIdsList):
         """
-        parentId = self._taxonIdToParentTaxonId.get(taxonId, None)
-        if parentId is None:
-            parentId = self._taxonomy.getParentNcbid(taxonId)
-            self._taxonIdToParentTaxonId[taxonId] = parentId
-        return parentId
-
-    def getRankIdOfTaxonId(self, taxonId):
+            Gets the predictions projected to the given ranks.
+
+            @param seqNameToTaxonId: mapping, sequence name -> taxonId
+            @type seqNameToTaxonId: dict
+            @param seqNameList: sequence names, the resulting arrays are aligned with this list
+            @param rankIdsList: ids of the ranks (see method getRankId)
+            @type rankIdsList: list of int
+            @return: mapping, rankId -> array of taxonIds at the rank (-1 ~ not assigned at the rank)
+            @rtype: dict
         """
-            @return: rankId of the taxonId (ids correspond to method getRankId)
-            @rtype: int
-        """
-        rankId = self._taxonIdToRankId.get(taxonId, None)
-        if rankId is None:
-            rank = self._taxonomy.getRank(taxonId)
-            rankId = self._rankToRankId.get(rank, None)
-            self._taxonIdToRankId[taxonId] = rankId
-        return rankId
+        ranks = [self._rankIdToRank[rankId] for rankId in rankIdsList]
+        if self._session is not None:
+            lineage = self._session.getLineageAtRanks(seqNameToTaxonId, seqNameList, ranks)
+        else:
+            lineage = session.getLineageAtRanks(self._taxonomy, seqNameToTaxonId, seqNameList, ranks)
+        rankIdToPred = {}
+        for pos, rankId in enumerate(rankIdsList):
+            rankIdToPred[rankId] = lineage[:, pos]
+        return rankIdToPred
 
     def getRankId(self, rank):
         """
@@ -122,7 +127,8 @@ class _TaxonomyWrapCM():
         return name
 
     def close(self):
-        self._taxonomy.close()
+        if self._session is None:  # the taxonomy of a session is closed by the session
+            self._taxonomy.close()
 
 
 class ConfusionMatrix():
@@ -138,11 +144,12 @@ class ConfusionMatrix():
                 @type seqNameToRefPred: dict; or a tab separated file, first column ~ sequence name, last column taxonId
             @param ranksList: list of ranks for which the confusion matrices will be computed (None ~ all default ranks)
                 @type ranksList: list of str
-            @param taxonomy: database file in the sqlite3 format; or taxonomy returned by function "getTaxonomy"
+            @param taxonomy: database file in the sqlite3 format; or taxonomy returned by function "getTaxonomy";
+                or an evaluation session (see session.EvalSession)
         """
         # Check input options and read in the data (if appropriate)
         self._initFailed = False  # replace this with exceptions!
-        if isinstance(seqNameToBp, dict):
+        if seqids.isMapping(seqNameToBp):
             self._seqNameToBp = seqNameToBp
         elif isinstance(seqNameToBp, str) and os.path.isfile(seqNameToBp):
             self._seqNameToBp = fas.getSequenceToBpDict(seqNameToBp)
@@ -150,18 +157,18 @@ class ConfusionMatrix():
             print("Can't get sequence info from:", seqNameToBp)
             self._initFailed = True
             return
-        if isinstance(seqNameToPred, dict):
+        if seqids.isMapping(seqNameToPred):
             self._seqNameToPred = seqNameToPred
         elif isinstance(seqNameToPred, str) and os.path.isfile(seqNameToPred):
-            self._seqNameToPred = cami.readAssignments(seqNameToPred)
+            self._seqNameToPred = cami.readAssignments(seqNameToPred, name='ConfusionMatrix')
         else:
             print("Can't get prediction info from:", seqNameToPred)
             self._initFailed = True
             return
-        if isinstance(seqNameToRefPred, dict):
+        if seqids.isMapping(seqNameToRefPred):
             self._seqNameToRefPred = seqNameToRefPred
         elif isinstance(seqNameToRefPred, str) and os.path.isfile(seqNameToRefPred):
-            self._seqNameToRefPred = cami.readAssignments(seqNameToRefPred)
+            self._seqNameToRefPred = cami.readAssignments(seqNameToRefPred, name='ConfusionMatrix')
         else:
             print("Can't get reference prediction info from:", seqNameToRefPred)
             self._initFailed = True
@@ -170,6 +177,8 @@ class ConfusionMatrix():
             self._taxonomy = _TaxonomyWrapCM(taxonomy)
         elif isinstance(taxonomy, _TaxonomyWrapCM):
             self._taxonomy = taxonomy
+        elif isinstance(taxonomy, session.EvalSession):
+            self._taxonomy = _TaxonomyWrapCM(taxonomy)
         else:
             print("Can't use taxonomy: ", taxonomy)
         if ranksList is None:
@@ -186,29 +195,19 @@ class ConfusionMatrix():
             rankIdsList.append(self._taxonomy.getRankId(rank))
         self._allowedRankIdsSet = set(rankIdsList)
 
-        # get predictions at different taxonomic ranks
-        # rankId -> (seqId -> taxonIdAtRank)
-        self._rankIdToPredMap = {}
-        self._rankIdToRefMap = {}
-        for rankId in rankIdsList:
-            self._rankIdToPredMap[rankId] = {}
-            self._rankIdToRefMap[rankId] = {}
-
-        # get predictions at given ranks
-        for seqId, taxonId in self._seqNameToPred.iteritems():
-            while (taxonId is not None) and (taxonId != 1):
-                rankId = self._taxonomy.getRankIdOfTaxonId(taxonId)
-                if rankId in self._allowedRankIdsSet:
-                    self._rankIdToPredMap[rankId][seqId] = taxonId
-                taxonId = self._taxonomy.getParent(taxonId)
+        # sequences and their lengths as arrays
+        if isinstance(taxonomy, session.EvalSession) and self._seqNameToBp is taxonomy.getSeqIdToBp():
+            seqNameList = taxonomy.getSeqList()
+            self._bp = taxonomy.getBpArray()
+        else:
+            seqNameList = self._seqNameToBp.keys()
+            self._bp = numpy.array([self._seqNameToBp[seqName] for seqName in seqNameList], dtype=numpy.int64)
+
+        # get predictions at given ranks, rankId -> array of taxonIdAtRank (aligned with seqNameList)
+        self._rankIdToPred = self._taxonomy.getPredAtRanks(self._seqNameToPred, seqNameList, rankIdsList)
 
         # get reference predictions at given ranks
-        for seqId, taxonId in self._seqNameToRefPred.iteritems():
-            while (taxonId is not None) and (taxonId != 1):
-                rankId = self._taxonomy.getRankIdOfTaxonId(taxonId)
-                if rankId in self._allowedRankIdsSet:
-                    self._rankIdToRefMap[rankId][seqId] = taxonId
-                taxonId = self._taxonomy.getParent(taxonId)
+        self._rankIdToRef = self._taxonomy.getPredAtRanks(self._seqNameToRefPred, seqNameList, rankIdsList)
 
     def generateConfusionMatrix(self, rank, prefixOutputPath):
         """
@@ -228,31 +227,11 @@ class ConfusionMatrix():
                   os.path.dirname(prefixOutputPath))
             return
 
-        # entries of the confusion matrix
-        tableCountMap = {}  # (taxonId_ref, taxonId_pred) -> count
-        tableBpMap = {}  # (taxonId_ref, taxonId_pred) -> bp
-
         # predictions (and reference) at the given rank
-        seqNameToPred = self._rankIdToPredMap[rankId]
-        seqNameToRef = self._rankIdToRefMap[rankId]
-        predTaxonIdSet = set()
-        refTaxonIdSet = set()
-
-        # fill in entries of the confusion matrix
-        for seqId, bp in self._seqNameToBp.iteritems():
-            predId = seqNameToPred.get(seqId, None)
-            refId = seqNameToRef.get(seqId, None)
-            if predId is not None:
-                predTaxonIdSet.add(predId)  # stores it only if it's predicted at this rank
-            if refId is not None:
-                refTaxonIdSet.add(refId)
-            key = (refId, predId)
-            if key not in tableCountMap:
-                tableCountMap[key] = 1
-                tableBpMap[key] = bp
-            else:
-                tableCountMap[key] += 1
-                tableBpMap[key] += bp
+        pred = self._rankIdToPred[rankId]
+        ref = self._rankIdToRef[rankId]
+        predTaxonIdSet = set(numpy.unique(pred[pred >= 0]).tolist())  # only taxa predicted at this rank
+        refTaxonIdSet = set(numpy.unique(ref[ref >= 0]).tolist())
 
         # get taxonIds contained in prediction and reference prediction, common for both, unique for pred. and ref.
         commonTaxonIdSet = predTaxonIdSet.intersection(refTaxonIdSet)
@@ -264,73 +243,47 @@ class ConfusionMatrix():
         uniquePredNames, uniquePredMap = self._taxonomy.getSortedScientificNames(uniquePredIdSet)
         uniqueRefNames, uniqueRefMap = self._taxonomy.getSortedScientificNames(uniqueRefIdSet)
 
-        # headers
+        # headers, the common taxa are at the same positions in both headers, unassigned is the last column (row)
         predHeader = commonNames + uniquePredNames + ['unassigned']  # predictions
         refHeader = commonNames + uniqueRefNames + ['unassigned']  # reference
-        predHeaderTaxonIds = []
-        refHeaderTaxonIds = []
-        for name in commonNames:
-            id = commonMap[name]
-            predHeaderTaxonIds.append(id)
-            refHeaderTaxonIds.append(id)
-        for name in uniquePredNames:
-            predHeaderTaxonIds.append(uniquePredMap[name])
-        for name in uniqueRefNames:
-            refHeaderTaxonIds.append(uniqueRefMap[name])
-        predHeaderTaxonIds.append(None)  # predicted as unassigned
-        refHeaderTaxonIds.append(None)  # unassigned in reference
-
-        # count matches
-        matchCount = 0
-        matchBp = 0
-        for taxonId in commonTaxonIdSet:
-            count = tableCountMap.get((taxonId, taxonId), None)
-            if count is not None:
-                bp = tableBpMap.get((taxonId, taxonId), None)
-                assert bp is not None
-                matchCount += count
-                matchBp += bp
-
-        # count mismatches
-        mismatchCount = 0
-        mismatchBp = 0
-        for predTaxonId in predHeaderTaxonIds[:-1]:
-            for refTaxonId in refHeaderTaxonIds[:-1]:
-                if predTaxonId == refTaxonId:
-                    continue
-                assert (predTaxonId is not None) and (refTaxonId is not None)
-                count = tableCountMap.get((refTaxonId, predTaxonId), None)
-                if count is not None:
-                    bp = tableBpMap.get((refTaxonId, predTaxonId), None)
-                    assert bp is not None
-                    mismatchCount += count
-                    mismatchBp += bp
-
-        # count pred total, ref total
-        predTotalCount = 0
-        predTotalBp = 0
-        refTotalCount = 0
-        refTotalBp = 0
-        for predTaxonId in predHeaderTaxonIds:
-            for refTaxonId in refHeaderTaxonIds:
-                count = tableCountMap.get((refTaxonId, predTaxonId), None)
-                if count is None:
-                    continue
-                bp = tableBpMap.get((refTaxonId, predTaxonId), None)
-                assert bp is not None
-                if predTaxonId is not None:
-                    predTotalCount += count
-                    predTotalBp += bp
-                if refTaxonId is not None:
-                    refTotalCount += count
-                    refTotalBp += bp
+        commonTaxonIds = [commonMap[name] for name in commonNames]
+        predHeaderTaxonIds = commonTaxonIds + [uniquePredMap[name] for name in uniquePredNames]
+        refHeaderTaxonIds = commonTaxonIds + [uniqueRefMap[name] for name in uniqueRefNames]
+        commonCount = len(commonTaxonIds)
+        colCount = len(predHeader)
+        rowCount = len(refHeader)
+
+        # entries of the confusion matrix as a sparse matrix in the coordinate format sorted by rows and columns,
+        # i.e. (row, column) pairs of the sequences are coded as (row * colCount + column)
+        col = self._getHeaderPos(predHeaderTaxonIds, pred)
+        row = self._getHeaderPos(refHeaderTaxonIds, ref)
+        cell, cellIdx = numpy.unique(row * colCount + col, return_inverse=True)
+        entryCount = numpy.bincount(cellIdx, minlength=len(cell)).astype(numpy.int64)
+        entryBp = numpy.bincount(cellIdx, self._bp, minlength=len(cell)).astype(numpy.int64)
+        entryRow = cell // colCount
+        entryCol = cell % colCount
+
+        # count matches (diagonal of the common taxa)
+        match = (entryRow == entryCol) & (entryRow < commonCount)
+        matchCount = int(entryCount[match].sum())
+        matchBp = int(entryBp[match].sum())
+
+        # count mismatches (assigned in both but not on the diagonal)
+        mismatch = (~match) & (entryRow < rowCount - 1) & (entryCol < colCount - 1)
+        mismatchCount = int(entryCount[mismatch].sum())
+        mismatchBp = int(entryBp[mismatch].sum())
+
+        # count pred total, ref total (all but the unassigned column, row)
+        predAssigned = entryCol < colCount - 1
+        predTotalCount = int(entryCount[predAssigned].sum())
+        predTotalBp = int(entryBp[predAssigned].sum())
+        refAssigned = entryRow < rowCount - 1
+        refTotalCount = int(entryCount[refAssigned].sum())
+        refTotalBp = int(entryBp[refAssigned].sum())
 
         # total
-        totalCount = 0
-        totalBp = 0
-        for bp in self._seqNameToBp.values():
-            totalCount += 1
-            totalBp += bp
+        totalCount = len(self._bp)
+        totalBp = int(self._bp.sum())
 
         # write the confusion matrix to a file
         out = csv.OutFileBuffer(os.path.normpath(prefixOutputPath + '.' + str(rank) + '_cmp.csv'))
@@ -340,18 +293,15 @@ class ConfusionMatrix():
             header += ', ' + e
         out.writeText(header + '\n')
 
-        for i in range(len(refHeaderTaxonIds)):
-            line = refHeader[i]
-            refTaxonId = refHeaderTaxonIds[i]
-            for j in range(len(predHeaderTaxonIds)):
-                predTaxonId = predHeaderTaxonIds[j]
-                count = tableCountMap.get((refTaxonId, predTaxonId), None)
-                line += ', '
-                if count is not None:
-                    bp = tableBpMap.get((refTaxonId, predTaxonId), None)
-                    assert bp is not None
-                    line += str(int(round(float(bp) / 1000.0))) + 'k (' + str(count) + ')'
-            out.writeText(line + '\n')
+        rowStart = numpy.searchsorted(entryRow, numpy.arange(rowCount + 1)).tolist()
+        entryCol = entryCol.tolist()
+        entryCount = entryCount.tolist()
+        entryBp = entryBp.tolist()
+        for i in range(rowCount):
+            entries = [''] * colCount
+            for e in range(rowStart[i], rowStart[i + 1]):
+                entries[entryCol[e]] = str(int(round(float(entryBp[e]) / 1000.0))) + 'k (' + str(entryCount[e]) + ')'
+            out.writeText(refHeader[i] + ', ' + ', '.join(entries) + '\n')
 
         out.writeText(',\n')
         out.writeText('Matches, ' + str(int(round(float(matchBp) / 1000.0))) + 'k, ' + str(matchCount) + ', ' +
@@ -373,6 +323,20 @@ class ConfusionMatrix():
         out.writeText('Total fasta, ' + str(int(round(float(totalBp) / 1000.0))) + 'k, ' + str(totalCount) + '\n')
         out.close()
 
+    def _getHeaderPos(self, headerTaxonIds, taxonIds):
+        """
+            @param headerTaxonIds: taxonIds of the header (without the last column 'unassigned')
+            @param taxonIds: array of taxonIds (-1 ~ unassigned)
+            @return: array of positions of the taxonIds in the header
+        """
+        headerTaxonIds = numpy.array(headerTaxonIds, dtype=numpy.int64)
+        order = numpy.argsort(headerTaxonIds)
+        pos = numpy.empty(len(taxonIds), dtype=numpy.int64)
+        pos.fill(len(headerTaxonIds))
+        assigned = taxonIds >= 0
+        pos[assigned] = order[numpy.searchsorted(headerTaxonIds[order], taxonIds[assigned])]
+        return pos
+
     def _div(self, dividend, divisor, roundNDigits):
         if abs(divisor) < 0.000001:
             return 'NaN'
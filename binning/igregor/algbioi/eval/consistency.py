@@ -22,19 +22,39 @@
 import os
 import sys
 import argparse
+import numpy
+from array import array
+from itertools import chain, compress
 
 from algbioi.eval import cami
+from algbioi.eval import session
+from algbioi.com import seqids
+from algbioi.com import parallel
 from algbioi.com.csv import getMapping
 from algbioi.com.fasta import getSequenceToBpDict
 from algbioi.com.taxonomy_ncbi import TaxonomyNcbi
 
+# scaffolds with fewer different taxa are processed by walking the parents (the LCA index doesn't pay off)
+MIN_TAXA_LCA = 16
+
+# number of parts (of about the same number of contigs) per process into which the scaffolds are split
+CHUNKS_PER_JOB = 4
+
 
 class _TaxonomyWrapper():
     """
         Wraps the taxonomy to buffer (speed up) taxonomy calls.
     """
-    def __init__(self, databaseFile):
-        self._taxonomy = TaxonomyNcbi(databaseFile)
+    def __init__(self, taxonomy):
+        """
+            @param taxonomy: database file in the sqlite3 format; or an evaluation session (see session.EvalSession)
+        """
+        if isinstance(taxonomy, session.EvalSession):
+            self._session = taxonomy
+            self._taxonomy = taxonomy.getTaxonomy()
+        else:
+            self._session = None
+            self._taxonomy = TaxonomyNcbi(taxonomy, preload=True)
         self._ncbidToNcbidParent = dict()
         self._closed = False
 
@@ -92,54 +112,78 @@ class _TaxonomyWrapper():
     def getScientificName(self, ncbid):
         return self._taxonomy.getScientificName(ncbid)
 
+    def getAncestorIndex(self):
+        """
+            Gets the depths and the LCA index of the taxa (the same parents as returned by "getParent").
+            @rtype: taxonomy_ncbi.AncestorIndex
+        """
+        return self._taxonomy.getAncestorIndex()
+
     def close(self):
         """ To free resources. """
-        self._taxonomy.close()
+        if self._session is None:  # the taxonomy of a session is closed by the session
+            self._taxonomy.close()
         self._closed = True
 
     def isClosed(self):
         return self._closed
 
 
-class ScScaffold():
+class ScScaffold(object):
     """
-        Represents one scaffold.
+        Represents one scaffold, a view of one row of the scaffold store (see _ScaffoldStore).
     """
-    def __init__(self, name, ncbid, pathSet, weightedDistToPath, contigsNameList, contigNameToNcbid,
-                 ncbidToBp, ncbidToWeight, ncbidToDist, ncbidToLeafDist):
-        self._name = name
-        self._ncbid = ncbid
-        self._pathSet = pathSet
-        self._weightedDistToPath = weightedDistToPath
-        self._contigsNameList = contigsNameList
-        self._contigNameToNcbid = contigNameToNcbid
-        self._ncbidToBp = ncbidToBp
-        self._ncbidToWeight = ncbidToWeight
-        self._ncbidToDist = ncbidToDist
-        self._ncbidToLeafDist = ncbidToLeafDist
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        """
+            @type store: _ScaffoldStore
+            @param row: index of the scaffold in the store
+        """
+        self._store = store
+        self._row = row
+
+    def _getRecords(self):
+        """
+            Gets the indices of the (scaffold, ncbid) records of this scaffold.
+        """
+        return xrange(self._store.recordOffsets[self._row], self._store.recordOffsets[self._row + 1])
+
+    def _getContigRecords(self):
+        """
+            Gets the record (see method "_getRecords") of each contig of this scaffold.
+        """
+        return self._store.contigRecord[self._store.contigOffsets[self._row]:self._store.contigOffsets[self._row + 1]]
+
+    def _getRecord(self, ncbid):
+        for i in self._getRecords():
+            if self._store.recordNcbid[i] == ncbid:
+                return i
+        return None
 
     def getName(self):
-        return self._name
+        return self._store.names[self._row]
 
     def getNcbid(self):
         """
             Returns ncbid according to which the consistency of this Scaffold was computed.
         """
-        return self._ncbid
+        return self._store.ncbid[self._row]
 
     def getPathSet(self):
         """
             Get the path from the root to the ncbid according to which this scaffold was assigned,
             the path is represented as a set.
         """
-        return self._pathSet
+        return set(self._store.pathNcbid[self._store.pathOffsets[self._row]:self._store.pathOffsets[self._row + 1]])
 
     def getToLeafDist(self, ncbid):
         """
             Get the distance from the argument ncbid to the ncbid to which the scaffold was assigned.
         """
-        if ncbid in self._ncbidToLeafDist:
-            return self._ncbidToLeafDist[ncbid]
+        i = self._getRecord(ncbid)
+        if i is not None:
+            return self._store.recordLeafDist[i]
         else:
             return None
 
@@ -147,8 +191,9 @@ class ScScaffold():
         """
             Get the distance from the argument ncbid to the path according to which this scaffold was assigned.
         """
-        if ncbid in self._ncbidToDist:
-            return self._ncbidToDist[ncbid]
+        i = self._getRecord(ncbid)
+        if i is not None:
+            return self._store.recordDist[i]
         else:
             return None
 
@@ -156,15 +201,15 @@ class ScScaffold():
         """
             Gets all contigs' names of this scaffold as a list.
         """
-        return self._contigsNameList
+        return self._store.contigLists[self._row]
 
     def getCollectiveLength(self):
         """
             Get the sum of the lengths (in bp) of all constituent contigs.
         """
         length = 0.0
-        for ncbid in self._ncbidToBp:
-            length += self._ncbidToBp[ncbid]
+        for i in self._getRecords():
+            length += self._store.recordBp[i]
         return length
 
     def getConsistencyTotal(self, asCount=False):
@@ -172,14 +217,14 @@ class ScScaffold():
             Consistency: def 1.
         """
         consistentCount = 0.0
-        for contigName in self._contigsNameList:
-            ncbid = self._contigNameToNcbid[contigName]
-            if ncbid in self._pathSet:
+        contigRecords = self._getContigRecords()
+        for i in contigRecords:
+            if self._store.recordOnPath[i]:
                 consistentCount += 1
         if asCount:
             return float(consistentCount)
         else:
-            return float(consistentCount) / len(self._contigsNameList)
+            return float(consistentCount) / len(contigRecords)
 
     def getConsistencyTotalBp(self, asBpCount=False):
         """
@@ -187,9 +232,9 @@ class ScScaffold():
         """
         consistentBp = 0.0
         sumBp = 0.0
-        for ncbid in self._ncbidToBp:
-            bp = self._ncbidToBp[ncbid]
-            if ncbid in self._pathSet:
+        for i in self._getRecords():
+            bp = self._store.recordBp[i]
+            if self._store.recordOnPath[i]:
                 consistentBp += bp
             sumBp += bp
         if asBpCount:
@@ -202,47 +247,282 @@ class ScScaffold():
             Consistency: def3.
         """
         sumDist = 0.0
-        for contigName in self._contigsNameList:
-            ncbid = self._contigNameToNcbid[contigName]
-            sumDist += self._ncbidToDist[ncbid]
+        contigRecords = self._getContigRecords()
+        for i in contigRecords:
+            sumDist += self._store.recordDist[i]
         if asTotalCount:
             return float(sumDist)
         else:
-            return float(sumDist) / len(self._contigsNameList)
+            return float(sumDist) / len(contigRecords)
 
     def getConsistencyWeightedAvgDist(self):
         """
             Consistency: def4.
         """
-        return self._weightedDistToPath
+        return self._store.weightedDistToPath[self._row]
 
     def getConsistencyAvgDistLeaf(self, asTotalCount=False):
         """
             Consistency: def5.
         """
         sumDist = 0.0
-        for contigName in self._contigsNameList:
-            ncbid = self._contigNameToNcbid[contigName]
-            sumDist += self._ncbidToLeafDist[ncbid]
+        contigRecords = self._getContigRecords()
+        for i in contigRecords:
+            sumDist += self._store.recordLeafDist[i]
         if asTotalCount:
             return float(sumDist)
         else:
-            return float(sumDist) / len(self._contigsNameList)
+            return float(sumDist) / len(contigRecords)
 
     def getConsistencyAvgWeightedDistLeaf(self):
         """
             Consistency: def6.
         """
         sumDist = 0.0
-        for ncbid in self._ncbidToWeight:
-            sumDist += float(self._ncbidToWeight[ncbid]) * self._ncbidToLeafDist[ncbid]
+        for i in self._getRecords():
+            sumDist += self._store.recordWeight[i] * self._store.recordLeafDist[i]
         return float(sumDist)
 
 
+def _toNumpy(arr):
+    """
+        Gets a numpy array sharing the memory of an array.array.
+    """
+    if len(arr) == 0:
+        return numpy.zeros(0, dtype=arr.typecode)
+    return numpy.frombuffer(arr, dtype=arr.typecode)
+
+
+class _ScaffoldContigIndex():
+    """
+        Scaffold-contig mapping stored in CSR arrays, the contigs of scaffold "row" are
+        contigs[offsets[row]:offsets[row + 1]], so that the scaffolds can be filtered by array predicates.
+    """
+    def __init__(self, scaffToContigsList, contigNameToBp, contigToPred, considerContigWithNoScaff=True):
+        """
+            Contigs that have no length are removed from the lists of the mapping, contigs that are predicted but
+            don't belong to any scaffold are added as artificial scaffolds (if considerContigWithNoScaff).
+
+            @param scaffToContigsList: scaffold name -> list of contig names (modified)
+            @param contigNameToBp: contig name -> bp
+            @param contigToPred: contig name -> ncbid
+        """
+        self.names = scaffToContigsList.keys()
+        self.contigLists = [scaffToContigsList[scaffName] for scaffName in self.names]
+        self.contigs = list(chain.from_iterable(self.contigLists))
+        counts = numpy.fromiter(map(len, self.contigLists), dtype=numpy.int64, count=len(self.names))
+        self.bp, hasBp = seqids.getArray(contigNameToBp, self.contigs)
+
+        # if a contig that is defined in the mapping doesn't exist (in the fasta file) we remove it
+        if not hasBp.all():
+            rows = numpy.repeat(numpy.arange(len(self.names)), counts)
+            for row in numpy.unique(rows[~hasBp]).tolist():
+                contigsList = self.contigLists[row]
+                contigsList[:] = [contig for contig in contigsList if contig in contigNameToBp]
+            self.contigs = list(compress(self.contigs, hasBp.tolist()))
+            self.bp = self.bp[hasBp]
+            counts = numpy.bincount(rows[hasBp], minlength=len(self.names))
+
+        # if a contig was predicted but there is no scaffold assigned to it then this
+        # contig is assigned to an "artificial scaffold"
+        if considerContigWithNoScaff:
+            scaffContigSet = set(self.contigs)
+            aloneContigList = [c for c in contigToPred if c not in scaffContigSet]
+            for c in aloneContigList:
+                scaffName = str('scaffold_' + c)  # make up a scaffold name
+                assert scaffName not in scaffToContigsList, 'The names of contigs are ambiguous!'
+                scaffToContigsList[scaffName] = [c]
+                self.names.append(scaffName)
+                self.contigLists.append(scaffToContigsList[scaffName])
+            self.contigs += aloneContigList
+            self.bp = numpy.concatenate((self.bp, seqids.getArray(contigNameToBp, aloneContigList)[0]))
+            counts = numpy.concatenate((counts, numpy.ones(len(aloneContigList), dtype=counts.dtype)))
+
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+        self.rows = numpy.repeat(numpy.arange(len(self.names)), counts)
+        self.pred = seqids.getArray(contigToPred, self.contigs)[0]  # -1 if the contig wasn't assigned
+        self.contigCount = counts
+        self.bpSum = numpy.bincount(self.rows, weights=self.bp, minlength=len(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def getMask(self, minScaffContigCount=None, minScaffBpLen=None, cladesSet=None):
+        """
+            Gets the scaffolds that pass the constrains (see Consistency).
+
+            @return: one entry per scaffold, True if the scaffold passes
+            @rtype: numpy.ndarray
+        """
+        mask = numpy.ones(len(self.names), dtype=bool)
+        if minScaffContigCount is not None:
+            mask &= self.contigCount >= minScaffContigCount
+        if minScaffBpLen is not None:
+            mask &= self.bpSum >= minScaffBpLen
+        if cladesSet is not None:
+            inClades = numpy.in1d(self.pred, numpy.fromiter(cladesSet, dtype=numpy.int64, count=len(cladesSet)))
+            mask &= numpy.bincount(self.rows, weights=inClades, minlength=len(self.names)) > 0
+        return mask
+
+    def split(self, rows, count):
+        """
+            Splits the scaffolds into consecutive parts that contain about the same number of contigs.
+
+            @param rows: rows of the scaffolds
+            @param count: maximum number of parts
+            @return: rows of the scaffolds of each non-empty part
+            @rtype: list of numpy.ndarray
+        """
+        cumulative = numpy.cumsum(self.contigCount[rows])
+        bounds = numpy.searchsorted(cumulative, numpy.linspace(0, cumulative[-1], count + 1)[1:-1], side='right')
+        return [part for part in numpy.split(rows, bounds) if len(part) > 0]
+
+
+class _ScaffoldStore():
+    """
+        Pre-processed consistency information of all scaffolds stored in flat arrays (one row per scaffold).
+
+        Scaffold "row" consists of:
+            the contigs contigOffsets[row]:contigOffsets[row + 1] (the record of each contig in contigRecord),
+            the (scaffold, ncbid) records recordOffsets[row]:recordOffsets[row + 1] and
+            the path from the root pathOffsets[row]:pathOffsets[row + 1] (in pathNcbid).
+    """
+    def __init__(self):
+        self.names = []
+        self.contigLists = []
+        self.ncbid = array('l')
+        self.weightedDistToPath = array('d')
+        self.contigOffsets = array('l', [0])
+        self.contigRecord = array('l')
+        self.recordOffsets = array('l', [0])
+        self.recordNcbid = array('l')
+        self.recordBp = array('l')
+        self.recordWeight = array('d')
+        self.recordDist = array('d')
+        self.recordLeafDist = array('d')
+        self.recordOnPath = array('b')
+        self.pathOffsets = array('l', [0])
+        self.pathNcbid = array('l')
+
+    def append(self, name, contigsList, ncbid, pathSet, weightedDistToPath, contigNcbids, ncbidToBp, ncbidToWeight,
+               ncbidToDist, ncbidToLeafDist):
+        """
+            Appends one scaffold (see Consistency._processScaffold).
+
+            @return: row of the scaffold
+        """
+        ncbidToRecord = dict()
+        for recordNcbid, weight in ncbidToWeight.iteritems():
+            ncbidToRecord[recordNcbid] = len(self.recordNcbid)
+            self.recordNcbid.append(recordNcbid)
+            self.recordBp.append(ncbidToBp[recordNcbid])
+            self.recordWeight.append(weight)
+            self.recordDist.append(ncbidToDist[recordNcbid])
+            self.recordLeafDist.append(ncbidToLeafDist[recordNcbid])
+            self.recordOnPath.append(recordNcbid in pathSet)
+        self.recordOffsets.append(len(self.recordNcbid))
+        for contigNcbid in contigNcbids:
+            self.contigRecord.append(ncbidToRecord[contigNcbid])
+        self.contigOffsets.append(len(self.contigRecord))
+        self.pathNcbid.extend(pathSet)
+        self.pathOffsets.append(len(self.pathNcbid))
+        self.names.append(name)
+        self.contigLists.append(contigsList)
+        self.ncbid.append(ncbid)
+        self.weightedDistToPath.append(weightedDistToPath)
+        return len(self.names) - 1
+
+    def extend(self, other, scaffToContigsList):
+        """
+            Appends all scaffolds of another store (e.g. filled by another process).
+
+            @type other: _ScaffoldStore
+            @param scaffToContigsList: scaffold name -> list of contig names (the lists are not sent between
+                the processes)
+        """
+        recordBase = len(self.recordNcbid)
+        contigBase = len(self.contigRecord)
+        pathBase = len(self.pathNcbid)
+        self.recordOffsets.extend(offset + recordBase for offset in other.recordOffsets[1:])
+        self.contigOffsets.extend(offset + contigBase for offset in other.contigOffsets[1:])
+        self.pathOffsets.extend(offset + pathBase for offset in other.pathOffsets[1:])
+        self.contigRecord.extend(record + recordBase for record in other.contigRecord)
+        for column in ['recordNcbid', 'recordBp', 'recordWeight', 'recordDist', 'recordLeafDist', 'recordOnPath',
+                       'pathNcbid', 'ncbid', 'weightedDistToPath']:
+            getattr(self, column).extend(getattr(other, column))
+        self.names += other.names
+        self.contigLists += [scaffToContigsList[scaffName] for scaffName in other.names]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['contigLists'] = None  # see method "extend"
+        return state
+
+    def __len__(self):
+        return len(self.names)
+
+
+class _ScaffoldTable():
+    """
+        Consistency results of all scaffolds stored column-wise (one row per scaffold),
+        the statistics of the clades are computed by grouped reductions of the columns.
+    """
+    def __init__(self, store):
+        """
+            @param store: all scaffolds, the rows of the table are the rows of the store
+            @type store: _ScaffoldStore
+        """
+        n = len(store)
+        rows = numpy.arange(n)
+        recordOnPath = _toNumpy(store.recordOnPath).astype(numpy.float64)
+        recordRow = numpy.repeat(rows, numpy.diff(_toNumpy(store.recordOffsets)))
+        contigRecord = _toNumpy(store.contigRecord)
+        contigRow = numpy.repeat(rows, numpy.diff(_toNumpy(store.contigOffsets)))
+        recordBp = _toNumpy(store.recordBp).astype(numpy.float64)
+        self.names = store.names
+        self.ncbid = _toNumpy(store.ncbid).astype(numpy.int64)
+        self.contigCount = numpy.diff(_toNumpy(store.contigOffsets)).astype(numpy.float64)
+        self.bp = numpy.bincount(recordRow, weights=recordBp, minlength=n)
+        self.consistentContigCount = numpy.bincount(contigRow, weights=recordOnPath[contigRecord], minlength=n)
+        self.consistentBp = numpy.bincount(recordRow, weights=recordBp * recordOnPath, minlength=n)
+        self.pathDist = numpy.bincount(contigRow, weights=_toNumpy(store.recordDist)[contigRecord], minlength=n)
+        self.pathDistWeighted = _toNumpy(store.weightedDistToPath)
+        self.leafDist = numpy.bincount(contigRow, weights=_toNumpy(store.recordLeafDist)[contigRecord], minlength=n)
+        self.leafDistWeighted = numpy.bincount(
+            recordRow, weights=_toNumpy(store.recordWeight) * _toNumpy(store.recordLeafDist), minlength=n)
+
+    def __len__(self):
+        return len(self.names)
+
+    def getGroupedSums(self, total=False):
+        """
+            Sums up the columns of the scaffolds that were assigned to the same ncbid.
+
+            The rows of each group are added up in the order of the table (as a loop over the scaffolds would do).
+
+            @param total: sum up all rows as one group (with ncbid 1), else group the rows by the ncbids
+            @return: (ncbids of the groups, scaffold counts, contig counts, collective lengths, consistent contig
+                counts, consistent bp, total distances to the paths, bp weighted distances to the paths,
+                total distances to the leaves, bp weighted distances to the leaves) - one array entry per group
+            @rtype: tuple
+        """
+        if total:
+            ncbids = numpy.array([1], dtype=numpy.int64)
+            inverse = numpy.zeros(len(self), dtype=numpy.intp)
+        else:
+            ncbids, inverse = numpy.unique(self.ncbid, return_inverse=True)
+        n = len(ncbids)
+        sums = [numpy.bincount(inverse, minlength=n)]
+        for column in (self.contigCount, self.bp, self.consistentContigCount, self.consistentBp, self.pathDist,
+                       self.bp * self.pathDistWeighted, self.leafDist, self.bp * self.leafDistWeighted):
+            sums.append(numpy.bincount(inverse, weights=column, minlength=n))
+        return tuple([ncbids] + sums)
+
+
 class Consistency():
     def __init__(self, contigNameToBp, contigNameToNcbid, scaffToContigList, taxonomy,
                  minScaffContigCount=None, minScaffBpLen=None, cladesSet=None, considerContigWithNoScaff=True,
-                 ignoreScaffPredToRoot=True):
+                 ignoreScaffPredToRoot=True, jobs=1):
         """
             Initializes the main Consistency class.
 
@@ -252,12 +532,16 @@ class Consistency():
                 or a prediction file - first column contig name, last column ncbid
             @param scaffToContigList: dictionary that maps scaffold names to list of contig names;
                 or a file - first column scaffold name, second column contig name
+            @param taxonomy: database file in the sqlite3 format; or taxonomy returned by function "getTaxonomy";
+                or an evaluation session (see session.EvalSession)
             @param minScaffContigCount: consider only scaffolds that contain at least this number of contigs
             @param minScaffBpLen: consider only scaffolds with at least this collective length (in bp)
             @param cladesSet: consider only scaffolds that contain at least one contig from this set
             @param considerContigWithNoScaff: consider also contigs that are not assigned to scaffolds
                 (as artificial scaffolds)
             @param ignoreScaffPredToRoot: ignore scaffolds that are assigned based on the root (uninformative)
+            @param jobs: number of processes that process the scaffolds (see parallel.runForked), the results
+                don't depend on it
         """
         # check input options
         assert minScaffContigCount is None or isinstance(minScaffContigCount, int)
@@ -265,18 +549,20 @@ class Consistency():
         assert cladesSet is None or isinstance(cladesSet, set)
         assert isinstance(considerContigWithNoScaff, bool)
         assert isinstance(ignoreScaffPredToRoot, bool)
+        assert isinstance(jobs, int)
+        self._ignoreScaffPredToRoot = ignoreScaffPredToRoot
 
-        if isinstance(contigNameToBp, dict):
+        if seqids.isMapping(contigNameToBp):
             self._contigNameToBp = contigNameToBp
         elif isinstance(contigNameToBp, str) and os.path.isfile(contigNameToBp):
             self._contigNameToBp = getSequenceToBpDict(contigNameToBp)
         else:
             print("Can't get contig info from: ", contigNameToBp)
             return
-        if isinstance(contigNameToNcbid, dict):
+        if seqids.isMapping(contigNameToNcbid):
             self._contigToPred = contigNameToNcbid
         elif isinstance(contigNameToNcbid, str) and os.path.isfile(contigNameToNcbid):
-            self._contigToPred = cami.readAssignments(contigNameToNcbid)
+            self._contigToPred = cami.readAssignments(contigNameToNcbid, name='Consistency')
         else:
             print("Can't get prediction info from: ", contigNameToNcbid)
             return
@@ -290,82 +576,148 @@ class Consistency():
 
         if isinstance(taxonomy, _TaxonomyWrapper) and (not taxonomy.isClosed()):
             self._taxonomy = taxonomy
-        elif isinstance(taxonomy, str) and os.path.isfile(taxonomy):
+        elif isinstance(taxonomy, session.EvalSession) or (isinstance(taxonomy, str) and os.path.isfile(taxonomy)):
             self._taxonomy = _TaxonomyWrapper(taxonomy)
         else:
             print("Can't use taxonomy:", taxonomy)
             return
 
-        # check the consistency of the data!
+        # check the consistency of the data and filter out scaffolds according to the input constrains
+        self._scaffoldIndex = _ScaffoldContigIndex(self._scaffToContigsList, self._contigNameToBp, self._contigToPred,
+                                                   considerContigWithNoScaff)
+        rows = numpy.flatnonzero(self._scaffoldIndex.getMask(minScaffContigCount, minScaffBpLen, cladesSet))
+        if jobs > 1 and len(rows) > 1:
+            # the parts are merged in the order of the rows, thus the result is the same as of one process
+            self._taxonomy.getAncestorIndex()  # built once and shared by the forked processes
+            chunks = self._scaffoldIndex.split(rows, jobs * CHUNKS_PER_JOB)
+            self._store = _ScaffoldStore()
+            for store in parallel.runForked(self._processScaffolds, chunks, jobs):
+                self._store.extend(store, self._scaffToContigsList)
+        else:
+            self._store = self._processScaffolds(rows)
 
-        # if a contig that is defined in the mapping doesn't exist (in the fasta file) we remove it
-        for scaff, contigsList in self._scaffToContigsList.iteritems():
-            removeList = []
-            for contig in contigsList:
-                if contig not in self._contigNameToBp:
-                    removeList.append(contig)
+        self._table = _ScaffoldTable(self._store)
+        self._scaffolds = None
 
-            for contig in removeList:
-                contigsList.remove(contig)
+    def _processScaffolds(self, rows):
+        """
+            Processes the scaffolds (see method "_processScaffold").
 
-        # if a contig was predicted but there is no scaffold assigned to it then this
-        # contig is assigned to an "artificial scaffold"
-        if considerContigWithNoScaff:
-            scaffContigSet = set()
-            for s, l in self._scaffToContigsList.iteritems():
-                for c in l:
-                    scaffContigSet.add(c)
-            aloneContigSet = set()
-            for c in self._contigToPred:
-                if c not in scaffContigSet:
-                    aloneContigSet.add(c)
-
-            for c in aloneContigSet:
-                scaffName = str('scaffold_' + c)  # make up a scaffold name
-                assert scaffName not in self._scaffToContigsList, 'The names of contigs are ambiguous!'
-                self._scaffToContigsList[scaffName] = [c]
-
-        # filter out scaffolds according to the input constrains
-        self._scaffolds = dict()
-        for scaffName, contigsList in self._scaffToContigsList.iteritems():
-            if minScaffContigCount is not None:
-                if len(contigsList) < minScaffContigCount:
-                    continue
-
-            if minScaffBpLen is not None:
-                sum = 0
-                for contig in contigsList:
-                    sum += self._contigNameToBp[contig]
-                if sum < minScaffBpLen:
-                    continue
-
-            if cladesSet is not None:
-                passScaff = False
-                for contig in contigsList:
-                    if (contig in self._contigToPred) and (self._contigToPred[contig] in cladesSet):
-                        passScaff = True
-                        break
-                if not passScaff:
-                    continue
+            @param rows: rows of the scaffolds in the scaffold-contig index
+            @rtype: _ScaffoldStore
+        """
+        store = _ScaffoldStore()
+        for row in rows.tolist():
+            scaffName = self._scaffoldIndex.names[row]
+            contigsList = self._scaffoldIndex.contigLists[row]
 
             # process the scaffold, but if everything in the scaffold was assigned to the root, then ignore it!
             s = self._processScaffold(scaffName)
-            if not ((s.getNcbid() == 1) and ignoreScaffPredToRoot):
-                self._scaffolds[scaffName] = s
+            if not ((s[0] == 1) and self._ignoreScaffPredToRoot):
+                store.append(scaffName, contigsList, *s)
+        return store
 
     def _getPred(self, contigName):
         """
             Gets prediction for contig "contigName" or 1 if it wasn't assigned.
         """
         if contigName in self._contigToPred:
-            return self._contigToPred[contigName]
+            return int(self._contigToPred[contigName])
         else:
             return 1
 
     def _processScaffold(self, scaffName):
         """
-            Gets a "Scaffold" - an object that contain pre-processed scaffold contig consistency information.
-            @rtype: ScScaffold
+            Gets pre-processed scaffold contig consistency information (a row of the scaffold store).
+
+            The distances of all taxa of the scaffold to the paths of all leaf taxa are computed at once:
+            the distance of taxon A to the path from the root to leaf L is depth(A) - depth(LCA(A, L)).
+            @return: (ncbid of the scaffold, path set, weighted distance to the path, ncbid of each contig,
+                ncbid -> bp, ncbid -> weight, ncbid -> distance to the path, ncbid -> distance to the leaf)
+            @rtype: tuple
+        """
+        contigsList = self._scaffToContigsList[scaffName]
+        allNcbidSet = set()
+        for contigName in contigsList:
+            allNcbidSet.add(self._getPred(contigName))
+        if len(allNcbidSet) < MIN_TAXA_LCA:
+            return self._processScaffoldWalk(scaffName)
+        ncbidList = list(allNcbidSet)
+        index = self._taxonomy.getAncestorIndex()
+        idx = index.toIdx(ncbidList)
+        if (idx < 0).any() or not index.rooted[idx].all():
+            return self._processScaffoldWalk(scaffName)
+        depth = index.depth[idx]
+
+        # the leaves are the taxa that are not ancestors of other taxa of the scaffold
+        ancestorIdxSet = set()
+        current = idx[depth > 0]
+        while len(current) > 0:
+            current = index.getParents(current)
+            ancestorIdxSet.update(current.tolist())
+            current = current[index.depth[current] > 0]
+        leafNcbidSet = set()
+        for ncbid, i in zip(ncbidList, idx.tolist()):
+            if ncbid != 1 and i not in ancestorIdxSet:
+                leafNcbidSet.add(ncbid)
+
+        ncbidToBp = dict()
+        sumBp = 0
+        for contigName in contigsList:
+            ncbid = self._getPred(contigName)
+            bp = self._contigNameToBp[contigName]
+            sumBp += int(bp)
+            if ncbid not in ncbidToBp:
+                ncbidToBp[ncbid] = int(bp)
+            else:
+                ncbidToBp[ncbid] += int(bp)
+
+        ncbidToWeight = dict()
+        for ncbid in allNcbidSet:
+            ncbidToWeight[ncbid] = float(ncbidToBp[ncbid])/float(sumBp)
+
+        # the path with the minimum weighted distance of all taxa (if everything is assigned to the root, it's 0)
+        minDistW = 0.0
+        minDistNcbid = 1
+        if len(leafNcbidSet) > 0:
+            leafList = list(leafNcbidSet)
+            k = len(ncbidList)
+            lca = index.getLca(numpy.repeat(index.toIdx(leafList), k), numpy.tile(idx, len(leafList)))
+            dist = (numpy.tile(depth, len(leafList)) - index.depth[lca]).reshape(len(leafList), k)
+            weights = numpy.array([ncbidToWeight[ncbid] for ncbid in ncbidList], dtype=numpy.float64)
+            # the weighted distances are summed up in the order of the taxa
+            distW = numpy.cumsum(dist.astype(numpy.float64) * weights, axis=1)[:, -1]
+            best = int(numpy.argmin(distW))
+            minDistW = float(distW[best])
+            minDistNcbid = leafList[best]
+
+        minPath = set([1])
+        current = minDistNcbid
+        while current != 1:
+            minPath.add(current)
+            current = self._taxonomy.getParent(current)
+
+        # for each ncbid compute the distance to the path and to the leaf (minDistNcbid)
+        minIdx = index.toIdx([minDistNcbid])
+        lca = index.getLca(idx, numpy.repeat(minIdx, len(idx)))
+        toPath = (depth - index.depth[lca]).tolist()
+        toLeaf = (index.depth[minIdx[0]] - index.depth[lca]).tolist()
+        ncbidToDist = dict()
+        ncbidToLeafDist = dict()
+        for ncbid, d, dLeaf in zip(ncbidList, toPath, toLeaf):
+            ncbidToDist[ncbid] = float(d)
+            ncbidToLeafDist[ncbid] = float(d + float(dLeaf))
+
+        contigNcbids = [self._getPred(contigName) for contigName in contigsList]
+
+        return (minDistNcbid, minPath, minDistW, contigNcbids, ncbidToBp, ncbidToWeight, ncbidToDist,
+                ncbidToLeafDist)
+
+    def _processScaffoldWalk(self, scaffName):
+        """
+            Gets pre-processed scaffold information (see method "_processScaffold") walking the parents of the taxa
+            one by one, used for scaffolds with a few taxa or if some taxa are not connected to the root of the taxonomy.
+            @rtype: tuple
         """
         allNcbidSet = set()
         for contigName in self._scaffToContigsList[scaffName]:
@@ -441,9 +793,7 @@ class Consistency():
         for ncbid in allNcbidSet:
             ncbidToDist[ncbid] = float(self._taxonomy.getDist(ncbid, minPath))
 
-        contigNameToNcbid = dict()
-        for contigName in self._scaffToContigsList[scaffName]:
-            contigNameToNcbid[contigName] = self._getPred(contigName)
+        contigNcbids = [self._getPred(contigName) for contigName in self._scaffToContigsList[scaffName]]
 
         # for each ncbid compute the distance to the leaf (minDistNcbid)
         ncbidToLeafDist = dict()
@@ -452,13 +802,17 @@ class Consistency():
             lcaNcbid = self._taxonomy.getDistantParent(ncbid, d)
             ncbidToLeafDist[ncbid] = float(d + self._taxonomy.getDistTowardsRoot(minDistNcbid, lcaNcbid))
 
-        return ScScaffold(scaffName, minDistNcbid, minPath, minDistW, self._scaffToContigsList[scaffName],
-                          contigNameToNcbid, ncbidToBp, ncbidToWeight, ncbidToDist, ncbidToLeafDist)
+        return (minDistNcbid, minPath, minDistW, contigNcbids, ncbidToBp, ncbidToWeight, ncbidToDist,
+                ncbidToLeafDist)
 
     def getScaffoldsDict(self):
         """
             Gets all scaffolds (as a dict) that were filtered out according to the parameters.
         """
+        if self._scaffolds is None:
+            self._scaffolds = dict()
+            for row, scaffName in enumerate(self._store.names):
+                self._scaffolds[scaffName] = ScScaffold(self._store, row)
         return self._scaffolds
 
     def getScaffoldsPrint(self):
@@ -467,13 +821,14 @@ class Consistency():
             @rtype: str
         """
         buff = ''
+        scaffolds = self.getScaffoldsDict()
         scaffList = []
-        for scaffName in self._scaffolds:
+        for scaffName in scaffolds:
             scaffList.append(scaffName)
         scaffList.sort()
 
         for scaffName in scaffList:
-            scaff = self._scaffolds[scaffName]
+            scaff = scaffolds[scaffName]
             contigCount = len(scaff.getContigsNameList())
             pathSet = scaff.getPathSet()
             scaffNcbid = scaff.getNcbid()
@@ -516,25 +871,31 @@ class Consistency():
 
         return buff
 
+    def getScaffoldContigIndex(self):
+        """
+            Gets the scaffold-contig mapping, e.g. to find out which scaffolds pass other constrains (method "getMask").
+            @rtype: _ScaffoldContigIndex
+        """
+        return self._scaffoldIndex
+
+    def getScaffoldTable(self):
+        """
+            Gets the consistency results of all scaffolds as columns.
+            @rtype: _ScaffoldTable
+        """
+        return self._table
+
     def getGroupedScaffoldsPrint(self):
         """
             Gets scaffolds grouped according to their ncbid, to be printed out.
         """
-        ncbidToScaffList = dict()  # ncbid -> list of scaffolds
-        for scaffName, scaff in self._scaffolds.iteritems():
-            scaffNcbid = scaff.getNcbid()
-            if scaffNcbid not in ncbidToScaffList:
-                ncbidToScaffList[scaffNcbid] = [scaff]
-            else:
-                ncbidToScaffList[scaffNcbid].append(scaff)
-
-        # ncbids
-        ncbidSet = set(ncbidToScaffList.keys())
+        sums = self._table.getGroupedSums()
+        ncbidToRow = dict(zip(sums[0].tolist(), range(len(sums[0]))))
 
         # scientific name -> ncbid list (there can be more than one ncbids for the same scientific name)
         scientificNameToNcbidList = dict()
         nameList = []
-        for ncbid in ncbidSet:
+        for ncbid in ncbidToRow:
             name = self._taxonomy.getScientificName(ncbid)
             if name in scientificNameToNcbidList:
                 scientificNameToNcbidList[name].append(ncbid)
@@ -543,6 +904,9 @@ class Consistency():
                 nameList.append(name)
         nameList.sort()
 
+        # one row per ncbid, the last row summarizes all scaffolds
+        rows = zip(*[column.tolist() for column in sums[1:]])
+        rows += zip(*[column.tolist() for column in self._table.getGroupedSums(total=True)[1:]])
         buff = ''
         nameList.append('Summary')
         scientificNameToNcbidList['Summary'] = [1]
@@ -550,36 +914,17 @@ class Consistency():
         for name in nameList:
             for ncbid in scientificNameToNcbidList[name]:
                 if name != 'Summary':
-                    scaffolds = ncbidToScaffList[ncbid]
+                    row = rows[ncbidToRow[ncbid]]
                 else:
-                    ncbid = str('all clades (' + str(len(set(ncbidToScaffList.keys()))) + ')')
-                    scaffolds = list(self._scaffolds.values())
-
-                if len(scaffolds) == 0:  # there are no scaffolds for this ncbid
-                    continue
-
-                totalContigCount = 0.0  # count the number of all contigs in all scaffolds
-                totalBpLen = 0.0  # sum up lengths of all scaffolds' lengths
-                totalConsistentContigCount = 0.0  # number of contigs that are consistent
-                totalConsistentBpLen = 0.0  # number of Bp that are consistent
-                totalPathDist = 0.0  # distance from all contigs to the path
-                totalPathDistWeighted = 0.0  # weighted distance from all contigs to the path
-                totalLeafDist = 0.0  # distance from all contigs to the respective leafs (of the path)
-                totalLeafDistWeighted = 0.0  # weighted distance from all contigs to the respective leaf (of the path)
-
-                for scaff in scaffolds:
-                    contigCount = float(len(scaff.getContigsNameList()))
-                    collectiveLength = float(scaff.getCollectiveLength())
-                    totalContigCount += contigCount
-                    totalConsistentContigCount += float(scaff.getConsistencyTotal(asCount=True))
-                    totalBpLen += collectiveLength
-                    totalConsistentBpLen += float(scaff.getConsistencyTotalBp(asBpCount=True))
-                    totalPathDist += float(scaff.getConsistencyAvgDist(asTotalCount=True))
-                    totalPathDistWeighted += collectiveLength * float(scaff.getConsistencyWeightedAvgDist())
-                    totalLeafDist += float(scaff.getConsistencyAvgDistLeaf(asTotalCount=True))
-                    totalLeafDistWeighted += collectiveLength * scaff.getConsistencyAvgWeightedDistLeaf()
-
-                buff += str(name + ', (' + str(ncbid) + '), scaffolds: ' + str(len(scaffolds)) + ', contigs: (' +
+                    ncbid = str('all clades (' + str(len(ncbidToRow)) + ')')
+                    if len(self._table) == 0:  # there are no scaffolds at all
+                        continue
+                    row = rows[-1]
+
+                (scaffCount, totalContigCount, totalBpLen, totalConsistentContigCount, totalConsistentBpLen,
+                 totalPathDist, totalPathDistWeighted, totalLeafDist, totalLeafDistWeighted) = row
+
+                buff += str(name + ', (' + str(ncbid) + '), scaffolds: ' + str(scaffCount) + ', contigs: (' +
                             str(int(totalConsistentContigCount)) + '/' + str(int(totalContigCount)) + '), ' +
                             str(round(((totalConsistentContigCount / totalContigCount) * 100.0), 2)) + '%, (' +
                             str(round(totalConsistentBpLen / 1000.0, 1)) + '/' + str(round(totalBpLen / 1000.0, 1)) +
@@ -651,6 +996,10 @@ def _main():
                              '(For each such contig an artificial scaffold is created.)',
                         dest='a')
 
+    parser.add_argument('-j', '--jobs', nargs=1, type=int,
+                        help='Number of processes that process the scaffolds.', metavar='N',
+                        dest='j')
+
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Print scaffold-contig consistency info for each scaffold.',
                         dest='v')
@@ -677,10 +1026,16 @@ def _main():
     else:
         cladesSet = None
 
+    if args.j:
+        assert len(args.j) == 1
+        jobs = args.j[0]
+    else:
+        jobs = 1
+
     assert len(args.f) == 1 and len(args.p) == 1 and len(args.m) == 1 and len(args.d) == 1  # make this nicer
 
     cons = Consistency(args.f[0].name, args.p[0].name, args.m[0].name, args.d[0].name, minScaffContigCount,
-                       minScaffBpLen, cladesSet, args.a)
+                       minScaffBpLen, cladesSet, args.a, jobs=jobs)
     if args.v:
         print cons.getScaffoldsPrint()
     print cons.getGroupedScaffoldsPrint()
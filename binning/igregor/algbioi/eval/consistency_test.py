@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2014  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Tests of the scaffold consistency computed via the lowest common ancestors against walking the parents.
+
+    Run from the directory that contains the "algbioi" package: python -m unittest algbioi.eval.consistency_test
+"""
+
+import os
+import sys
+import random
+import shutil
+import argparse
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from algbioi.com import ncbitax2sqlite
+from algbioi.com.taxonomy_ncbi_test import _writeDumps
+from algbioi.eval import consistency
+
+
+class TestScaffoldPaths(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpDir = tempfile.mkdtemp()
+        cls.ncbids = _writeDumps(cls.tmpDir, 300, 3)
+        cls.database = os.path.join(cls.tmpDir, 'taxonomy.db')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            ncbitax2sqlite.build_database(argparse.Namespace(db=cls.database, dmp=cls.tmpDir))
+        finally:
+            sys.stdout = stdout
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir)
+
+    def setUp(self):
+        self.minTaxaLca = consistency.MIN_TAXA_LCA
+
+    def tearDown(self):
+        consistency.MIN_TAXA_LCA = self.minTaxaLca
+
+    def _getConsistency(self, seed):
+        """
+            Random scaffolds, some of them with many taxa and with contigs of the same length (ties of the paths).
+        """
+        rnd = random.Random(seed)
+        contigToBp = {}
+        contigToNcbid = {}
+        scaffToContigs = {}
+        for s in range(40):
+            taxa = rnd.sample(self.ncbids, rnd.choice([1, 2, 5, consistency.MIN_TAXA_LCA, 40]))
+            sameLength = rnd.random() < 0.5
+            contigs = []
+            for c in range(rnd.randint(len(taxa), 2 * len(taxa))):
+                name = 's%s_c%s' % (s, c)
+                contigToBp[name] = 1000 if sameLength else rnd.randint(100, 5000)
+                contigToNcbid[name] = taxa[c % len(taxa)]
+                contigs.append(name)
+            scaffToContigs['s%s' % s] = contigs
+        return consistency.Consistency(contigToBp, contigToNcbid, scaffToContigs, self.database,
+                                       considerContigWithNoScaff=False, ignoreScaffPredToRoot=False)
+
+    def _assertSameAsWalk(self, cons):
+        for scaffName in cons._scaffToContigsList:
+            lca = cons._processScaffold(scaffName)
+            walk = cons._processScaffoldWalk(scaffName)
+            # ncbid of the scaffold (tie-breaking), path, weighted distance, ..., distances to the path and leaf
+            self.assertEqual(walk, lca)
+            self.assertEqual(repr(walk[2]), repr(lca[2]))
+
+    def test_lca_equals_walk(self):
+        for seed in range(3):
+            cons = self._getConsistency(seed)
+            self.assertTrue(any(len(set(map(cons._getPred, contigs))) >= consistency.MIN_TAXA_LCA
+                                for contigs in cons._scaffToContigsList.values()))
+            self._assertSameAsWalk(cons)
+            cons.close()
+
+    def test_lca_of_few_taxa_equals_walk(self):
+        consistency.MIN_TAXA_LCA = 1
+        cons = self._getConsistency(10)
+        self._assertSameAsWalk(cons)
+        cons.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
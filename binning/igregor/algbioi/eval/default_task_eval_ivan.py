@@ -30,16 +30,20 @@ import argparse
 from algbioi.com import fasta
 from algbioi.com import csv
 from algbioi.com import ncbitax2sqlite
+from algbioi.com import parallel
+from algbioi.com import seqids
 from algbioi.eval import cami
 from algbioi.eval import accuracy
 from algbioi.eval import consistency
 from algbioi.eval import confusion_matrix
+from algbioi.eval import session
 from algbioi.com import taxonomy_ncbi
 
 CORRECT_LABEL_THRESHOLD = 0.9
 MIN_FRAC_CLADE = 0.01
 MIN_FRAC_PRED = 0.01
 RANKS = taxonomy_ncbi.TAXONOMIC_RANKS[1:]
+TAXONOMY_SNAPSHOT = 'taxonomy_ncbi.snapshot'
 
 class Args():
     def __init__(self, db, dmp):
@@ -73,6 +77,15 @@ def _main():
                         help='What task/job should be performed (p~precision/recall, s~scaff-contig consistency, '
                              'c~confusion tables, default - if not spec compute all)', metavar='', dest='j')
 
+    parser.add_argument('--jobs', nargs=1, type=int, required=False,
+                        help='Number of processes, the ranks, jobs and scaffolds are computed in parallel '
+                             '(Default ~ 1).',
+                        metavar='N', dest='jobs')
+
+    parser.add_argument('--duplicates', nargs=1, choices=[seqids.FIRST_WINS, seqids.LAST_WINS, seqids.ERROR], required=False,
+                        help='Which assignment of a sequence assigned more than once is kept (first, last), or stop '
+                             'with an error (error) (Default ~ last).', dest='duplicates')
+
     args = parser.parse_args()
 
     # read and check the arguments
@@ -82,20 +95,24 @@ def _main():
     trueBinning = None
     outputDir = None
     job = None
+    jobs = 1
+    # the sequence names are stored once for all input files
+    seqIdIndex = seqids.SeqIdIndex()
+    duplicates = args.duplicates[0] if args.duplicates else seqids.LAST_WINS
 
     if args.o and len(args.o) == 1 and os.path.isdir(args.o[0]):
         outputDir = args.o[0]
 
     if args.b and len(args.b) == 1 and os.path.isfile(args.b[0].name):
         binningFile = args.b[0].name
-        binning = cami.readAssignments(binningFile)
+        binning = cami.readAssignments(binningFile, seqIdIndex, duplicates, name='Binning')
 
     if args.t and len(args.t) == 1 and os.path.isfile(args.t[0].name):
         trueBinningFile = args.t[0].name
-        trueBinning = cami.readAssignments(trueBinningFile)
+        trueBinning = cami.readAssignments(trueBinningFile, seqIdIndex, duplicates, name='True binning')
 
     if args.f and len(args.f) == 1 and os.path.isfile(args.f[0].name):
-        seqIdToBp = fasta.getSequenceToBpDict(args.f[0].name)
+        seqIdToBp = fasta.getSequenceToBpDict(args.f[0].name, seqIdIndex=seqIdIndex)
 
         # contigsFileListing = args.f[0].name
         # for line in open(contigsFileListing):
@@ -113,17 +130,17 @@ def _main():
         scaffoldContigMapping = args.m[0].name
         scaffToContig = csv.getMapping(scaffoldContigMapping, 0, 1, '\t')
 
-    taxonomyPath = os.path.join(outputDir, 'taxonomy_ncbi.db')
-    if not os.path.isfile(taxonomyPath):
-        if args.n and len(args.n) == 1 and os.path.isdir(args.n[0]):
-            # build the ncbi taxonomy in the case it doesn't exist
-            ncbitax2sqlite.build_database(Args(db=taxonomyPath, dmp=args.n[0]))
-        else:
-            taxonomyPath = None
+    dmpDir = None
+    if args.n and len(args.n) == 1 and os.path.isdir(args.n[0]):
+        dmpDir = args.n[0]
+    taxonomyPath = getTaxonomySnapshot(dmpDir, outputDir)
 
     if args.j and len(args.j) > 0 and len(set(args.j).intersection(set(['p', 's', 'c']))) > 0:
         job = set(args.j)
 
+    if args.jobs and len(args.jobs) == 1 and args.jobs[0] > 1:
+        jobs = args.jobs[0]
+
     # print job
     # print args.j
     # print len(seqIdToBp)
@@ -132,43 +149,111 @@ def _main():
     # print taxonomyPath
     # print outputDir
 
-    if (job is None or 'p' in args.j) and seqIdToBp and binning and trueBinning and taxonomyPath and outputDir:
-        print('Computing precision/recall')
-        # precision/recall - no correction
-        acc = accuracy.Accuracy(seqIdToBp, binning, trueBinning, taxonomyPath)
-        out = csv.OutFileBuffer(os.path.join(outputDir, 'precision_recall.csv'))
-        out.writeText(acc.getAccuracyPrint(RANKS, MIN_FRAC_CLADE, MIN_FRAC_CLADE))
-        out.close()
-        acc.close()
+    # the sequences, assignments and the taxonomy are loaded only once and shared by all jobs
+    evalSession = None
+    if seqIdToBp and binning and taxonomyPath and outputDir:
+        evalSession = session.EvalSession(seqIdToBp, binning, trueBinning, taxonomyPath, RANKS)
 
-        # precision/recall - with correction
-        acc = accuracy.Accuracy(seqIdToBp, binning, trueBinning, taxonomyPath, CORRECT_LABEL_THRESHOLD)
-        out = csv.OutFileBuffer(os.path.join(outputDir, 'precision_recall_correction.csv'))
-        out.writeText(acc.getAccuracyPrint(RANKS, MIN_FRAC_CLADE, MIN_FRAC_CLADE))
-        out.close()
-        acc.close()
+    # the work is divided into independent tasks (job, rank) that are run in parallel if "--jobs" is set
+    taskList = []
+    acc = None
+    accCorrection = None
+    confusionMatrix = None
+
+    if (job is None or 'p' in args.j) and evalSession and trueBinning:
+        print('Computing precision/recall')
+        # precision/recall - no correction, with correction
+        acc = accuracy.Accuracy(seqIdToBp, binning, trueBinning, evalSession)
+        accCorrection = accuracy.Accuracy(seqIdToBp, binning, trueBinning, evalSession, CORRECT_LABEL_THRESHOLD)
+        for rank in RANKS:
+            taskList.append(('p', rank))
+        for rank in RANKS:
+            taskList.append(('pc', rank))
 
     # compute confusion matrices
-    if (job is None or 'c' in args.j) and seqIdToBp and binning and trueBinning and taxonomyPath and outputDir:
+    if (job is None or 'c' in args.j) and evalSession and trueBinning:
         print('Computing confusion matrices')
-        confusionMatrix = confusion_matrix.ConfusionMatrix(seqIdToBp, binning, trueBinning, taxonomyPath, RANKS)
+        confusionMatrix = confusion_matrix.ConfusionMatrix(seqIdToBp, binning, trueBinning, evalSession, RANKS)
         for rank in RANKS:
+            taskList.append(('c', rank))
+
+    # compute scaffold contig consistency (the longest task, its scaffolds are processed by all processes)
+    consistencyBuff = None
+    if (job is None or 's' in args.j) and evalSession and scaffToContig:
+        print('Computing scaffold-contig consistency')
+        cons = consistency.Consistency(seqIdToBp, binning, scaffToContig, evalSession, jobs=jobs)
+        consistencyBuff = cons.getGroupedScaffoldsPrint()
+        cons.close()
+
+    def runTask(task):
+        taskJob, rank = task
+        if taskJob == 'p':
+            return acc.getAccuracyPrintRank(rank, MIN_FRAC_CLADE, MIN_FRAC_CLADE)
+        elif taskJob == 'pc':
+            return accCorrection.getAccuracyPrintRank(rank, MIN_FRAC_CLADE, MIN_FRAC_CLADE)
+        elif taskJob == 'c':
             confusionMatrix.generateConfusionMatrix(rank, os.path.join(outputDir, 'confusion_matrix'))
+
+    taskToResult = dict(zip(taskList, parallel.runForked(runTask, taskList, jobs)))
+
+    if acc is not None:
+        for taskJob, fileName in [('p', 'precision_recall.csv'), ('pc', 'precision_recall_correction.csv')]:
+            out = csv.OutFileBuffer(os.path.join(outputDir, fileName))
+            out.writeText(accuracy.PRINT_HEADER)
+            for rank in RANKS:
+                out.writeText(taskToResult[(taskJob, rank)])
+            out.close()
+        acc.close()
+        accCorrection.close()
+
+    if confusionMatrix is not None:
         confusionMatrix.close()
 
-    # compute scaffold contig consistency
-    if (job is None or 's' in args.j) and seqIdToBp and binning and scaffToContig and taxonomyPath \
-            and outputDir:
-        print('Computing scaffold-contig consistency')
-        cons = consistency.Consistency(seqIdToBp, binning, scaffToContig, taxonomyPath)
+    if consistencyBuff is not None:
         out = csv.OutFileBuffer(os.path.join(outputDir, 'consistency.txt'))
-        out.writeText(cons.getGroupedScaffoldsPrint())
-        cons.close()
+        out.writeText(consistencyBuff)
         out.close()
 
+    if evalSession is not None:
+        evalSession.close()
+
     createEvalMetaFile(outputDir)
 
 
+def getTaxonomySnapshot(dmpDir, outputDir):
+    """
+        Gets the ncbi taxonomy, in this order:
+            a binary snapshot in the output dir or next to the dump files (not older than the dump files),
+            an existing database "taxonomy_ncbi.db" in the output dir,
+            a new snapshot built from the dump files in the output dir.
+        Nothing is written next to the dump files, i.e. a snapshot is shared by several evaluations only if it was
+        put there beforehand (e.g. by "ncbitax2sqlite.py -m").
+
+        @param dmpDir: directory containing the NCBI names.dmp and nodes.dmp files (or None)
+        @param outputDir: output directory
+        @return: path to the snapshot or to the database (None if there is no taxonomy)
+    """
+    dmpMTime = None
+    if dmpDir is not None:
+        dmpMTime = max(os.path.getmtime(os.path.join(dmpDir, 'nodes.dmp')),
+                       os.path.getmtime(os.path.join(dmpDir, 'names.dmp')))
+    for directory in [outputDir, dmpDir]:
+        if directory is None:
+            continue
+        snapshotPath = os.path.join(directory, TAXONOMY_SNAPSHOT)
+        if os.path.isfile(snapshotPath) and (dmpMTime is None or os.path.getmtime(snapshotPath) >= dmpMTime) \
+                and taxonomy_ncbi.isSnapshot(snapshotPath):
+            return snapshotPath
+    databasePath = os.path.join(outputDir, 'taxonomy_ncbi.db')
+    if os.path.isfile(databasePath):
+        return databasePath
+    if dmpDir is not None:
+        snapshotPath = os.path.join(outputDir, TAXONOMY_SNAPSHOT)
+        ncbitax2sqlite.build_snapshot(Args(db=snapshotPath, dmp=dmpDir))
+        return snapshotPath
+    return None
+
+
 def createEvalMetaFile(outputDir):
 
     precisionRecallFile = os.path.join(outputDir, 'precision_recall.csv')
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+    Copyright (C) 2015  Ivan Gregor
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+    Evaluation session, the state shared by the evaluation scripts (accuracy.py, confusion_matrix.py, consistency.py)
+    when they are computed for the same sequences, assignments and taxonomy.
+"""
+
+import os
+import numpy
+
+from algbioi.com import fasta
+from algbioi.com import seqids
+from algbioi.com import taxonomy_ncbi
+from algbioi.eval import cami
+
+
+def getLineageAtRanks(taxonomy, seqToNcbid, seqList, ranks):
+    """
+        Projects the assignments of the sequences to the given ranks.
+
+        @param taxonomy: taxonomy
+        @type taxonomy: taxonomy_ncbi.TaxonomyNcbi
+        @param seqToNcbid: mapping, sequence name -> ncbi taxon id
+        @type seqToNcbid: dict or seqids.SeqIdMap
+        @param seqList: sequence names that correspond to the rows of the matrix
+        @param ranks: ranks that correspond to the columns of the matrix
+        @return: matrix [sequence, rank] -> ncbi taxon id at given rank (-1 ~ not defined or not assigned)
+        @rtype: numpy.ndarray
+    """
+    lineage = numpy.empty((len(seqList), len(ranks)), dtype=numpy.int32)
+    lineage.fill(-1)
+    if isinstance(seqToNcbid, seqids.SeqIdMap):
+        ncbids, assigned = seqToNcbid.getArray(seqList)
+        if assigned.any():
+            lineage[assigned] = taxonomy.getLineageAtRanks(ncbids[assigned], ranks)
+        return lineage
+    assigned = numpy.array([seq in seqToNcbid for seq in seqList], dtype=bool)
+    if assigned.any():
+        lineage[assigned] = taxonomy.getLineageAtRanks([seqToNcbid[seq] for seq in seqList if seq in seqToNcbid],
+                                                       ranks)
+    return lineage
+
+
+class EvalSession():
+    """
+        Loads the sequence lengths, assignments and the taxonomy only once, the assignments projected to the
+        taxonomic ranks are computed at the first request and shared by all evaluation scripts
+        that are initialized with the session (instead of a taxonomy).
+    """
+    def __init__(self, seqIdToBp, seqIdToPred, seqIdToTruePred, taxonomy, ranks=None):
+        """
+            @param seqIdToBp: dictionary (or seqids.SeqIdMap) or a fasta file
+            @param seqIdToPred: dictionary (or seqids.SeqIdMap) or a prediction file
+            @param seqIdToTruePred: dictionary (or seqids.SeqIdMap) or a true prediction file (or None)
+            @param taxonomy: database file in the sqlite3 format or a taxonomy snapshot
+            @param ranks: the assignments are projected to these ranks (None ~ all default ranks)
+        """
+        # the files are loaded as compact mappings that share the sequence names
+        seqIdIndex = seqids.SeqIdIndex()
+        if seqids.isMapping(seqIdToBp):
+            self._seqToBp = seqIdToBp
+        else:
+            assert os.path.isfile(seqIdToBp)
+            self._seqToBp = fasta.getSequenceToBpDict(seqIdToBp, seqIdIndex=seqIdIndex)
+
+        if seqids.isMapping(seqIdToPred):
+            self._seqToPred = seqIdToPred
+        else:
+            assert os.path.isfile(seqIdToPred)
+            self._seqToPred = cami.readAssignments(seqIdToPred, seqIdIndex, name='EvalSession')
+
+        if seqIdToTruePred is None or seqids.isMapping(seqIdToTruePred):
+            self._seqToTrue = seqIdToTruePred
+        else:
+            assert os.path.isfile(seqIdToTruePred)
+            self._seqToTrue = cami.readAssignments(seqIdToTruePred, seqIdIndex, name='EvalSession')
+
+        assert os.path.isfile(taxonomy)
+        self._taxonomy = taxonomy_ncbi.TaxonomyNcbi(taxonomy, preload=True)
+
+        if ranks is None:
+            ranks = taxonomy_ncbi.TAXONOMIC_RANKS[1:]
+        self._ranks = list(ranks)
+        self._seqList = self._seqToBp.keys()
+        if isinstance(self._seqToBp, seqids.SeqIdMap):
+            self._bp = self._seqToBp.getValueArray().astype(numpy.int64)
+        else:
+            self._bp = numpy.array([self._seqToBp[seq] for seq in self._seqList], dtype=numpy.int64)
+        self._predLineage = None
+        self._trueLineage = None
+
+    def getSeqIdToBp(self):
+        return self._seqToBp
+
+    def getSeqIdToPred(self):
+        return self._seqToPred
+
+    def getSeqIdToTruePred(self):
+        return self._seqToTrue
+
+    def getSeqList(self):
+        """
+            @return: sequence names, all arrays of the session are aligned with this list
+            @rtype: list
+        """
+        return self._seqList
+
+    def getBpArray(self):
+        """
+            @return: lengths of the sequences
+            @rtype: numpy.ndarray
+        """
+        return self._bp
+
+    def getTaxonomy(self):
+        """
+            @return: the taxonomy shared by all evaluation scripts (it is closed by the session)
+            @rtype: taxonomy_ncbi.TaxonomyNcbi
+        """
+        return self._taxonomy
+
+    def getLineageAtRanks(self, seqToNcbid, seqList, ranks):
+        """
+            Projects the assignments of the sequences to the given ranks (see function getLineageAtRanks),
+            the projections of the predictions and the true assignments of the session are computed only once.
+
+            @rtype: numpy.ndarray
+        """
+        if seqList is not self._seqList or not set(ranks).issubset(self._ranks):
+            return getLineageAtRanks(self._taxonomy, seqToNcbid, seqList, ranks)
+        if seqToNcbid is self._seqToPred:
+            if self._predLineage is None:
+                self._predLineage = getLineageAtRanks(self._taxonomy, seqToNcbid, seqList, self._ranks)
+            lineage = self._predLineage
+        elif seqToNcbid is self._seqToTrue:
+            if self._trueLineage is None:
+                self._trueLineage = getLineageAtRanks(self._taxonomy, seqToNcbid, seqList, self._ranks)
+            lineage = self._trueLineage
+        else:
+            return getLineageAtRanks(self._taxonomy, seqToNcbid, seqList, ranks)
+        if list(ranks) == self._ranks:
+            return lineage
+        return lineage[:, [self._ranks.index(rank) for rank in ranks]]
+
+    def close(self):
+        """
+            Release resources.
+        """
+        self._taxonomy.close()
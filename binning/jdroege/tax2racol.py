@@ -116,6 +116,9 @@ if __name__ == "__main__":
 
     print header(ranks)
 
+    # taxon id -> path, the same taxa are usually assigned to many sequences
+    pathCache = {}
+
     for line in stdin:
         if line[0] != "#":
             line = line.rstrip()
@@ -123,5 +126,8 @@ if __name__ == "__main__":
                 ident, taxid = line.split("\t")[:2]
             except ValueError:
                 stderr.write("error parsing, skipping line \"%s\"" % line)
-            path = taxID2Ranks(tax, rank2pos, path_iterator, taxid)
+            path = pathCache.get(taxid)
+            if path is None:
+                path = taxID2Ranks(tax, rank2pos, path_iterator, taxid)
+                pathCache[taxid] = path
             print "%s\t%s" % (ident, "\t".join(path))
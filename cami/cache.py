@@ -0,0 +1,231 @@
+"""
+Column cache module
+
+This module stores the parsed content of a CAMI file in a binary columnar
+sidecar file, FILENAME + CACHE_SUFFIX, that is loaded instead of parsing the
+text again. A cache belongs to the state of its file: it records the size,
+modification time and a hash of the first and the last block of the file,
+thus a cache of a modified file is not used.
+
+Layout (little endian):
+
+    HEADER: magic, version, size, modification time and fingerprint of the
+    file, length of the metadata.
+
+    Metadata, JSON: header info, column definition, number of lines and rows,
+    and the type and blocks of each column.
+
+    Blocks of the columns, offsets in the metadata are relative to the end of
+    the metadata:
+
+        int64: the values as 64 bit integers.
+
+        str: the values joined by new lines.
+
+        category: the codes as 32 bit integers and the category values joined
+        by new lines.
+
+A cache is written to a temporary file that is renamed, thus a concurrent
+reader sees either the old or the new cache.
+
+The binning caches are also read by binning/igregor/algbioi/eval/cami.py
+(readCamiCache), which is deployed separately and has its own copy of the
+constants. CACHE_VERSION must be bumped on both sides with any change of the
+layout, binning/igregor/algbioi/eval/cami_test.py checks that they match.
+
+"""
+import os.path
+import sys
+import struct
+import json
+import hashlib
+from array import array
+
+CACHE_SUFFIX = '.colcache'
+CACHE_MAGIC = 'CAMICOLS'
+CACHE_VERSION = 1
+HEADER = struct.Struct('<8sIQd20sQ')
+FINGERPRINT_BLOCK = 1024 * 1024
+
+INT64 = 'int64'
+STR = 'str'
+CATEGORY = 'category'
+
+# array type codes of 64 and 32 bit integers, signed long is 64 bit on 64 bit Linux and OS X
+_INT64_TYPECODE = 'l'
+_INT32_TYPECODE = 'i'
+
+
+def cache_filename(filename):
+    """
+    :param filename: the CAMI file
+    :return: the name of its cache file
+    """
+    return filename + CACHE_SUFFIX
+
+
+def file_signature(filename):
+    """
+    :param filename: the file
+    :return: size, modification time and sha1 of the first and the last FINGERPRINT_BLOCK bytes of the file
+    """
+    with open(filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        h = hashlib.sha1()
+        h.update(f.read(FINGERPRINT_BLOCK))
+        if st.st_size > FINGERPRINT_BLOCK:
+            f.seek(max(FINGERPRINT_BLOCK, st.st_size - FINGERPRINT_BLOCK))
+            h.update(f.read(FINGERPRINT_BLOCK))
+    return st.st_size, st.st_mtime, h.digest()
+
+
+class ColumnCache(object):
+    """
+    ColumnCache
+
+    Content of a cache file.
+
+    header_info: header info of the file
+    column_definition: the column names
+    lines: number of lines of the file
+    columns: the values of each column, an array of TAXID-like integers (int64),
+        a list of strings (str) or a pair of an array of codes and a list of
+        category values (category)
+    """
+
+    def __init__(self, header_info, column_definition, lines, columns):
+        self.header_info = header_info
+        self.column_definition = column_definition
+        self.lines = lines
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[0][0] if isinstance(self.columns[0], tuple) else self.columns[0]) \
+            if len(self.columns) > 0 else 0
+
+
+def write_cache(filename, column_cache, signature):
+    """
+    Write the cache of a file.
+    :param filename: the CAMI file
+    :param column_cache: ColumnCache
+    :param signature: file_signature() of the file at the time it was read
+    """
+    blocks = []
+    offset = 0
+    column_meta = []
+    for column in column_cache.columns:
+        if isinstance(column, tuple):
+            codes, values = column
+            column_blocks = [_to_little_endian(array(_INT32_TYPECODE, codes)), '\n'.join(values)]
+            meta = {'type': CATEGORY, 'categories': len(values)}
+        elif isinstance(column, array):
+            column_blocks = [_to_little_endian(column if column.typecode == _INT64_TYPECODE
+                                               else array(_INT64_TYPECODE, column))]
+            meta = {'type': INT64}
+        else:
+            column_blocks = ['\n'.join(column)]
+            meta = {'type': STR}
+        meta['blocks'] = []
+        for block in column_blocks:
+            meta['blocks'].append([offset, len(block)])
+            offset += len(block)
+        blocks.extend(column_blocks)
+        column_meta.append(meta)
+    metadata = json.dumps({'header_info': column_cache.header_info,
+                           'column_definition': column_cache.column_definition,
+                           'lines': column_cache.lines,
+                           'rows': len(column_cache),
+                           'columns': column_meta})
+
+    name = cache_filename(filename)
+    tmp_name = '{0}.tmp{1}'.format(name, os.getpid())
+    try:
+        with open(tmp_name, 'wb') as f:
+            f.write(HEADER.pack(CACHE_MAGIC, CACHE_VERSION, signature[0], signature[1], signature[2], len(metadata)))
+            f.write(metadata)
+            for block in blocks:
+                f.write(block)
+        os.rename(tmp_name, name)
+    except:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+def read_cache(filename):
+    """
+    Read the cache of a file.
+    :param filename: the CAMI file
+    :return: ColumnCache or None when there is no cache or it doesn't match the file
+    :raises: ValueError when the cache file is corrupt
+    """
+    name = cache_filename(filename)
+    if not os.path.isfile(name):
+        return None
+    with open(name, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError('truncated cache file {0}'.format(name))
+        magic, version, size, mtime, fingerprint, metadata_length = HEADER.unpack(header)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION \
+                or (size, mtime, fingerprint) != file_signature(filename):
+            return None
+        metadata = _to_str(json.loads(f.read(metadata_length)))
+        rows = metadata['rows']
+        position = [0]
+
+        def read_block(meta, i):
+            # the blocks are stored in the order of the columns
+            offset, length = meta['blocks'][i]
+            if offset != position[0]:
+                f.seek(HEADER.size + metadata_length + offset)
+            data = f.read(length)
+            if len(data) != length:
+                raise ValueError('truncated cache file {0}'.format(name))
+            position[0] = offset + length
+            return data
+
+        columns = []
+        for meta in metadata['columns']:
+            if meta['type'] == INT64:
+                column = _from_little_endian(_INT64_TYPECODE, read_block(meta, 0))
+            elif meta['type'] == STR:
+                column = read_block(meta, 0).split('\n') if rows > 0 else []
+            elif meta['type'] == CATEGORY:
+                codes = _from_little_endian(_INT32_TYPECODE, read_block(meta, 0))
+                values = read_block(meta, 1).split('\n') if meta['categories'] > 0 else []
+                column = (codes, values)
+            else:
+                raise ValueError('unknown column type {0} in cache file {1}'.format(meta['type'], name))
+            if len(column[0] if isinstance(column, tuple) else column) != rows:
+                raise ValueError('inconsistent cache file {0}'.format(name))
+            columns.append(column)
+    return ColumnCache(metadata['header_info'], metadata['column_definition'], metadata['lines'], columns)
+
+
+def _to_str(obj):
+    """
+    Convert the unicode strings parsed by json to str.
+    """
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in obj.iteritems())
+    if isinstance(obj, list):
+        return map(_to_str, obj)
+    return obj
+
+
+def _to_little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+
+def _from_little_endian(typecode, data):
+    values = array(typecode, data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
@@ -0,0 +1,281 @@
+"""
+Compression module
+
+This module opens compressed input files transparently. The compression is
+detected from the first bytes of a file, not from its name.
+
+Supported formats:
+
+    gzip, bzip2, zstd and xz.
+
+A compressed file is decompressed in a separate process by an external program
+(a multi-threaded one such as pigz or lbzip2 is preferred) that writes to a
+pipe, thus decompression runs on another core than the parsing. Without such a
+program, gzip and bzip2 files are decompressed by the gzip and bz2 modules.
+
+A decompressed stream can only be read forward, it does not support seek.
+
+Output is compressed the same way, the format is chosen by the caller or from
+the suffix of the file name (see SUFFIXES).
+
+"""
+import os.path
+import subprocess
+import threading
+from distutils.spawn import find_executable
+
+# compression -> magic bytes at the beginning of a file
+MAGIC = [('gzip', '\x1f\x8b'), ('bzip2', 'BZh'), ('zstd', '\x28\xb5\x2f\xfd'), ('xz', '\xfd7zXZ\x00')]
+
+# compression -> decompression commands in the order of preference
+DECOMPRESS_COMMANDS = {
+    'gzip': [['pigz', '-dc'], ['gzip', '-dc']],
+    'bzip2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+    'zstd': [['zstd', '-dcq']],
+    'xz': [['xz', '-dc']]
+}
+
+# compression -> compression commands in the order of preference, they write to the standard output
+COMPRESS_COMMANDS = {
+    'gzip': [['pigz', '-c'], ['gzip', '-c']],
+    'bzip2': [['lbzip2', '-c'], ['pbzip2', '-c'], ['bzip2', '-c']],
+    'zstd': [['zstd', '-cq']],
+    'xz': [['xz', '-c']]
+}
+
+# file name suffix -> compression
+SUFFIXES = {'.gz': 'gzip', '.bz2': 'bzip2', '.zst': 'zstd', '.xz': 'xz'}
+
+# set to False to (de)compress by the gzip and bz2 modules only
+USE_EXTERNAL = True
+
+_command_cache = {}
+
+
+def detect_compression(filename):
+    """
+    Detect the compression of a file from its first bytes.
+    :param filename: the file
+    :return: a compression of MAGIC or None for an uncompressed file
+    """
+    with open(filename, 'rb') as f:
+        head = f.read(6)
+    for compression, magic in MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def open_input(filename):
+    """
+    Open a file for reading, a compressed file is decompressed on the fly.
+    :param filename: the file
+    :return: a file-like object that supports read, readline, readlines, iteration and close
+    :raises: IOError if the file is compressed by a format that cannot be decompressed
+    """
+    compression = detect_compression(filename)
+    if compression is None:
+        return open(filename, 'rb')
+    command = _find_command(compression)
+    if command is not None:
+        return PipeFile(command + [os.path.abspath(filename)])
+    # imported on demand, gzip imports the standard io module which the io module of this package shadows
+    if compression == 'gzip':
+        import gzip
+        return gzip.GzipFile(filename, 'rb')
+    if compression == 'bzip2':
+        import bz2
+        return bz2.BZ2File(filename, 'rb')
+    raise IOError('decompression of {0} ({1}) requires one of the programs: {2}'.format(
+        filename, compression, ', '.join(command[0] for command in DECOMPRESS_COMMANDS[compression])))
+
+
+def compression_from_name(filename):
+    """
+    :param filename: the file
+    :return: the compression of SUFFIXES that the file name ends with or None
+    """
+    return SUFFIXES.get(os.path.splitext(filename)[1])
+
+
+def open_output(filename, compression=None):
+    """
+    Open a file for writing, the output is compressed on the fly.
+    :param filename: the file
+    :param compression: a compression of MAGIC or None for an uncompressed file
+    :return: a file-like object that supports write and close
+    :raises: IOError if the compression is not available
+    """
+    if compression is None:
+        return open(filename, 'wb')
+    if compression not in COMPRESS_COMMANDS:
+        raise IOError('unknown compression {0}'.format(compression))
+    command = _find_command(compression, COMPRESS_COMMANDS)
+    if command is not None:
+        return PipeWriter(command, filename)
+    if compression == 'gzip':
+        import gzip
+        return gzip.GzipFile(filename, 'wb')
+    if compression == 'bzip2':
+        import bz2
+        return bz2.BZ2File(filename, 'wb')
+    raise IOError('compression of {0} ({1}) requires one of the programs: {2}'.format(
+        filename, compression, ', '.join(command[0] for command in COMPRESS_COMMANDS[compression])))
+
+
+def _drain(stream):
+    """
+    Read the stream in a background thread, so that a program writing a lot to
+    its standard error does not block on a full pipe.
+    :return: the thread and the list that receives the content of the stream
+    """
+    content = []
+    thread = threading.Thread(target=lambda: content.append(stream.read()))
+    thread.daemon = True
+    thread.start()
+    return thread, content
+
+
+def _read_drained(drained):
+    thread, content = drained
+    thread.join()
+    return ''.join(content).strip()
+
+
+def _find_command(compression, commands=DECOMPRESS_COMMANDS):
+    """
+    :param compression: a compression of MAGIC
+    :param commands: DECOMPRESS_COMMANDS or COMPRESS_COMMANDS
+    :return: the first installed command or None
+    """
+    if not USE_EXTERNAL:
+        return None
+    key = (compression, commands is COMPRESS_COMMANDS)
+    if key not in _command_cache:
+        _command_cache[key] = None
+        for command in commands[compression]:
+            if find_executable(command[0]) is not None:
+                _command_cache[key] = command
+                break
+    return _command_cache[key]
+
+
+class PipeFile(object):
+    """
+    PipeFile
+
+    Read-only file-like object over the output of a decompression program. A
+    failure of the program is raised as IOError once its output has ended.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __init__(self, args):
+        """
+        Start the program.
+        :param args: the command line, the program writes to its standard output
+        """
+        self.args = args
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1)
+        self.stdout = self.process.stdout
+        self.stderr = _drain(self.process.stderr)
+
+    def __iter__(self):
+        for line in self.stdout:
+            yield line
+        self._check_exit()
+
+    def read(self, size=-1):
+        data = self.stdout.read(size)
+        if len(data) == 0 and size != 0:
+            self._check_exit()
+        return data
+
+    def readline(self):
+        line = self.stdout.readline()
+        if len(line) == 0:
+            self._check_exit()
+        return line
+
+    def readlines(self, sizehint=0):
+        lines = self.stdout.readlines(sizehint)
+        if len(lines) == 0:
+            self._check_exit()
+        return lines
+
+    def _check_exit(self):
+        if self.process.wait() != 0:
+            raise IOError('decompression failed with exit code {0}: {1} [{2}]'.format(
+                self.process.returncode, ' '.join(self.args), _read_drained(self.stderr)))
+
+    def close(self):
+        """
+        Close the pipe, the program is terminated if it has not finished yet.
+        """
+        self.stdout.close()
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+        _read_drained(self.stderr)
+        self.process.stderr.close()
+
+
+class PipeWriter(object):
+    """
+    PipeWriter
+
+    Write-only file-like object that feeds a compression program, which writes
+    to the output file. A failure of the program is raised as IOError on close.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __init__(self, args, filename):
+        """
+        Start the program.
+        :param args: the command line, the program reads its standard input
+        :param filename: the output file
+        """
+        self.args = args
+        self.output = open(filename, 'wb')
+        try:
+            self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=self.output, stderr=subprocess.PIPE,
+                                            bufsize=-1)
+        except OSError:
+            self.output.close()
+            raise
+        self.stdin = self.process.stdin
+        self.stderr = _drain(self.process.stderr)
+
+    def write(self, data):
+        try:
+            self.stdin.write(data)
+        except IOError:
+            # the program has exited, its exit code and message are more useful
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Close the pipe and wait for the program to finish.
+        """
+        if self.stdin.closed:
+            return
+        try:
+            self.stdin.close()
+        except IOError:
+            pass
+        message = _read_drained(self.stderr)
+        self.process.stderr.close()
+        self.output.close()
+        if self.process.wait() != 0:
+            raise IOError('compression failed with exit code {0}: {1} [{2}]'.format(
+                self.process.returncode, ' '.join(self.args), message))
@@ -28,7 +28,12 @@ Where {tab} represents a single tab character.
 """
 import os.path
 import sys
-import re
+import gc
+from array import array
+from itertools import repeat, islice, izip
+
+from compression import open_input, open_output, compression_from_name
+from cache import ColumnCache, read_cache, write_cache, file_signature
 
 # Global constants
 HEADER_COMMENT = '#CAMI Format for Binning'
@@ -37,6 +42,14 @@ HEADER_CHAR = '@'
 DELIMITER = '\t'
 HEADER_SEP = ':'
 
+# Reader buffering
+BLOCK_SIZE = 4 * 1024 * 1024
+BATCH_SIZE = 65536
+
+# Array type codes of the binning columns, signed long is 64 bit on 64 bit Linux and OS X
+TAXID_TYPECODE = 'l'
+BINCODE_TYPECODE = 'i'
+
 # Generic keys
 TASK_KEY = 'task'
 VERSION_KEY = 'version'
@@ -66,6 +79,9 @@ class Writer(object):
 
     Opens a file on instantiation and validates header information. Provides iterator
     access to each subsequent data line, returned as a list of values.
+
+    For large outputs, writerows() and write_columns() format and write whole batches
+    of rows at once.
     """
 
     def __enter__(self):
@@ -80,13 +96,15 @@ class Writer(object):
         """
         self.close()
 
-    def __init__(self, filename, additional_header_info, column_definition, overwrite=False):
+    def __init__(self, filename, additional_header_info, column_definition, overwrite=False, compression=None):
         """
         Instatiate the Writer class for a given filename.
         :param filename: the filename to write
         :param additional_header_info: addition header fields for a concrete class
         :param column_definition: columns defined for a concrete class
         :param overwrite: boolean flag for file overwriting
+        :param compression: compress the output (see compression.MAGIC), by default
+                            according to the suffix of the filename, e.g. '.gz'
         :raises: BinningError when output file already exists and overwrite is False
         """
         self.header_info = {
@@ -100,7 +118,9 @@ class Writer(object):
 
         if not overwrite and os.path.exists(filename):
             raise ParseError('output file {0} already exists'.format(filename))
-        self.file_handle = open(filename, 'w')
+        self.file_handle = open_output(filename, compression or compression_from_name(filename))
+        # a row formatted by the % operator, the values are converted by str
+        self._row_format = DELIMITER.join(['%s'] * len(column_definition)) + '\n'
         self._write_header()
 
     def _set_headinfo(self, key, value):
@@ -152,7 +172,41 @@ class Writer(object):
         if len(row) != len(self.column_definition):
             raise FieldError('number of fields {0} does not agree with columns'.format(row, self.column_definition))
         self._writeline(DELIMITER.join(row))
-        pass
+
+    def writerows(self, rows):
+        """
+        Write rows of values to the file, the rows are formatted in batches of BATCH_SIZE.
+        :param rows: an iterable of rows, the values are converted by str
+        :raises FieldError when the number of fields of a row does not agree with the defined number of columns
+        """
+        columns = len(self.column_definition)
+        rows = iter(rows)
+        while True:
+            batch = map(tuple, islice(rows, BATCH_SIZE))
+            if len(batch) == 0:
+                break
+            if min(map(len, batch)) != columns or max(map(len, batch)) != columns:
+                for row in batch:
+                    if len(row) != columns:
+                        raise FieldError('number of fields {0} does not agree with columns'.format(
+                            row, self.column_definition))
+            self.file_handle.write(''.join(map(self._row_format.__mod__, batch)))
+
+    def write_columns(self, columns):
+        """
+        Write rows given by columns to the file, e.g. arrays of the same length.
+        :param columns: a sequence of values for each column, in the column order. The values are converted by str
+        :raises FieldError when the number of columns or the lengths of the columns do not agree
+        """
+        if len(columns) != len(self.column_definition):
+            raise FieldError('number of columns {0} does not agree with columns {1}'.format(
+                len(columns), self.column_definition))
+        size = len(columns[0])
+        if any(len(column) != size for column in columns):
+            raise FieldError('columns differ in length {0}'.format(map(len, columns)))
+        for i in xrange(0, size, BATCH_SIZE):
+            batch = izip(*[column[i:i + BATCH_SIZE] for column in columns])
+            self.file_handle.write(''.join(map(self._row_format.__mod__, batch)))
 
     def close(self):
         """
@@ -169,6 +223,11 @@ class Reader(object):
     Read from a given CAMI binning file. Provides an iterator over the data lines
     where each row is returned as a list of values ordered by column definition.
 
+    The file is read in blocks of BLOCK_SIZE bytes, which are split into lines at once.
+    For large files, row_batches() returns the rows in batches and validates a whole
+    batch in one pass, falling back to line by line parsing only for batches with
+    comments, blank lines or errors.
+
     """
 
     @staticmethod
@@ -179,7 +238,7 @@ class Reader(object):
         :param line: the line to check
         :return: return True if line contains only white space
         """
-        return re.match('^\s*$', line) is not None
+        return not line.strip()
 
     @staticmethod
     def _is_comment(line):
@@ -202,19 +261,32 @@ class Reader(object):
         Instantiate a Reader. The parser will open and read the header
         as part of instantiation.
 
-        :param filename: the filename of the input file.
+        :param filename: the filename of the input file, which may be compressed (see compression).
         :return:
         """
         self.line_number = 0
         self.version_value = None
         self.filename = filename
-        self.file_handle = open(filename, 'r')
+        self.file_handle = open_input(filename)
+        self._lines = []
+        self._line_pos = 0
+        self._tail = ''
+        self._eof = False
+        self._bytes_read = 0
+        self._block_offset = 0
+        self._block_has_comment = False
         # TODO casting header information values, such as T => True.
         self.header_info = {}
         self.supports = {TASK_KEY: [task_name], VERSION_KEY: version_support}
         self.column_definition = column_definition
         self.mandatory_header_fields = [TASK_KEY, VERSION_KEY, CONID_KEY, SAMPLEID_KEY] + mandatory_header_fields
-        self._read_header()
+        try:
+            self._read_header()
+        except:
+            # the reader is not returned, a decompression program must not be left running
+            self.file_handle.close()
+            raise
+        self._header_lines = self.line_number
 
 
     def __iter__(self):
@@ -233,15 +305,65 @@ class Reader(object):
                 raise HeaderError('mandatory header field {0} was not found'.format(mf))
 
 
+    def _read_block(self):
+        """
+        Read the next block of the file and split it into lines. The incomplete
+        last line of a block is kept until the next block is read.
+        :return: False when there are no more lines
+        """
+        while not self._eof:
+            block_offset = self._bytes_read - len(self._tail)
+            data = self.file_handle.read(BLOCK_SIZE)
+            self._bytes_read += len(data)
+            if len(data) == 0:
+                self._eof = True
+                lines = [self._tail] if len(self._tail) > 0 else []
+                self._tail = ''
+            else:
+                lines = (self._tail + data).split('\n')
+                self._tail = lines.pop()
+            if len(lines) > 0:
+                self._lines = lines
+                self._line_pos = 0
+                self._block_offset = block_offset
+                self._block_has_comment = COMMENT_CHAR in data or COMMENT_CHAR in lines[0]
+                return True
+        return False
+
+    def tell(self):
+        """
+        Byte offset of the next line in the file, e.g. the beginning of the body after the header was read.
+        The offset of a compressed file refers to the decompressed data.
+        :return: the offset
+        """
+        offset = self._block_offset + sum(len(line) + 1 for line in self._lines[:self._line_pos])
+        return min(offset, self._bytes_read)
+
     def _readline(self):
         """
         Read a line from the file.
         :return: return the line as a string, stripped.
+        :raises: StopIteration when the file has ended
         """
-        line = self.file_handle.next().strip()
+        if self._line_pos >= len(self._lines) and not self._read_block():
+            raise StopIteration
+        line = self._lines[self._line_pos].strip()
+        self._line_pos += 1
         self.line_number += 1
         return line
 
+    def _parse_row(self, line):
+        """
+        Split a stripped data line into its values.
+        :param line: the line to split
+        :return: the row of values
+        :raises: FieldError when the number of fields does not agree with the column definition
+        """
+        values = line.split(DELIMITER)
+        if len(values) != len(self.column_definition):
+            raise FieldError('incorrect number of fields for line:{0} [{1}]'.format(self.line_number, line))
+        return values
+
     def _header_parse(self, line):
         """
         Parse a line of the header
@@ -312,19 +434,134 @@ class Reader(object):
         Iterator over data lines.
         :return: the next row of values in the data table
         """
-        line = self._readline()
-        if line is StopIteration:
-            return StopIteration
-
-        # skip blank and comment lines
-        if Reader._is_blank(line) or Reader._is_comment(line):
-            return self.next()
-
-        values = line.split(DELIMITER)
-        if len(values) != len(self.column_definition):
-            raise FieldError('incorrect number of fields for line:{0} [{1}]'.format(self.line_number, line))
+        while True:
+            line = self._readline()
 
-        return values
+            # skip blank and comment lines
+            if len(line) > 0 and not Reader._is_comment(line):
+                return self._parse_row(line)
+
+    def raw_line_batches(self, batch_size=BATCH_SIZE):
+        """
+        Iterator over batches of data lines that are neither split nor validated,
+        e.g. to validate a file beyond its first error.
+        :param batch_size: maximum number of lines in a batch
+        :return: an iterator over (line number of the first line, lines) pairs,
+                 the lines are not stripped and may be blank or comments
+        """
+        for lines, bulk in self._line_batches(batch_size):
+            line_number = self.line_number + 1
+            self._skip_lines(len(lines))
+            yield line_number, lines
+
+    def row_batches(self, batch_size=BATCH_SIZE):
+        """
+        Iterator over data lines in batches. Rows, validation and line numbers of
+        errors are the same as when iterating row by row, the two can be mixed.
+        :param batch_size: maximum number of rows in a batch
+        :return: an iterator over lists of rows
+        """
+        columns = len(self.column_definition)
+        for lines, bulk in self._line_batches(batch_size):
+            if bulk:
+                # the rows cannot form reference cycles, thus the cyclic garbage collector
+                # (triggered by the many new lists) is suspended while the batch is split
+                gc_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    rows = [line.strip().split(DELIMITER) for line in lines]
+                finally:
+                    if gc_enabled:
+                        gc.enable()
+                # blank lines are split into a single empty value
+                if len(rows) > 0 and min(map(len, rows)) == columns == max(map(len, rows)):
+                    self._skip_lines(len(lines))
+                    yield rows
+                    continue
+
+            rows = self._parse_lines(lines)
+            if len(rows) > 0:
+                yield rows
+
+    def _line_batches(self, batch_size):
+        """
+        Iterator over batches of lines that have not been read yet, a batch never spans two blocks.
+        The consumer marks the lines as read by _skip_lines() or _parse_lines().
+        :param batch_size: maximum number of lines in a batch
+        :return: an iterator over (lines, bulk) pairs, bulk is False if the block
+                 contains a comment character, thus the lines must be parsed one by one
+        """
+        while self._line_pos < len(self._lines) or self._read_block():
+            lines = self._lines[self._line_pos:self._line_pos + batch_size]
+            yield lines, not (self._block_has_comment and COMMENT_CHAR in ''.join(lines))
+
+    def _skip_lines(self, count):
+        """
+        Mark lines parsed in bulk as read.
+        :param count: number of lines
+        """
+        self._line_pos += count
+        self.line_number += count
+
+    def _parse_lines(self, lines):
+        """
+        Parse a batch of lines one by one, used for batches with comments, blank lines or errors.
+        :param lines: the lines, which must not have been read yet
+        :return: the rows of values
+        """
+        rows = []
+        for _ in xrange(len(lines)):
+            line = self._readline()
+            if len(line) > 0 and not Reader._is_comment(line):
+                rows.append(self._parse_row(line))
+        return rows
+
+    def write_cache(self):
+        """
+        Read all data lines and store them in the column cache of the file (see cache),
+        which is loaded instead of parsing the file when it is read again.
+        :return: ColumnCache
+        :raises: ParseError when data lines have been read already
+        """
+        if self.line_number != self._header_lines:
+            raise ParseError('the cache of {0} can only be written before data lines are read'.format(self.filename))
+        signature = file_signature(self.filename)
+        columns = self._cache_columns()
+        column_cache = ColumnCache(dict(self.header_info), list(self.column_definition), self.line_number, columns)
+        # a file modified while it was read is not cached
+        if file_signature(self.filename) == signature:
+            write_cache(self.filename, column_cache, signature)
+        return column_cache
+
+    def _cache_columns(self):
+        """
+        Read all data lines into the columns of a cache.
+        :return: a list of values for each column
+        """
+        rows = [row for batch in self.row_batches() for row in batch]
+        if len(rows) == 0:
+            return [[] for _ in self.column_definition]
+        return map(list, zip(*rows))
+
+    def _read_cache(self):
+        """
+        Load the data lines from the column cache, the reader is then at the end of the file.
+        :return: ColumnCache or None when there is no usable cache or data lines have been read already
+        """
+        if self.line_number != self._header_lines:
+            return None
+        try:
+            column_cache = read_cache(self.filename)
+        except ValueError:
+            # a corrupt cache is ignored, the file is parsed instead
+            return None
+        if column_cache is None or column_cache.column_definition != self.column_definition:
+            return None
+        self.line_number = column_cache.lines
+        self._lines = []
+        self._line_pos = 0
+        self._eof = True
+        return column_cache
 
     def get_info(self, key):
         """
@@ -352,7 +589,7 @@ class BinningWriter(Writer):
     Concrete class for CAMI binning format.
     """
 
-    def __init__(self, filename, overwrite=False):
+    def __init__(self, filename, overwrite=False, compression=None):
 
         binning_header_info = {
             TASK_KEY: BIN_TASK,
@@ -363,7 +600,16 @@ class BinningWriter(Writer):
         }
 
         super(BinningWriter, self).__init__(
-            filename, binning_header_info, BIN_COLUMN_DEFINITION, overwrite)
+            filename, binning_header_info, BIN_COLUMN_DEFINITION, overwrite, compression)
+
+    def write_columns(self, columns):
+        """
+        Write rows given by columns, see Writer.write_columns.
+        :param columns: a sequence of columns or BinningColumns
+        """
+        if isinstance(columns, BinningColumns):
+            columns = [columns.sequence_ids, columns.taxids, map(columns.bin_ids.__getitem__, columns.bin_codes)]
+        super(BinningWriter, self).write_columns(columns)
 
     def set_reference_based(self):
         """
@@ -391,6 +637,107 @@ class BinningReader(Reader):
     def __init__(self, filename):
         super(BinningReader, self).__init__(
             filename, BIN_TASK, BIN_VERSION_SUPPORT, BIN_MANDATORY_FIELDS, BIN_COLUMN_DEFINITION)
+        # BINID -> category code, shared by all batches of the reader
+        self._bin_index = {}
+        self.bin_ids = []
+
+    def _to_columns(self, sequence_ids, taxids, binids):
+        """
+        Convert a batch of values to columns.
+        :param sequence_ids: values of SEQUENCEID
+        :param taxids: values of TAXID
+        :param binids: values of BINID
+        :return: BinningColumns
+        :raises: FieldError when a TAXID is not an integer
+        """
+        try:
+            taxid_array = array(TAXID_TYPECODE, map(int, taxids))
+        except (ValueError, OverflowError):
+            for taxid in taxids:
+                try:
+                    array(TAXID_TYPECODE, [int(taxid)])
+                except (ValueError, OverflowError):
+                    raise FieldError('TAXID is not an integer [{0}] in the rows ending at line:{1}'
+                                     .format(taxid, self.line_number))
+            raise
+        for binid in set(binids).difference(self._bin_index):
+            self._bin_index[binid] = len(self.bin_ids)
+            self.bin_ids.append(binid)
+        return BinningColumns(map(intern, sequence_ids), taxid_array,
+                              array(BINCODE_TYPECODE, map(self._bin_index.__getitem__, binids)), self.bin_ids)
+
+    def _cache_columns(self):
+        columns = self.read_columns(use_cache=False)
+        return [columns.sequence_ids, columns.taxids, (columns.bin_codes, columns.bin_ids)]
+
+    def iter_batches(self, batch_size=BATCH_SIZE):
+        """
+        Iterator over data lines in columnar batches, see BinningColumns.
+        The category codes of BINID are the same across all batches of the reader.
+        :param batch_size: maximum number of rows in a batch
+        :return: an iterator over BinningColumns
+        """
+        columns = len(self.column_definition)
+        for lines, bulk in self._line_batches(batch_size):
+            if bulk:
+                # lines without surrounding white space and with non-empty fields can be split at once
+                text = DELIMITER.join(lines)
+                if not (DELIMITER * 2 in text or text.startswith(DELIMITER) or text.endswith(DELIMITER)
+                        or ' ' in text or '\r' in text or '\x0b' in text or '\x0c' in text):
+                    values = text.split(DELIMITER)
+                    if len(values) == columns * len(lines) \
+                            and min(map(str.count, lines, repeat(DELIMITER, len(lines)))) == columns - 1:
+                        self._skip_lines(len(lines))
+                        yield self._to_columns(values[0::columns], values[1::columns], values[2::columns])
+                        continue
+
+            rows = self._parse_lines(lines)
+            if len(rows) > 0:
+                yield self._to_columns(*zip(*rows))
+
+    def read_columns(self, use_cache=True):
+        """
+        Read all (remaining) data lines into columns, see BinningColumns.
+        :param use_cache: load the columns from the cache of the file if it is up to date (see write_cache)
+        :return: BinningColumns
+        """
+        column_cache = self._read_cache() if use_cache else None
+        if column_cache is not None:
+            sequence_ids, taxids, (bin_codes, bin_ids) = column_cache.columns
+            for binid in bin_ids:
+                self._bin_index[binid] = len(self.bin_ids)
+                self.bin_ids.append(binid)
+            return BinningColumns(sequence_ids, taxids, bin_codes, self.bin_ids)
+
+        columns = self._to_columns([], [], [])
+        for batch in self.iter_batches():
+            columns.sequence_ids.extend(batch.sequence_ids)
+            columns.taxids.extend(batch.taxids)
+            columns.bin_codes.extend(batch.bin_codes)
+        return columns
+
+
+class BinningColumns(object):
+    """
+    Binning rows stored by columns. The typed arrays support the buffer protocol,
+    e.g. numpy.frombuffer(columns.taxids, dtype=numpy.int64) doesn't copy them.
+
+    sequence_ids: list of SEQUENCEID, the strings parsed from text are interned, so
+        identifiers shared with other files or batches are stored only once (interning
+        would dominate the time to load a cache, thus cached identifiers are not interned)
+    taxids: array of TAXID (TAXID_TYPECODE)
+    bin_codes: array of BINID category codes (BINCODE_TYPECODE), bin_ids[code] is the BINID
+    bin_ids: list of BINID values in the order of their first occurrence
+    """
+
+    def __init__(self, sequence_ids, taxids, bin_codes, bin_ids):
+        self.sequence_ids = sequence_ids
+        self.taxids = taxids
+        self.bin_codes = bin_codes
+        self.bin_ids = bin_ids
+
+    def __len__(self):
+        return len(self.taxids)
 
 
 #
@@ -401,7 +748,7 @@ class ProfileWriter(Writer):
     """
     Concreate class for writing CAMI profiling format.
     """
-    def __init__(self, filename, overwrite=False):
+    def __init__(self, filename, overwrite=False, compression=None):
 
         profiling_header_info = {
             TASK_KEY: PRO_TASK,
@@ -410,7 +757,7 @@ class ProfileWriter(Writer):
         }
 
         super(ProfileWriter, self).__init__(
-            filename, profiling_header_info, PRO_COLUMN_DEFINITION, overwrite)
+            filename, profiling_header_info, PRO_COLUMN_DEFINITION, overwrite, compression)
 
 class ProfileReader(Reader):
     """
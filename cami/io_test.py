@@ -1,4 +1,10 @@
 import unittest
+import os
+import sys
+from array import array
+import io as cami_io
+import compression
+import cache
 from io import *
 
 
@@ -65,6 +71,194 @@ class TestBinningRead(unittest.TestCase):
         reader = ProfileReader('test-data/profile-valid.txt')
         self.assertEqual(12, len([r for r in reader]))
 
+    def test_compressed_file(self):
+        expected = [r for r in BinningReader('test-data/binning-valid.txt')]
+        for name in ['test-data/binning-valid.txt.gz', 'test-data/binning-valid.txt.bz2']:
+            self.assertEqual(expected, [r for r in BinningReader(name)])
+        compression.USE_EXTERNAL = False
+        try:
+            self.assertEqual(expected, [r for r in BinningReader('test-data/binning-valid.txt.bz2')])
+        finally:
+            compression.USE_EXTERNAL = True
+
+
+class TestBatchRead(unittest.TestCase):
+
+    def setUp(self):
+        with open('test-data/binning-valid.txt') as f:
+            self.header = f.read().split('@@')[0] + '@@' + '\t'.join(BIN_COLUMN_DEFINITION) + '\n'
+        self.block_size = cami_io.BLOCK_SIZE
+        self.tmp_files = []
+
+    def tearDown(self):
+        cami_io.BLOCK_SIZE = self.block_size
+        for name in self.tmp_files:
+            os.remove(name)
+
+    def _write(self, body):
+        name = 'test-data/binning-batch{0}-delete.txt'.format(len(self.tmp_files))
+        with open(name, 'w') as f:
+            f.write(self.header + body)
+        self.tmp_files.append(name)
+        return name
+
+    def _batch_rows(self, reader, batch_size):
+        return [r for batch in reader.row_batches(batch_size) for r in batch]
+
+    def test_batches_equal_rows(self):
+        body = ''.join('r{0}\t{1}\t{2}\n'.format(i, i % 7, i % 3) for i in range(100))
+        body += '# comment\n\n  \nlast\t1\t2'
+        name = self._write(body)
+        expected = [r for r in BinningReader(name)]
+        self.assertEqual(101, len(expected))
+        for block_size in [1, 7, 64, 1 << 20]:
+            cami_io.BLOCK_SIZE = block_size
+            for batch_size in [1, 5, 1000]:
+                self.assertEqual(expected, self._batch_rows(BinningReader(name), batch_size))
+
+        for reader_class, name in [(BinningReader, 'test-data/binning-valid.txt'),
+                                   (ProfileReader, 'test-data/profile-valid.txt')]:
+            self.assertEqual([r for r in reader_class(name)], self._batch_rows(reader_class(name), 3))
+
+    def test_many_comments(self):
+        name = self._write('# comment\n' * 10000 + 'r1\t1\t1\n')
+        self.assertEqual([['r1', '1', '1']], [r for r in BinningReader(name)])
+        self.assertEqual([['r1', '1', '1']], self._batch_rows(BinningReader(name), 100))
+
+    def test_columns_equal_rows(self):
+        body = ''.join('r{0}\t{1}\tb{2}\n'.format(i, i % 7, i % 3) for i in range(100))
+        body += '# comment\n\n  \nlast\t-1\tb9\n r x\t 5 \tb1'
+        name = self._write(body)
+        expected = [r for r in BinningReader(name)]
+        for block_size in [1, 7, 64, 1 << 20]:
+            cami_io.BLOCK_SIZE = block_size
+            for batch_size in [1, 5, 1000]:
+                reader = BinningReader(name)
+                batches = list(reader.iter_batches(batch_size))
+                self.assertEqual([(r[0], int(r[1]), r[2]) for r in expected],
+                                 [(b.sequence_ids[i], b.taxids[i], b.bin_ids[b.bin_codes[i]])
+                                  for b in batches for i in range(len(b))])
+                columns = BinningReader(name).read_columns()
+                self.assertEqual([r[0] for r in expected], list(columns.sequence_ids))
+                self.assertEqual([int(r[1]) for r in expected], columns.taxids.tolist())
+                self.assertEqual(['b0', 'b1', 'b2', 'b9'], sorted(columns.bin_ids))
+                self.assertEqual([r[2] for r in expected], [columns.bin_ids[c] for c in columns.bin_codes])
+
+    def test_columns_bad_taxid(self):
+        for taxid in ['x', '1.5', '', '99999999999999999999']:
+            name = self._write('r1\t1\t1\n' * 50 + 'r2\t{0}\t1\n'.format(taxid))
+            with self.assertRaises(FieldError):
+                BinningReader(name).read_columns()
+
+    def test_bad_row_line_number(self):
+        name = self._write('r1\t1\t1\n' * 50 + 'r2\t1\n')
+        line_number = self.header.count('\n') + 51
+        for batch_size in [1, 10, 1000]:
+            reader = BinningReader(name)
+            with self.assertRaises(FieldError) as cm:
+                self._batch_rows(reader, batch_size)
+            self.assertEqual(line_number, reader.line_number)
+            self.assertIn('line:{0} '.format(line_number), str(cm.exception))
+
+    def test_truncated_compressed_file(self):
+        with open('test-data/binning-valid.txt.gz', 'rb') as f:
+            data = f.read()
+        name = 'test-data/binning-batch-delete.txt.gz'
+        with open(name, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        self.tmp_files.append(name)
+        with self.assertRaises(IOError):
+            BinningReader(name).read_columns()
+
+    def test_pipe_with_long_stderr(self):
+        # more warnings than a pipe buffer holds must not block the reader
+        script = "import sys; sys.stderr.write('w' * 1000000); sys.stdout.write('data'); sys.exit({0})"
+        with compression.PipeFile([sys.executable, '-c', script.format(0)]) as f:
+            self.assertEqual('data', f.read())
+        with compression.PipeFile([sys.executable, '-c', script.format(1)]) as f:
+            with self.assertRaises(IOError) as cm:
+                list(f)
+            self.assertIn('w' * 100, str(cm.exception))
+        name = 'test-data/binning-pipe-delete.txt'
+        self.tmp_files.append(name)
+        writer = compression.PipeWriter([sys.executable, '-c', script.format(0)], name)
+        writer.write('input')
+        writer.close()
+        with open(name) as f:
+            self.assertEqual('data', f.read())
+
+    def test_bad_header_closes_input(self):
+        name = 'test-data/binning-no-task-delete.txt.gz'
+        self.tmp_files.append(name)
+        with open('test-data/binning-no-task.txt', 'rb') as f:
+            with compression.open_output(name, 'gzip') as output:
+                output.write(f.read())
+        handles = []
+
+        def open_input(filename):
+            handles.append(compression.open_input(filename))
+            return handles[-1]
+
+        cami_io.open_input = open_input
+        try:
+            with self.assertRaises(HeaderError):
+                BinningReader(name)
+        finally:
+            cami_io.open_input = compression.open_input
+        self.assertEqual(1, len(handles))
+        if isinstance(handles[0], compression.PipeFile):
+            # the decompression program has exited
+            self.assertIsNotNone(handles[0].process.returncode)
+            self.assertTrue(handles[0].stdout.closed)
+        else:
+            self.assertIsNone(handles[0].fileobj)  # closed gzip.GzipFile
+
+    def test_column_cache(self):
+        body = ''.join('r{0}\t{1}\tb{2}\n'.format(i, i % 7, i % 3) for i in range(100)) + '# comment\nlast\t-1\tb9'
+        name = self._write(body)
+        self.tmp_files.append(name + cache.CACHE_SUFFIX)
+        expected = BinningReader(name).read_columns()
+        written = BinningReader(name).write_cache()
+        self.assertEqual(len(expected), len(written))
+        reader = BinningReader(name)
+        columns = reader.read_columns()
+        self.assertEqual(expected.sequence_ids, columns.sequence_ids)
+        self.assertEqual(expected.taxids, columns.taxids)
+        self.assertEqual([expected.bin_ids[c] for c in expected.bin_codes],
+                         [columns.bin_ids[c] for c in columns.bin_codes])
+        self.assertEqual(self.header.count('\n') + 102, reader.line_number)
+        self.assertIsNotNone(cache.read_cache(name))
+
+        # data lines were read already
+        reader = BinningReader(name)
+        reader.next()
+        with self.assertRaises(ParseError):
+            reader.write_cache()
+        self.assertEqual(len(expected) - 1, len(reader.read_columns(use_cache=True)))
+
+        # the cache of a modified file is not used
+        with open(name, 'a') as f:
+            f.write('\nr100\t1\tb1\n')
+        self.assertIsNone(cache.read_cache(name))
+        self.assertEqual(len(expected) + 1, len(BinningReader(name).read_columns()))
+
+        # a corrupt cache is ignored
+        BinningReader(name).write_cache()
+        with open(name + cache.CACHE_SUFFIX, 'r+b') as f:
+            f.truncate(os.path.getsize(name + cache.CACHE_SUFFIX) - 10)
+        with self.assertRaises(ValueError):
+            cache.read_cache(name)
+        self.assertEqual(len(expected) + 1, len(BinningReader(name).read_columns()))
+
+    def test_profile_cache(self):
+        name = 'test-data/profile-valid.txt'
+        try:
+            rows = [r for r in ProfileReader(name)]
+            self.assertEqual(map(list, zip(*rows)), ProfileReader(name).write_cache().columns)
+            self.assertEqual(map(list, zip(*rows)), cache.read_cache(name).columns)
+        finally:
+            os.remove(name + cache.CACHE_SUFFIX)
+
 
 class TestBinningWrite(unittest.TestCase):
 
@@ -113,4 +307,40 @@ class TestBinningWrite(unittest.TestCase):
 
         with self.assertRaises(FieldError):
             with ProfileWriter('test-data/profile-delete.txt', overwrite=True) as writer:
-                writer.writerow([99] * 20)
\ No newline at end of file
+                writer.writerow([99] * 20)
+
+        with self.assertRaises(FieldError):
+            with BinningWriter('test-data/binning-delete.txt', overwrite=True) as writer:
+                writer.writerows(self.bin_rows + [[99] * 20])
+
+        with self.assertRaises(FieldError):
+            with BinningWriter('test-data/binning-delete.txt', overwrite=True) as writer:
+                writer.write_columns([['r1'], [1]])
+
+    def _write_bin_rows(self, name, write, output_compression=None):
+        with BinningWriter(name, overwrite=True, compression=output_compression) as writer:
+            write(writer)
+        with compression.open_input(name) as f:
+            return f.read()
+
+    def test_batch_write_equals_rows(self):
+        rows = self.bin_rows * 1000
+        name = 'test-data/binning-delete.txt'
+        expected = self._write_bin_rows(name, lambda writer: [writer.writerow(r) for r in rows])
+        self.assertEqual(expected, self._write_bin_rows(name, lambda writer: writer.writerows(iter(rows))))
+        columns = [[r[0] for r in rows], array('l', [int(r[1]) for r in rows]), [r[2] for r in rows]]
+        self.assertEqual(expected, self._write_bin_rows(name, lambda writer: writer.write_columns(columns)))
+        bin_ids = sorted(set(columns[2]))
+        binning_columns = BinningColumns(columns[0], columns[1],
+                                         array('i', map(bin_ids.index, columns[2])), bin_ids)
+        self.assertEqual(expected, self._write_bin_rows(name, lambda writer: writer.write_columns(binning_columns)))
+
+        for output_compression in ['gzip', 'bzip2']:
+            self.assertEqual(expected, self._write_bin_rows(name, lambda writer: writer.writerows(rows),
+                                                            output_compression))
+        name = 'test-data/binning-delete.txt.gz'
+        try:
+            self.assertEqual(expected, self._write_bin_rows(name, lambda writer: writer.writerows(rows)))
+            self.assertEqual('gzip', compression.detect_compression(name))
+        finally:
+            os.remove(name)
@@ -0,0 +1,427 @@
+"""
+Validation module
+
+This module validates CAMI files in a streaming fashion. Unlike iterating a
+Reader, which stops at the first error, it checks all data lines and reports
+the counts and the first errors.
+
+Checks:
+
+    Header, as the Reader does.
+
+    Number of fields of each data line.
+
+    Integer columns, e.g. TAXID.
+
+    Duplicate identifiers, e.g. SEQUENCEID of a binning file.
+
+After the header is read, the body is split into shards, byte ranges that
+begin and end at line boundaries. The shards are validated by a pool of
+processes (or one after the other) and their counts and errors are merged,
+the line numbers of the errors refer to the whole file. A compressed file is
+decompressed on the fly and validated as a single shard.
+
+Memory does not grow with the number of data lines, except for the candidate
+duplicates: identifiers are added to a fixed size hash filter shared by all
+shards and only those that hit it are kept and checked exactly in a second
+pass over the file.
+
+"""
+import os.path
+import sys
+import mmap
+import operator
+import multiprocessing
+from itertools import compress, repeat
+
+from compression import open_input, detect_compression
+from io import BinningReader, ProfileReader, COMMENT_CHAR, DELIMITER, ParseError, BLOCK_SIZE, BATCH_SIZE
+
+# file type -> reader class, identifier column that must be unique (or None), integer columns
+FILE_TYPES = {
+    'binning': (BinningReader, 'SEQUENCEID', ['TAXID']),
+    'profile': (ProfileReader, None, ['TAXID'])
+}
+
+MAX_ERRORS = 10
+DUPLICATE_FILTER_SIZE = 1 << 27  # 128MB, at most one byte per byte of the file is used
+SHARDS_PER_JOB = 4
+
+# state of a running validation, the forked worker processes inherit it
+_task = None
+
+
+class DuplicateFilter(object):
+    """
+    Bloom-style filter of identifiers, each identifier marks two slots of a byte
+    table chosen by its hash. An identifier reported as seen may be a false
+    positive, thus it is only a candidate duplicate.
+
+    The table is an anonymous shared memory map, thus processes forked after the
+    filter was created add to the same filter. The slots of a batch are tested
+    and marked under the lock (if given), thus an identifier repeated in two
+    processes is always reported by one of them.
+    """
+
+    def __init__(self, size=DUPLICATE_FILTER_SIZE, lock=None):
+        """
+        :param size: number of slots, a power of two
+        :param lock: lock shared by the processes that use the filter (or None)
+        """
+        if size <= 0 or size & (size - 1) != 0:
+            raise ValueError('size of the filter must be a power of two: {0}'.format(size))
+        self.mask = size - 1
+        self.table = mmap.mmap(-1, size)
+        self.lock = lock
+
+    def add(self, keys):
+        """
+        Add a batch of identifiers to the filter.
+        :param keys: the identifiers
+        :return: the identifiers that may have been added before (including repeats within the batch)
+        """
+        hashes = map(hash, keys)
+        slots1 = map(operator.and_, hashes, repeat(self.mask, len(hashes)))
+        slots2 = map(operator.and_, map(operator.rshift, hashes, repeat(32, len(hashes))),
+                     repeat(self.mask, len(hashes)))
+        get = self.table.__getitem__
+        set_slot = self.table.__setitem__
+        if self.lock is not None:
+            self.lock.acquire()
+        try:
+            hits = map(operator.and_, map(operator.ne, map(get, slots1), repeat('\0', len(slots1))),
+                       map(operator.ne, map(get, slots2), repeat('\0', len(slots2))))
+            map(set_slot, slots1, repeat('\1', len(slots1)))
+            map(set_slot, slots2, repeat('\1', len(slots2)))
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+        seen = list(compress(keys, hits))
+        if len(set(keys)) != len(keys):
+            unique = set()
+            seen.extend(key for key in keys if key in unique or unique.add(key))
+        return seen
+
+    def close(self):
+        self.table.close()
+
+
+class ValidationResult(object):
+    """
+    Counts and the first errors found by validate().
+    """
+
+    def __init__(self, filename, max_errors):
+        self.filename = filename
+        self.max_errors = max_errors
+        self.header_info = {}
+        self.column_definition = []
+        self.lines = 0
+        self.rows = 0
+        self.field_errors = 0
+        self.integer_errors = 0
+        self.duplicates = 0
+        self.header_error = None
+        # the first errors of the data lines as (line number, message), ordered by line number
+        self.errors = []
+
+    def add_error(self, line_number, message):
+        """
+        Record an error, only the first max_errors errors are kept.
+        :param line_number: line of the error
+        :param message: description of the error
+        """
+        if len(self.errors) < self.max_errors or line_number < self.errors[-1][0]:
+            self.errors.append((line_number, message))
+            self.errors.sort()
+            del self.errors[self.max_errors:]
+
+    def merge(self, shard, first_line):
+        """
+        Add the counts and errors of a shard.
+        :param shard: ValidationResult of a shard, its line numbers are relative to the shard
+        :param first_line: line number of the first line of the shard
+        """
+        self.lines += shard.lines
+        self.rows += shard.rows
+        self.field_errors += shard.field_errors
+        self.integer_errors += shard.integer_errors
+        self.duplicates += shard.duplicates
+        for line_number, message in shard.errors:
+            self.add_error(first_line + line_number - 1, message)
+
+    def error_count(self):
+        """
+        :return: total number of errors
+        """
+        return (1 if self.header_error is not None else 0) + self.field_errors + self.integer_errors \
+            + self.duplicates
+
+    def is_valid(self):
+        """
+        :return: True if no error was found
+        """
+        return self.error_count() == 0
+
+
+def _line_batches(filename, start, end):
+    """
+    Iterator over the lines of a byte range of a file in batches.
+    :param filename: the file
+    :param start: offset of the first line
+    :param end: offset after the last line or None for the end of the file
+    :return: an iterator over (line number of the first line within the range, lines) pairs
+    """
+    line_number = 1
+    tail = ''
+    with open_input(filename) as f:
+        if end is None:
+            # a compressed file cannot seek, its body is a single range up to the end
+            while start > 0:
+                skipped = len(f.read(min(BLOCK_SIZE, start)))
+                start = start - skipped if skipped > 0 else 0
+            remaining = sys.maxint
+        else:
+            f.seek(start)
+            remaining = end - start
+        while remaining > 0 or len(tail) > 0:
+            data = f.read(min(BLOCK_SIZE, remaining))
+            remaining -= len(data)
+            if len(data) == 0:
+                lines = [tail] if len(tail) > 0 else []
+                tail = ''
+                remaining = 0
+            else:
+                lines = (tail + data).split('\n')
+                tail = lines.pop()
+            for i in xrange(0, len(lines), BATCH_SIZE):
+                batch = lines[i:i + BATCH_SIZE]
+                yield line_number, batch
+                line_number += len(batch)
+
+
+def _data_columns(line_batches, columns, result=None):
+    """
+    Iterator over the data lines in batches, blank and comment lines are skipped.
+    The lines are counted and lines with an incorrect number of fields are reported
+    to the result (if given) and skipped.
+    :param line_batches: iterator over (line number of the first line, lines) pairs
+    :param columns: number of columns
+    :param result: ValidationResult or None
+    :return: an iterator over (line numbers, columns) pairs, a column is a list of values
+    """
+    for first_line, lines in line_batches:
+        if result is not None:
+            result.lines += len(lines)
+        lines = map(str.strip, lines)
+        line_numbers = range(first_line, first_line + len(lines))
+        if '' in lines or COMMENT_CHAR in ''.join(lines):
+            data = [(n, line) for n, line in zip(line_numbers, lines)
+                    if len(line) > 0 and not line.startswith(COMMENT_CHAR)]
+            line_numbers = [n for n, line in data]
+            lines = [line for n, line in data]
+        if len(lines) == 0:
+            continue
+        if result is not None:
+            result.rows += len(lines)
+
+        fields = map(str.count, lines, repeat(DELIMITER, len(lines)))
+        if min(fields) == columns - 1 == max(fields):
+            # all lines are split at once
+            values = DELIMITER.join(lines).split(DELIMITER)
+            yield line_numbers, [values[i::columns] for i in range(columns)]
+            continue
+
+        good = map(operator.eq, fields, repeat(columns - 1, len(fields)))
+        for n, line, count, ok in zip(line_numbers, lines, fields, good):
+            if not ok and result is not None:
+                result.field_errors += 1
+                result.add_error(n, 'incorrect number of fields {0} (expected {1}) [{2}]'
+                                 .format(count + 1, columns, line))
+        line_numbers = list(compress(line_numbers, good))
+        rows = [line.split(DELIMITER) for line in compress(lines, good)]
+        if len(rows) > 0:
+            yield line_numbers, map(list, zip(*rows))
+
+
+def _is_integer(value):
+    try:
+        int(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _shards(filename, start, count):
+    """
+    Split a file into byte ranges of about the same size that begin and end at line boundaries.
+    :param filename: the file
+    :param start: offset where the first range begins
+    :param count: number of ranges
+    :return: list of (start, end) pairs
+    """
+    size = os.path.getsize(filename)
+    bounds = [start]
+    with open(filename, 'r') as f:
+        for i in range(1, count):
+            pos = max(start + (size - start) * i // count, bounds[-1] + 1)
+            # the range ends after the first end of line at or after pos - 1
+            f.seek(pos - 1)
+            while True:
+                data = f.read(65536)
+                if len(data) == 0:
+                    pos = size
+                    break
+                idx = data.find('\n')
+                if idx != -1:
+                    pos += idx
+                    break
+                pos += len(data)
+            if pos >= size:
+                break
+            bounds.append(pos)
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+class _ValidationTask(object):
+    """
+    What the shards are validated for, shared with the worker processes.
+    """
+
+    def __init__(self, result, integer_pos, unique_pos, shards, duplicate_filter):
+        self.filename = result.filename
+        self.max_errors = result.max_errors
+        self.column_definition = result.column_definition
+        self.integer_pos = integer_pos
+        self.unique_pos = unique_pos
+        self.shards = shards
+        self.duplicate_filter = duplicate_filter
+        self.candidates = None
+
+
+def _validate_shard(shard_idx):
+    """
+    First pass over a shard, checks the number of fields and the integer columns
+    and adds the identifiers to the duplicate filter.
+    :param shard_idx: index of the shard
+    :return: ValidationResult of the shard (line numbers relative to the shard), candidate duplicates
+    """
+    task = _task
+    start, end = task.shards[shard_idx]
+    result = ValidationResult(task.filename, task.max_errors)
+    candidates = set()
+    for line_numbers, values in _data_columns(_line_batches(task.filename, start, end),
+                                              len(task.column_definition), result):
+        for pos in task.integer_pos:
+            # plain decimal numbers are checked at once
+            if not ''.join(values[pos]).isdigit():
+                for n, value in zip(line_numbers, values[pos]):
+                    if not _is_integer(value):
+                        result.integer_errors += 1
+                        result.add_error(n, '{0} is not an integer [{1}]'
+                                         .format(task.column_definition[pos], value))
+        if task.unique_pos is not None:
+            candidates.update(task.duplicate_filter.add(values[task.unique_pos]))
+    return result, candidates
+
+
+def _find_candidates(shard_idx):
+    """
+    Second pass over a shard, finds the exact occurrences of the candidate duplicates.
+    :param shard_idx: index of the shard
+    :return: list of (line number relative to the shard, identifier)
+    """
+    task = _task
+    start, end = task.shards[shard_idx]
+    occurrences = []
+    for line_numbers, values in _data_columns(_line_batches(task.filename, start, end),
+                                              len(task.column_definition)):
+        keys = values[task.unique_pos]
+        hits = map(task.candidates.__contains__, keys)
+        occurrences.extend(zip(compress(line_numbers, hits), compress(keys, hits)))
+    return occurrences
+
+
+def _run(func, count, jobs):
+    """
+    Call func(shard_idx) for all shards using a pool of jobs processes.
+    :return: list of results in the order of the shards
+    """
+    if jobs <= 1 or count <= 1:
+        return map(func, range(count))
+    pool = multiprocessing.Pool(min(jobs, count))
+    try:
+        return pool.map(func, range(count), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def validate(filename, file_type, max_errors=MAX_ERRORS, duplicate_filter_size=DUPLICATE_FILTER_SIZE, jobs=1):
+    """
+    Validate a CAMI file in a streaming fashion.
+    :param filename: the file to validate
+    :param file_type: a key of FILE_TYPES
+    :param max_errors: number of errors reported in detail
+    :param duplicate_filter_size: maximum size (in bytes) of the filter used to find duplicate identifiers
+    :param jobs: number of processes, the body is split into SHARDS_PER_JOB shards per process
+                 (the body of a compressed file is a single shard)
+    :return: ValidationResult
+    """
+    global _task
+    reader_class, unique_column, integer_columns = FILE_TYPES[file_type]
+    result = ValidationResult(filename, max_errors)
+    try:
+        reader = reader_class(filename)
+    except ParseError as e:
+        result.header_error = str(e)
+        return result
+    with reader:
+        result.header_info = dict(reader.header_info)
+        result.column_definition = list(reader.column_definition)
+        header_lines = reader.line_number
+        body_offset = reader.tell()
+
+    duplicate_filter = None
+    unique_pos = None
+    if unique_column is not None:
+        unique_pos = result.column_definition.index(unique_column)
+        size = 1 << 13
+        while size < duplicate_filter_size and size < os.path.getsize(filename):
+            size <<= 1
+        duplicate_filter = DuplicateFilter(size, multiprocessing.Lock() if jobs > 1 else None)
+
+    if detect_compression(filename) is None:
+        shards = _shards(filename, body_offset, 1 if jobs <= 1 else jobs * SHARDS_PER_JOB)
+    else:
+        shards = [(body_offset, None)]
+    assert _task is None, 'validation: validations cannot be nested'
+    _task = _ValidationTask(result, [result.column_definition.index(c) for c in integer_columns],
+                            unique_pos, shards, duplicate_filter)
+    try:
+        # line number of the first line of each shard
+        first_lines = []
+        candidates = set()
+        for shard_result, shard_candidates in _run(_validate_shard, len(shards), jobs):
+            first_lines.append(header_lines + result.lines + 1)
+            result.merge(shard_result, first_lines[-1])
+            candidates.update(shard_candidates)
+
+        if len(candidates) > 0:
+            _task.candidates = candidates
+            first_line = {}
+            for shard_first_line, occurrences in zip(first_lines, _run(_find_candidates, len(shards), jobs)):
+                for line_number, key in occurrences:
+                    line_number += shard_first_line - 1
+                    if key in first_line:
+                        result.duplicates += 1
+                        result.add_error(line_number, 'duplicate {0} [{1}] first seen at line:{2}'
+                                         .format(unique_column, key, first_line[key]))
+                    else:
+                        first_line[key] = line_number
+    finally:
+        _task = None
+        if duplicate_filter is not None:
+            duplicate_filter.close()
+    return result
@@ -0,0 +1,85 @@
+import unittest
+import os
+from validation import *
+
+
+class TestValidation(unittest.TestCase):
+
+    def setUp(self):
+        with open('test-data/binning-valid.txt') as f:
+            self.header = f.read().split('@@')[0] + '@@SEQUENCEID\tTAXID\tBINID\n'
+        self.header_lines = self.header.count('\n')
+        self.tmp_files = []
+
+    def tearDown(self):
+        for name in self.tmp_files:
+            os.remove(name)
+
+    def _write(self, body):
+        name = 'test-data/binning-validation{0}-delete.txt'.format(len(self.tmp_files))
+        with open(name, 'w') as f:
+            f.write(self.header + body)
+        self.tmp_files.append(name)
+        return name
+
+    def test_valid_files(self):
+        result = validate('test-data/binning-valid.txt', 'binning')
+        self.assertTrue(result.is_valid())
+        self.assertEqual(5, result.rows)
+        self.assertEqual('binning', result.header_info['task'])
+
+        result = validate('test-data/profile-valid.txt', 'profile')
+        self.assertTrue(result.is_valid())
+        self.assertEqual(12, result.rows)
+
+    def test_header_error(self):
+        result = validate('test-data/binning-no-task.txt', 'binning')
+        self.assertFalse(result.is_valid())
+        self.assertIsNotNone(result.header_error)
+        self.assertEqual(0, result.rows)
+
+    def test_all_errors_counted(self):
+        body = ''.join('r{0}\t{0}\t1\n'.format(i) for i in range(1000))
+        body += 'bad\t1\n# comment\n\nr5\t5\t1\nr1001\tx\t1\nr1002\t-3\t1\n'
+        result = validate(self._write(body), 'binning', max_errors=2)
+        self.assertEqual(1004, result.rows)
+        self.assertEqual(1, result.field_errors)
+        self.assertEqual(1, result.integer_errors)
+        self.assertEqual(1, result.duplicates)
+        self.assertEqual(3, result.error_count())
+        first = self.header_lines + 1001
+        self.assertEqual([first, first + 3], [n for n, message in result.errors])
+        self.assertIn('r5', validate(self._write(body), 'binning').errors[1][1])
+
+    def test_compressed_file(self):
+        expected = validate('test-data/binning-valid.txt', 'binning')
+        for name in ['test-data/binning-valid.txt.gz', 'test-data/binning-valid.txt.bz2']:
+            result = validate(name, 'binning', jobs=2)
+            self.assertTrue(result.is_valid())
+            self.assertEqual((expected.lines, expected.rows), (result.lines, result.rows))
+
+    def test_shards(self):
+        body = ''.join('r{0}\t{1}\t1\n'.format(i % 700, 'x' if i % 97 == 0 else i) for i in range(1000))
+        body += '# comment\n\nbad\t1\nr5\t5\t1'
+        name = self._write(body)
+        expected = validate(name, 'binning', max_errors=50)
+        for jobs in [2, 3]:
+            result = validate(name, 'binning', max_errors=50, jobs=jobs)
+            self.assertEqual(expected.errors, result.errors)
+            self.assertEqual((1002, 1, 11, 301), (result.rows, result.field_errors, result.integer_errors,
+                                                   result.duplicates))
+
+    def test_duplicates(self):
+        body = ''.join('r{0}\t1\t1\n'.format(i % 300) for i in range(1000))
+        result = validate(self._write(body), 'binning')
+        self.assertEqual(700, result.duplicates)
+        self.assertEqual(self.header_lines + 301, result.errors[0][0])
+
+    def test_filter_candidates(self):
+        # every identifier collides in a filter of a single slot
+        seen = DuplicateFilter(1)
+        self.assertEqual([], seen.add(['a']))
+        self.assertEqual(set(['b']), set(seen.add(['b', 'b'])))
+        seen = DuplicateFilter(1 << 16)
+        self.assertEqual([], seen.add(['r{0}'.format(i) for i in range(100)]))
+        self.assertEqual(['r1'], seen.add(['x', 'r1']))
@@ -3,14 +3,62 @@
 A simple tool for validating CAMI file formats.
 """
 import cami.io
+import cami.cache
+import cami.validation
 import argparse
 import sys
 
 parser = argparse.ArgumentParser(description='A simple tool for validating CAMI file formats.')
 parser.add_argument('input_file', help='The file to validate')
 parser.add_argument('-t', '--type', help='File type [binning, profile]', required=True, nargs=1)
+parser.add_argument('-s', '--streaming', action='store_true',
+                    help='Check all data lines in constant memory (field count, integer TAXID, duplicate '
+                         'SEQUENCEID) without printing them, report counts and the first errors')
+parser.add_argument('-m', '--max-errors', type=int, default=cami.validation.MAX_ERRORS,
+                    help='Number of errors reported in the streaming mode (default: %(default)s)')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='Number of processes that validate parts of the file in the streaming mode '
+                         '(implies --streaming, default: %(default)s)')
+parser.add_argument('-c', '--write-cache', action='store_true',
+                    help='Store the parsed columns of a valid file in a binary cache next to it ({0}), which '
+                         'the readers load instead of parsing the file again'.format(cami.cache.CACHE_SUFFIX))
 args = parser.parse_args()
 
+
+def write_cache(reader_class):
+    with reader_class(args.input_file) as reader:
+        rows = len(reader.write_cache())
+    print 'Wrote the column cache of {0} data rows: {1}'.format(rows, cami.cache.cache_filename(args.input_file))
+
+
+def validate_streaming():
+    result = cami.validation.validate(args.input_file, args.type[0], args.max_errors, jobs=args.jobs)
+    if result.header_error is not None:
+        print 'Header error: {0}'.format(result.header_error)
+    else:
+        print 'Header information:'
+        for k, v in result.header_info.iteritems():
+            print '{0}={1}'.format(k, v)
+        print
+        print 'Data fields:'
+        print result.column_definition
+        print
+    print 'Read {0} data rows.'.format(result.rows)
+    print 'Errors: {0} (header: {1}, number of fields: {2}, integer format: {3}, duplicates: {4})'.format(
+        result.error_count(), 0 if result.header_error is None else 1, result.field_errors,
+        result.integer_errors, result.duplicates)
+    for line_number, message in result.errors:
+        print 'line:{0} {1}'.format(line_number, message)
+    more = result.field_errors + result.integer_errors + result.duplicates - len(result.errors)
+    if more > 0:
+        print '... {0} more errors'.format(more)
+    if result.is_valid():
+        print 'VALIDATION OK.'
+    else:
+        print 'VALIDATION FAILED.'
+        sys.exit(1)
+
+
 try:
     reader_class = None
     if args.type[0] == 'binning':
@@ -22,19 +70,26 @@ try:
     else:
         raise RuntimeError('Unknown file type {0}'.format(args.type))
 
+    if args.streaming or args.jobs > 1:
+        validate_streaming()
+        if args.write_cache:
+            write_cache(reader_class)
+        sys.exit(0)
+
     with reader_class(args.input_file) as reader:
         print 'Header information:'
         reader.print_headerinfo(sys.stderr)
         print
         print 'Data fields:'
         print >> sys.stderr, reader.column_definition
-        mr = []
+        nrow = 0
         for nrow, row in enumerate(reader, start=1):
             print >> sys.stderr, row
-            mr.append(row)
         print
         print 'Read {0} data rows, check that this is correct.'.format(nrow)
         print 'VALIDATION OK.'
+    if args.write_cache:
+        write_cache(reader_class)
 
 except IOError as e:
     print 'VALIDATION FAILED.'